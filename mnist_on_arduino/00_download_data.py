@@ -4,7 +4,8 @@
 # Email:    richard.freitag@uadm.uu.se
 # Created:  26.07.2019
 #
-# Revisions: ---
+# Revisions: 18.10.2026 - streaming, resumable and verified download (artifacts.py)
+#            18.10.2026 - archive verified against the md5 of the zenodo record by default
 #
 # Description: This script downloads the MNIST dataset of hand written digits
 #              and saves them in a hdf5 file.
@@ -12,18 +13,55 @@
 #              by a max pooling operation of 2x2 windows with stride 2.
 #              The smaller images are saved in a separate hdf5 file.
 #
+#              The archive is streamed to disk, an interrupted download is
+#              resumed and the checksum is verified (see "artifacts.py"). By
+#              default it is the md5 published in the zenodo record, "none"
+#              skips the verification. Only the files needed by the other
+#              scripts are extracted. If they were already extracted and
+#              verified nothing is downloaded.
+#
+#              Usage: python 00_download_data.py [--url URL] [--checksum md5:<hex>|published|none]
+#                                                [--members PATTERN ...] [--deep]
+#
 ################################################################################
 
-import requests
-import zipfile
-import os
+import argparse
+
+import artifacts
 
 url = 'https://zenodo.org/record/3351382/files/mnist_on_arduino.zip'
-r = requests.get(url, allow_redirects=True)
-open('mnist_on_arduino.zip', 'wb').write(r.content)
-
-with zipfile.ZipFile('mnist_on_arduino.zip', 'r') as zip_ref:
-    zip_ref.extractall('.')
-    
-os.remove('mnist_on_arduino.zip')
-print("Done...")
\ No newline at end of file
+record_url = 'https://zenodo.org/api/records/3351382'
+
+# checksum of the archive as "<algorithm>:<hex digest>", "published" for the md5 listed
+# in the zenodo record, "none" only reports the sha256 checksum of the downloaded archive
+checksum = "published"
+
+# files used by the other scripts (glob patterns of archive members)
+members = ["mnist_small.h5",
+           "trained_models/small_mnist_model.h5",
+           "trained_models/fixedpoint_mnist_model.h5",
+           "Raw_Photos/*.jpg"]
+
+parser = argparse.ArgumentParser(description="Download the dataset and model archive")
+parser.add_argument("--url", default=url)
+parser.add_argument("--checksum", default=checksum)
+parser.add_argument("--record", default=record_url, help="zenodo record listing the published checksum")
+parser.add_argument("--members", nargs="+", default=members, help="archive members to extract, '*' for all")
+parser.add_argument("--dest", default=".")
+parser.add_argument("--keep-archive", action="store_true")
+parser.add_argument("--deep", action="store_true", help="check the CRCs of already extracted files")
+args = parser.parse_args()
+
+checksum = args.checksum
+if checksum.lower() == "none":
+    checksum = None
+elif checksum == "published":
+    # the marker of files extracted earlier holds the checksum they were verified with
+    checksum = None if artifacts.verified(args.dest, None, args.members, args.deep) else \
+        artifacts.published_checksum(args.record, 'mnist_on_arduino.zip')
+
+if artifacts.fetch(args.url, 'mnist_on_arduino.zip', args.dest, checksum, args.members,
+                   args.keep_archive, args.deep):
+    print("Done...")
+else:
+    print("Already downloaded and verified")
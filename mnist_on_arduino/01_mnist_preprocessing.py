@@ -4,21 +4,40 @@
 # Email:    michael.rinderle@tum.de
 # Created:  26.04.2019
 #
-# Revisions: ---
+# Revisions: 18.10.2026 - vectorized, chunked dataset builder (dataset_builder.py)
+#            18.10.2026 - command line options, tensorflow imported only for the download
+#            18.10.2026 - binarized 14x14 dataset
 #
 # Description: This script downloads the MNIST dataset of hand written digits
 #              and saves them in a hdf5 file.
 #              It also reduces the image size from 28x28 pixels to 14x14 pixels
 #              by a max pooling operation of 2x2 windows with stride 2.
 #              The smaller images are saved in a separate hdf5 file.
+#              Additionally a 7x7 pixel version is created by 4x4 max pooling.
+#              The binarized 14x14 dataset (pixels >= threshold are 255, all
+#              others 0) is used for the 1 bit per pixel network, see
+#              "03_mnist_small_training.py --binary".
+#
+#              Usage: python 01_mnist_preprocessing.py [--output mnist.h5]
+#                     (or python cli.py preprocess ...)
 #
 ################################################################################
 
 
-import h5py
-import numpy as np
+import argparse
+
+import dataset_builder
+from fixedpoint import BINARY_THRESHOLD
 
-import tensorflow as tf
+parser = argparse.ArgumentParser(description="Download MNIST and create the 14x14 and 7x7 datasets")
+parser.add_argument("--output", default="mnist.h5", help="28x28 dataset")
+parser.add_argument("--small", default="mnist_small.h5", help="14x14 dataset (2x2 max pooling)")
+parser.add_argument("--tiny", default="mnist_tiny.h5", help="7x7 dataset (4x4 max pooling)")
+parser.add_argument("--small-binary", default="mnist_small_binary.h5", help="binarized 14x14 dataset")
+parser.add_argument("--threshold", type=int, default=BINARY_THRESHOLD, help="threshold of the binarized dataset")
+args = parser.parse_args()
+
+# tensorflow is only needed for the download of the MNIST dataset
 from tensorflow import keras
 
 # download MNIST dataset
@@ -27,33 +46,13 @@ mnist = keras.datasets.mnist
 
 
 # save dataset to hdf5 file
-with h5py.File("mnist.h5", "w") as file:
-    file.create_dataset("train_images", data=train_images)
-    file.create_dataset("train_labels", data=train_labels)
-    file.create_dataset("test_images", data=test_images)
-    file.create_dataset("test_labels", data=test_labels)
-
-
-# make images smaller  (28x28 --> 14x14)
-pic_size = 14
-
-train_small = np.zeros((len(train_images), pic_size, pic_size), dtype=np.uint8)
-test_small = np.zeros((len(test_images), pic_size, pic_size), dtype=np.uint8)
-
-for pic in range(len(train_images)):
-    for i in range(0, pic_size):
-        for j in range(0, pic_size):
-            train_small[pic, i, j] = np.max(train_images[pic, 2 * i:2 * i + 2, 2 * j:2 * j + 2])
-
-for pic in range(len(test_images)):
-    for i in range(0, pic_size):
-        for j in range(0, pic_size):
-            test_small[pic, i, j] = np.max(test_images[pic, 2 * i:2 * i + 2, 2 * j:2 * j + 2])
+dataset_builder.build_dataset(args.output, {"train": (train_images, train_labels),
+                                            "test": (test_images, test_labels)})
 
 
-# save smaller dataset to hdf5 file
-with h5py.File("mnist_small.h5", "w") as file:
-    file.create_dataset("train_images", data=train_small)
-    file.create_dataset("train_labels", data=train_labels)
-    file.create_dataset("test_images", data=test_small)
-    file.create_dataset("test_labels", data=test_labels)
+# make images smaller by max pooling  (28x28 --> 14x14 and 28x28 --> 7x7)
+# the pooling is done block by block on the whole batch of images at once,
+# the binarized dataset is thresholded after the pooling
+dataset_builder.build_resolutions(args.output, {args.small: (2, "max"),
+                                                args.tiny: (4, "max"),
+                                                args.small_binary: (2, "max", args.threshold)})
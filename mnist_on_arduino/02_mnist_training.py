@@ -4,47 +4,64 @@
 # Email:    michael.rinderle@tum.de
 # Created:  26.04.2019
 #
-# Revisions: ---
+# Revisions: 18.10.2026 - memory mapped dataset cache (data_cache.py)
+#            18.10.2026 - streaming tf.data training input (input_pipeline.py)
+#            18.10.2026 - command line options, heavy imports after parsing them
 #
 # Description: This script defines a 3 layer neural network, trains and
 #              evaluates the network using the full 28x28 pixel MNIST dataset.
 #              Accuracy > 97% is reached.
 #
+#              Usage: python 02_mnist_training.py [--epochs 5] [--no-plot]
+#                     (or python cli.py train-full ...)
+#
 ################################################################################
 
 
-import h5py
+import argparse
+
 import numpy as np
-import matplotlib.pyplot as plt
+
+parser = argparse.ArgumentParser(description="Train the 28x28 MNIST network")
+parser.add_argument("--dataset", default="mnist.h5")
+parser.add_argument("--hidden", type=int, default=128, help="nodes of the hidden layer")
+parser.add_argument("--epochs", type=int, default=5)
+parser.add_argument("--output", default="trained_models/full_mnist_model.h5")
+parser.add_argument("--no-plot", action="store_true", help="do not plot the first test images")
+args = parser.parse_args()
 
 import tensorflow as tf
 from tensorflow import keras
 
-# load MNIST dataset
-with h5py.File("mnist.h5", "r") as file:
-    train_images = np.array(file.get("train_images"))
-    train_labels = np.array(file.get("train_labels"))
-    test_images = np.array(file.get("test_images"))
-    test_labels = np.array(file.get("test_labels"))
+import data_cache
+import input_pipeline
+
+# training data is streamed from the hdf5 file in chunks and normalized on the fly
+# (augmentation e.g. dict(shift=1, noise=0.02, high_val=180), None = no augmentation)
+augment = None
+train_dataset = input_pipeline.make_dataset(args.dataset, "train", augment=augment)
+
+# load MNIST test dataset (memory mapped uint8 arrays)
+test = data_cache.open_split(args.dataset, "test")
+test_labels = test.labels
 
-# normalize data
-train_images = train_images / 256
-test_images = test_images / 256
+# normalize data (float32)
+test_images = test.normalized()
 
 
 # define neural network layers
-layer1 = keras.layers.Flatten(input_shape=train_images.shape[1:])       # flatten images (28x28 --> 1x784)
-layer2 = keras.layers.Dense(128, activation=tf.nn.relu)                 # fully connected layer with 128 nodes      relu activation
+layer1 = keras.layers.Flatten(input_shape=test_images.shape[1:])        # flatten images (28x28 --> 1x784)
+layer2 = keras.layers.Dense(args.hidden, activation=tf.nn.relu)         # fully connected layer with 128 nodes      relu activation
 layer3 = keras.layers.Dense(10, activation=tf.nn.softmax)               # dense layer with 10 nodes                 softmax activation --> probabilities sum up to 1
 # build model
 model = keras.Sequential([layer1, layer2, layer3])
 model.compile(optimizer="adam", loss="sparse_categorical_crossentropy", metrics=["accuracy"])
 
 # train the model
-model.fit(train_images, train_labels, epochs=5)
+model.fit(train_dataset, epochs=args.epochs)
 
 # save the trained model to hdf5 file
-model.save("trained_models/full_mnist_model.h5")
+model.save(args.output)
 
 
 # test model performance
@@ -84,14 +101,17 @@ def plot_prediction(true_label, prediction):
 
 
 # plot first X items
-num_rows = 5
-num_cols = 3
-num_images = num_rows * num_cols
-
-plt.figure(figsize=(2 * 2 * num_cols, 2 * num_rows))
-for i in range(num_images):
-    plt.subplot(num_rows, 2 * num_cols, 2 * i + 1)
-    plot_image(test_images[i], test_labels[i], predictions[i])
-    plt.subplot(num_rows, 2 * num_cols, 2 * i + 2)
-    plot_prediction(test_labels[i], predictions[i])
-plt.show()
+if not args.no_plot:
+    import matplotlib.pyplot as plt
+
+    num_rows = 5
+    num_cols = 3
+    num_images = num_rows * num_cols
+
+    plt.figure(figsize=(2 * 2 * num_cols, 2 * num_rows))
+    for i in range(num_images):
+        plt.subplot(num_rows, 2 * num_cols, 2 * i + 1)
+        plot_image(test_images[i], test_labels[i], predictions[i])
+        plt.subplot(num_rows, 2 * num_cols, 2 * i + 2)
+        plot_prediction(test_labels[i], predictions[i])
+    plt.show()
@@ -4,47 +4,111 @@
 # Email:    michael.rinderle@tum.de
 # Created:  26.04.2019
 #
-# Revisions: ---
+# Revisions: 18.10.2026 - optional magnitude pruning and fine-tuning
+#            18.10.2026 - memory mapped dataset cache (data_cache.py)
+#            18.10.2026 - streaming tf.data training input (input_pipeline.py)
+#            18.10.2026 - command line options, heavy imports after parsing them
+#            18.10.2026 - first stage of the early-exit cascade (--stage1)
+#            18.10.2026 - binarized input (--binary)
 #
 # Description: This script defines a 3 layer neural network, trains and
 #              evaluates the network using the smaller 14x14 pixel MNIST dataset.
 #              Accuracy of about 95% is reached.
+#              Optionally the smallest weights are pruned (set to zero) and the
+#              network is fine-tuned with the pruned weights kept at zero, for
+#              the sparse export in "04_quantize_model.py".
+#              With --stage1 the small first stage of the cascade (see
+#              "cascade.py") is trained on the 7x7 dataset instead.
+#              With --binary the network is trained on the binarized 14x14
+#              dataset (1 bit per pixel, see "04_quantize_model.py --binary").
+#
+#              Usage: python 03_mnist_small_training.py [--epochs 5] [--no-plot]
+#                     python 03_mnist_small_training.py --stage1
+#                     python 03_mnist_small_training.py --binary
+#                     (or python cli.py train ...)
 #
 ################################################################################
 
 
-import h5py
+import argparse
+
 import numpy as np
-import matplotlib.pyplot as plt
+
+parser = argparse.ArgumentParser(description="Train the 14x14 MNIST network")
+parser.add_argument("--dataset", default="mnist_small.h5")
+parser.add_argument("--hidden", type=int, default=32, help="nodes of the hidden layer")
+parser.add_argument("--epochs", type=int, default=5)
+parser.add_argument("--sparsity", type=float, default=0.0, help="magnitude pruning with fine-tuning (0.0 = no pruning)")
+parser.add_argument("--finetune-epochs", type=int, default=2)
+parser.add_argument("--output", default="trained_models/small_mnist_model.h5")
+parser.add_argument("--no-plot", action="store_true", help="do not plot the first test images")
+parser.add_argument("--stage1", action="store_true",
+                    help="train the first stage of the cascade (defaults: mnist_tiny.h5, 16 hidden nodes, "
+                         "trained_models/tiny_mnist_model.h5)")
+parser.add_argument("--binary", action="store_true",
+                    help="train on binarized images (defaults: mnist_small_binary.h5, "
+                         "trained_models/small_binary_model.h5)")
+args = parser.parse_args()
+if args.stage1 and args.binary:
+    parser.error("--stage1 and --binary cannot be combined")
+if args.stage1:
+    parser.set_defaults(dataset="mnist_tiny.h5", hidden=16, output="trained_models/tiny_mnist_model.h5")
+    args = parser.parse_args()
+if args.binary:
+    parser.set_defaults(dataset="mnist_small_binary.h5", output="trained_models/small_binary_model.h5")
+    args = parser.parse_args()
 
 import tensorflow as tf
 from tensorflow import keras
 
-# load MNIST dataset
-with h5py.File("mnist_small.h5", "r") as file:
-    train_images = np.array(file.get("train_images"))
-    train_labels = np.array(file.get("train_labels"))
-    test_images = np.array(file.get("test_images"))
-    test_labels = np.array(file.get("test_labels"))
+import data_cache
+import input_pipeline
+import quantization
+
+# training data is streamed from the hdf5 file in chunks and normalized on the fly
+# (augmentation e.g. dict(shift=1, noise=0.02, high_val=180), None = no augmentation)
+augment = None
+train_dataset = input_pipeline.make_dataset(args.dataset, "train", augment=augment)
+
+# load MNIST test dataset (memory mapped uint8 arrays)
+test = data_cache.open_split(args.dataset, "test")
+test_labels = test.labels
 
-# normalize data
-train_images = train_images / 256
-test_images = test_images / 256
+# normalize data (float32)
+test_images = test.normalized()
 
 
 # define neural network layers
-layer1 = keras.layers.Flatten(input_shape=train_images.shape[1:])       # flatten images (14x14 --> 1x196)
-layer2 = keras.layers.Dense(32, activation=tf.nn.relu)                  # fully connected layer with 32 nodes      relu activation
+layer1 = keras.layers.Flatten(input_shape=test_images.shape[1:])        # flatten images (14x14 --> 1x196)
+layer2 = keras.layers.Dense(args.hidden, activation=tf.nn.relu)         # fully connected layer with 32 nodes      relu activation
 layer3 = keras.layers.Dense(10, activation=tf.nn.softmax)               # dense layer with 10 nodes                softmax activation --> probabilities sum up to 1
 # build model
 model = keras.Sequential([layer1, layer2, layer3])
 model.compile(optimizer="adam", loss="sparse_categorical_crossentropy", metrics=["accuracy"])
 
 # train the model
-model.fit(train_images, train_labels, epochs=5)
+model.fit(train_dataset, epochs=args.epochs)
+
+# optional magnitude pruning with fine-tuning (0.0 = no pruning)
+sparsity = args.sparsity
+finetune_epochs = args.finetune_epochs
+
+if sparsity > 0:
+    dense_layers = [layer2, layer3]
+    masks = [quantization.magnitude_mask(layer.get_weights()[0], sparsity) for layer in dense_layers]
+
+    class ApplyMasks(keras.callbacks.Callback):
+        # keep pruned weights at zero
+        def on_train_batch_end(self, batch, logs=None):
+            for layer, mask in zip(dense_layers, masks):
+                kernel, bias = layer.get_weights()
+                layer.set_weights([kernel * mask, bias])
+
+    ApplyMasks().on_train_batch_end(0)
+    model.fit(train_dataset, epochs=finetune_epochs, callbacks=[ApplyMasks()])
 
 # save the trained model to hdf5 file
-model.save("trained_models/small_mnist_model.h5")
+model.save(args.output)
 
 
 # test model performance
@@ -84,14 +148,17 @@ def plot_prediction(true_label, prediction):
 
 
 # plot first X items
-num_rows = 5
-num_cols = 3
-num_images = num_rows * num_cols
-
-plt.figure(figsize=(2 * 2 * num_cols, 2 * num_rows))
-for i in range(num_images):
-    plt.subplot(num_rows, 2 * num_cols, 2 * i + 1)
-    plot_image(test_images[i], test_labels[i], predictions[i])
-    plt.subplot(num_rows, 2 * num_cols, 2 * i + 2)
-    plot_prediction(test_labels[i], predictions[i])
-plt.show()
+if not args.no_plot:
+    import matplotlib.pyplot as plt
+
+    num_rows = 5
+    num_cols = 3
+    num_images = num_rows * num_cols
+
+    plt.figure(figsize=(2 * 2 * num_cols, 2 * num_rows))
+    for i in range(num_images):
+        plt.subplot(num_rows, 2 * num_cols, 2 * i + 1)
+        plot_image(test_images[i], test_labels[i], predictions[i])
+        plt.subplot(num_rows, 2 * num_cols, 2 * i + 2)
+        plot_prediction(test_labels[i], predictions[i])
+    plt.show()
@@ -4,7 +4,14 @@
 # Email:    michael.rinderle@tum.de
 # Created:  26.04.2019
 #
-# Revisions: ---
+# Revisions: 18.10.2026 - accumulator range analysis, code moved to quantization.py
+#            18.10.2026 - magnitude pruning and sparse export
+#            18.10.2026 - 4-bit packed weights
+#            18.10.2026 - rounding mode and fractional bit offsets
+#            18.10.2026 - command line options
+#            18.10.2026 - early-exit cascade with a 7x7 first stage
+#            18.10.2026 - column-major layer 1 weights for the streaming firmware
+#            18.10.2026 - binarized input (--binary)
 #
 # Description: This script loads the trained model created by script
 #              "03_mnist_small_training.py" and quantizes weights and biases.
@@ -17,100 +24,166 @@
 #              The quantized weights and biases are stored in a hdf5 file and
 #              the file "network.h" is created to include in the Arduino code.
 #
+#              The worst case partial sums of both layers are computed from
+#              the quantized weights and the input formats, and the partial
+#              sums observed on the training set are reported. Blocks of inputs
+#              whose partial sums provably fit into 16 bits are accumulated
+#              with 16-bit ints on the arduino (l1_block/l2_block in network.h).
+#
+#              Optionally the weights are pruned to a target sparsity (use the
+#              same sparsity as for fine-tuning in "03_mnist_small_training.py")
+#              and exported as compressed rows of the nonzero weights.
+#
+#              With weight_bits = 4 the weights are quantized to signed 4-bit
+#              integers and packed two per byte (half the flash, see
+#              "05_compare_models.py" for the loss in accuracy).
+#
+#              The rounding mode and offsets to the fractional bits of the
+#              weights and biases can be chosen from the results of
+#              "quantization_sweep.py".
+#
+#              With --stage1-model the first stage of the early-exit cascade
+#              (trained by "03_mnist_small_training.py --stage1") is quantized
+#              and exported into network.h as well. Unless --exit-margin is
+#              given, the margin with the fewest MACs per image whose accuracy
+#              on the training set is at most --max-loss below the network
+#              alone is exported (see "cascade.py").
+#
+#              With --column-major the layer 1 weights are exported with one
+#              row per pixel: the firmware then multiplies the pixels into
+#              layer 1 while the image is still received.
+#
+#              With --binary the network trained on the binarized dataset
+#              ("03_mnist_small_training.py --binary") is exported with
+#              BINARY_INPUT: the pixels are thresholded like the dataset and
+#              layer 1 only adds up the weights of the set pixels (the host
+#              sends 1 bit per pixel with protocol "bits").
+#
+#              Usage: python 04_quantize_model.py [--weight-bits 4] [--sparsity 0.5 --sparse]
+#                     python 04_quantize_model.py --stage1-model trained_models/tiny_mnist_model.h5
+#                     python 04_quantize_model.py --binary
+#                     (or python cli.py quantize ...)
+#
 ################################################################################
 
 
+import argparse
+
 import h5py
 import numpy as np
 
+import cascade
+import quantization
+from fixedpoint import BINARY_THRESHOLD
+
+# magnitude pruning (0.0 = no pruning) and sparse export of the nonzero weights
+sparsity = 0.0
+sparse = False
+
+# bits of the weights: 8 or 4 (packed two per byte, dense export only)
+weight_bits = 8
+
+# rounding mode and offsets to the fractional bits of l1w, l1b, l2w, l2b (see quantization_sweep.py)
+rounding = "nearest"
+bit_offsets = (0, 0, 0, 0)
+
+parser = argparse.ArgumentParser(description="Quantize the trained model and export network.h")
+parser.add_argument("--model", default="trained_models/small_mnist_model.h5")
+parser.add_argument("--dataset", default="mnist_small.h5", help="training images for the accumulator analysis")
+parser.add_argument("--sparsity", type=float, default=sparsity)
+parser.add_argument("--sparse", action="store_true", default=sparse, help="export the nonzero weights only")
+parser.add_argument("--weight-bits", type=int, default=weight_bits, choices=quantization.WEIGHT_BITS)
+parser.add_argument("--rounding", default=rounding, choices=sorted(quantization.ROUNDING))
+parser.add_argument("--bit-offsets", nargs=4, type=int, default=bit_offsets, metavar=("L1W", "L1B", "L2W", "L2B"))
+parser.add_argument("--column-major", action="store_true",
+                    help="layer 1 weights of one pixel per row (streaming layer 1, dense 8-bit only)")
+parser.add_argument("--header", default="network.h")
+parser.add_argument("--output", default="trained_models/fixedpoint_mnist_model.h5")
+parser.add_argument("--stage1-model", default=None, help="float first stage of the cascade (7x7 inputs)")
+parser.add_argument("--stage1-output", default="trained_models/fixedpoint_tiny_model.h5")
+parser.add_argument("--exit-margin", type=int, default=None, help="exit margin of the cascade (default: chosen)")
+parser.add_argument("--max-loss", type=float, default=0.002, help="accuracy the cascade may lose (training set)")
+parser.add_argument("--binary", action="store_true",
+                    help="network trained on binarized images (defaults: trained_models/small_binary_model.h5, "
+                         "mnist_small_binary.h5, trained_models/fixedpoint_binary_model.h5)")
+args = parser.parse_args()
+if args.binary:
+    parser.set_defaults(model="trained_models/small_binary_model.h5", dataset="mnist_small_binary.h5",
+                        output="trained_models/fixedpoint_binary_model.h5")
+    args = parser.parse_args()
+if args.column_major and (args.sparse or args.weight_bits == 4):
+    parser.error("--column-major needs dense 8-bit weights")
+if args.binary and (args.sparse or args.weight_bits == 4 or args.column_major or args.stage1_model is not None):
+    parser.error("--binary needs dense 8-bit row-major weights without a cascade")
+sparsity, sparse, weight_bits, rounding, bit_offsets = (args.sparsity, args.sparse, args.weight_bits, args.rounding,
+                                                        tuple(args.bit_offsets))
+
 # load model weights and biases
-with h5py.File("trained_models/small_mnist_model.h5", "r") as file:
-    model = file.get("model_weights")
-    layer1 = model.get("dense/dense")
-    l1_weights = np.array(layer1.get("kernel:0"))
-    l1_bias = np.array(layer1.get("bias:0"))
-    layer2 = model.get("dense_1/dense_1")
-    l2_weights = np.array(layer2.get("kernel:0"))
-    l2_bias = np.array(layer2.get("bias:0"))
+l1_weights, l1_bias, l2_weights, l2_bias = quantization.load_float_weights(args.model)
+
+l1_weights, l1_bias, l2_weights, l2_bias = quantization.prune_weights(l1_weights, l1_bias, l2_weights, l2_bias, sparsity)
 
 # print("Layer 1 weights:", l1_weights.shape)
 # print("Layer 1 biases: ", l1_bias.shape)
 # print("Layer 2 weights:", l2_weights.shape)
 # print("Layer 2 biases: ", l2_bias.shape)
 
-# find number of fractional bits to represent range
-l1w_min, l1w_max = np.min(l1_weights), np.max(l1_weights)
-l1b_min, l1b_max = np.min(l1_bias), np.max(l1_bias)
-l2w_min, l2w_max = np.min(l2_weights), np.max(l2_weights)
-l2b_min, l2b_max = np.min(l2_bias), np.max(l2_bias)
-
-l1w_bits = 7 - int(np.ceil(np.log2(max(abs(l1w_min), abs(l1w_max)))))
-l1b_bits = 7 - int(np.ceil(np.log2(max(abs(l1b_min), abs(l1b_max)))))
-l2w_bits = 7 - int(np.ceil(np.log2(max(abs(l2w_min), abs(l2w_max)))))
-l2b_bits = 7 - int(np.ceil(np.log2(max(abs(l2b_min), abs(l2b_max)))))
-
-# print("Layer 1 weights:  min {:3.3f}, max {:3.3f}, bits {}".format(l1w_min, l1w_max, l1w_bits))
-# print("Layer 1 biases:   min {:3.3f}, max {:3.3f}, bits {}".format(l1b_min, l1b_max, l1b_bits))
-# print("Layer 2 weights:  min {:3.3f}, max {:3.3f}, bits {}".format(l2w_min, l2w_max, l2w_bits))
-# print("Layer 2 biases:   min {:3.3f}, max {:3.3f}, bits {}".format(l2b_min, l2b_max, l2b_bits))
+# binarized input: threshold of the binarized dataset (0 = 8-bit pixels)
+input_threshold = 0
+if args.binary:
+    with h5py.File(args.dataset, "r") as file:
+        input_threshold = int(file.attrs.get("threshold", BINARY_THRESHOLD))
 
+# find number of fractional bits to represent range and
 # calculate fixed point representation for weights and biases   (signed 8-bit integers)
-fixed_l1w = np.array(np.round(l1_weights * 2 ** l1w_bits), dtype=np.int8)
-fixed_l1b = np.array(np.round(l1_bias * 2 ** l1b_bits), dtype=np.int8)
-fixed_l2w = np.array(np.round(l2_weights * 2 ** l2w_bits), dtype=np.int8)
-fixed_l2b = np.array(np.round(l2_bias * 2 ** l2b_bits), dtype=np.int8)
-
-# layer dimensions
-img_size = fixed_l1w.shape[0]
-l1_size = fixed_l1b.shape[0]
-l2_size = fixed_l2b.shape[0]
-
-# fractional bits of images
-img_bits = 8
+network = quantization.quantize_model(l1_weights, l1_bias, l2_weights, l2_bias, weight_bits=weight_bits,
+                                      rounding=rounding, bit_offsets=bit_offsets, input_threshold=input_threshold)
+
+# print("Layer 1 weights:  bits {}".format(network.l1w_bits))
+# print("Layer 1 biases:   bits {}".format(network.l1b_bits))
+# print("Layer 2 weights:  bits {}".format(network.l2w_bits))
+# print("Layer 2 biases:   bits {}".format(network.l2b_bits))
+
+# accumulator range analysis (worst case and observed on the training set)
+with h5py.File(args.dataset, "r") as file:
+    analysis = quantization.analyze_accumulators(network, file["train_images"])
+
+for layer, size in ((1, network.img_size), (2, network.l1_size)):
+    print("Layer {} accumulator: worst case {:d}, training set {:d}, 16-bit blocks of {:d}/{:d} inputs".format(
+        layer, analysis["l{}_acc_bound".format(layer)], analysis["l{}_acc_observed".format(layer)],
+        analysis["l{}_block".format(layer)], size))
+
+print("Flash: {} bytes, MACs: {} per image ({} export, {}-bit weights)".format(
+    quantization.flash_bytes(network, sparse), quantization.mac_count(network, sparse), "sparse" if sparse else "dense",
+    weight_bits))
+
+# early-exit cascade: 8-bit first stage on the 2x2 max pooled images, exit margin chosen on the training set
+stage1 = None
+exit_margin = None
+if args.stage1_model is not None:
+    stage1 = quantization.quantize_model(*quantization.load_float_weights(args.stage1_model), rounding=rounding)
+    with h5py.File(args.dataset, "r") as file:
+        train_images = file["train_images"][:].reshape(-1, network.img_size)
+        train_labels = file["train_labels"][:]
+    stage1_analysis = quantization.analyze_accumulators(stage1, cascade.pool_images(train_images))
+    stage1 = stage1.with_blocks(stage1_analysis["l1_block"], stage1_analysis["l2_block"])
+
+    rows = cascade.threshold_table(stage1, network, train_images, train_labels,
+                                   extra_margins=[] if args.exit_margin is None else [args.exit_margin], sparse=sparse)
+    print(cascade.format_table(rows))
+    if args.exit_margin is None:
+        chosen = cascade.choose_margin(rows, args.max_loss)
+    else:
+        chosen = [row for row in rows if row["margin"] == args.exit_margin][0]
+    exit_margin = chosen["margin"]
+    print("Cascade: exit margin {}, {:.1%} of the training images exit after stage 1, {:.0f} MACs per image, "
+          "accuracy {:.4f}".format(exit_margin, chosen["exit_rate"], chosen["macs"], chosen["accuracy"]))
+
+    quantization.save_fixedpoint(args.stage1_output, stage1, stage1_analysis, exit_margin)
 
 # export weights and biases for arduino
-with open("network.h", "w") as file:
-    file.write("#ifndef NETWORK_H\n#define NETWORK_H\n\n")
-    file.write("const PROGMEM char l1_weights[{:d}][{:d}] = {{\n{{".format(l1_size, img_size))
-    np.savetxt(file, fixed_l1w.T, fmt="%4d", delimiter=", ", newline="},\n{")
-    file.seek(file.tell() - 3)
-    file.write("};\n\n")
-
-    file.write("const PROGMEM char l1_bias[{:d}] = {{".format(l1_size))
-    np.savetxt(file, fixed_l1b, fmt="%4d", delimiter=", ", newline=", ")
-    file.seek(file.tell() - 2)
-    file.write("};\n\n")
-
-    file.write("const PROGMEM char l2_weights[{:d}][{:d}] = {{\n{{".format(l2_size, l1_size))
-    np.savetxt(file, fixed_l2w.T, fmt="%4d", delimiter=", ", newline="},\n{")
-    file.seek(file.tell() - 3)
-    file.write("};\n\n")
-
-    file.write("const PROGMEM char l2_bias[{:d}] = {{".format(l2_size))
-    np.savetxt(file, fixed_l2b, fmt="%4d", delimiter=", ", newline=", ")
-    file.seek(file.tell() - 2)
-    file.write("};\n\n")
-
-    file.write("#define img_bits {}\n".format(img_bits))
-    file.write("#define l1w_bits {}\n".format(l1w_bits))
-    file.write("#define l1b_bits {}\n".format(l1b_bits))
-    file.write("#define l2w_bits {}\n".format(l2w_bits))
-    file.write("#define l2b_bits {}\n".format(l2b_bits))
-
-    file.write("\n#define img_size {}\n".format(img_size))
-    file.write("#define l1_size {}\n".format(l1_size))
-    file.write("#define l2_size {}\n".format(l2_size))
-
-    file.write("\n#endif // NETWORK_H")
-
+quantization.write_header(args.header, network, analysis, sparse, stage1, exit_margin,
+                          column_major=args.column_major)
 
 # save fixed point model to hdf5 file
-with h5py.File("trained_models/fixedpoint_mnist_model.h5", "w") as file:
-    h5_l1w = file.create_dataset("layer1_weights", data=fixed_l1w)
-    h5_l1b = file.create_dataset("layer1_bias", data=fixed_l1b)
-    h5_l2w = file.create_dataset("layer2_weights", data=fixed_l2w)
-    h5_l2b = file.create_dataset("layer2_bias", data=fixed_l2b)
-    h5_l1w.attrs.create("bits", l1w_bits)
-    h5_l1b.attrs.create("bits", l1b_bits)
-    h5_l2w.attrs.create("bits", l2w_bits)
-    h5_l2b.attrs.create("bits", l2b_bits)
+quantization.save_fixedpoint(args.output, network, analysis)
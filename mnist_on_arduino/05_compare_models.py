@@ -4,95 +4,143 @@
 # Email:    michael.rinderle@tum.de
 # Created:  27.04.2019
 #
-# Revisions: ---
+# Revisions: 18.10.2026 - fixed point computation moved to fixedpoint.py
+#            18.10.2026 - check of the 16-bit block accumulation
+#            18.10.2026 - accuracy, flash and MACs of pruned models
+#            18.10.2026 - memory mapped dataset cache (data_cache.py)
+#            18.10.2026 - accuracy and flash of 4-bit packed weights
+#            18.10.2026 - single tensorflow pass (predict only)
+#            18.10.2026 - command line options, tensorflow imported only for its section
+#            18.10.2026 - accuracy cost of the binarized input model
 #
 # Description: This script loads the quantized model created by
 #              "04_quantize_model.py" and implements the prediction algorithm
 #              like it would be on the Arduino microcontroller.
 #              A comparison to the full precision tensorflow model is made.
 #              The loss in accuracy due to quantization is in the range of 0.1%
+#              With --float numpy the float model is computed from its weights
+#              (see "quantization_sweep.py") and tensorflow is not needed.
+#              If the fixed point model with binarized input exists
+#              ("04_quantize_model.py --binary"), its accuracy, bytes and MACs
+#              per image are compared to the 8-bit model.
+#
+#              Usage: python 05_compare_models.py [--float numpy]
+#                     (or python cli.py compare ...)
 #
 ################################################################################
 
 
-import h5py
+import argparse
+import os
+
 import numpy as np
 
-import tensorflow as tf
-from tensorflow import keras
+import data_cache
+import quantization
+from fixedpoint import FixedPointNetwork
+
+parser = argparse.ArgumentParser(description="Compare the fixed point model with the float model")
+parser.add_argument("--fixedpoint", default="trained_models/fixedpoint_mnist_model.h5")
+parser.add_argument("--float-model", default="trained_models/small_mnist_model.h5")
+parser.add_argument("--dataset", default="mnist_small.h5")
+parser.add_argument("--binary", default="trained_models/fixedpoint_binary_model.h5",
+                    help="fixed point model with binarized input (compared if the file exists)")
+parser.add_argument("--float", default="tensorflow", choices=("tensorflow", "numpy"),
+                    help="compute the float model with tensorflow or from its weights with numpy")
+args = parser.parse_args()
 
 # load fixed point model
-with h5py.File("trained_models/fixedpoint_mnist_model.h5", "r") as file:
-    layer1_weights = np.array(file.get("layer1_weights"))
-    layer1_bias = np.array(file.get("layer1_bias"))
-    layer2_weights = np.array(file.get("layer2_weights"))
-    layer2_bias = np.array(file.get("layer2_bias"))
-    l1w_bits = file["layer1_weights"].attrs.get("bits")
-    l1b_bits = file["layer1_bias"].attrs.get("bits")
-    l2w_bits = file["layer2_weights"].attrs.get("bits")
-    l2b_bits = file["layer2_bias"].attrs.get("bits")
-
-# layer dimensions
-img_size = layer1_weights.shape[0]
-l1_size = layer1_bias.shape[0]
-l2_size = layer2_bias.shape[0]
-
-# load MNIST dataset
-with h5py.File("mnist_small.h5", "r") as file:
-    test_images = np.array(file.get("test_images"))
-    test_labels = np.array(file.get("test_labels"))
+network = FixedPointNetwork.load(args.fixedpoint)
+
+# load MNIST dataset (memory mapped uint8 arrays)
+test = data_cache.open_split(args.dataset, "test")
+test_labels = np.array(test.labels)
 
 # flatten images
-test_images = np.reshape(test_images, (-1, img_size))
+test_images = test.flat()
 print(test_images.shape)
 
-# fractional bits of images
-img_bits = 8
-
 
 ################################################################################
 # compute neural network with fixed point data
+# (same integer arithmetic as compute_network() and send_result() on the arduino,
+#  see fixedpoint.py)
+fixedpoint_predictions = network.predict(test_images)
 
-# cast weights and images to 32-bit integers
-weights1 = np.array(layer1_weights, dtype=np.int32)
-weights2 = np.array(layer2_weights, dtype=np.int32)
-images = np.array(test_images, dtype=np.int32)
+# the 16-bit block accumulation (l1_block/l2_block from the range analysis in
+# 04_quantize_model.py) has to give exactly the same results as 32-bit accumulators
+if network.l1_block or network.l2_block:
+    narrow_logits = network.logits(test_images)
+    wide_logits = network.widened().logits(test_images)
+    mismatches = np.count_nonzero(np.any(narrow_logits != wide_logits, axis=1))
+    print("16-bit accumulation (blocks of {} / {} inputs): {} of {} images differ from 32-bit accumulation".format(
+        network.l1_block, network.l2_block, mismatches, len(test_images)))
 
-# multiply layer 1 weight matrix and image vector(s)
-layer1 = np.squeeze(np.matmul(weights1.T, np.expand_dims(images, -1)))
-# shift bits to have same precision as layer 1 bias
-layer1 = np.right_shift(layer1, img_bits + l1w_bits - l1b_bits)
-# add layer 1 bias
-layer1 += layer1_bias
-# relu activation
-layer1 *= layer1 > 0
 
-# multiply layer 2 weight matrix and layer 1 vector(s)
-layer2 = np.squeeze(np.matmul(weights2.T, np.expand_dims(layer1, -1)))
-# shift bits to have same precision as layer 2 bias
-layer2 = np.right_shift(layer2, l1b_bits + l2w_bits - l2b_bits)
-# add layer 2 bias
-layer2 += layer2_bias
+################################################################################
+# prune the trained model to different sparsities and compare the quantized models
+# (without fine-tuning, see "03_mnist_small_training.py" for pruning with fine-tuning)
+float_weights = quantization.load_float_weights(args.float_model)
 
-# # softmax activation  (actually correct implementation but needs floating point exp function)
-# layer2 = layer2 / 2 ** l2b_bits
-# layer2 = (np.exp(layer2).T / np.sum(np.exp(layer2), 1)).T
-# print(layer2.dtype)
+print("Sparsity  Accuracy  Flash dense/sparse [bytes]  MACs/image")
+for sparsity in (0.0, 0.25, 0.5, 0.6, 0.7, 0.8, 0.9):
+    pruned = quantization.quantize_model(*quantization.prune_weights(*float_weights, sparsity))
+    pruned_accuracy = np.mean(pruned.predict(test_images) == test_labels)
+    print("{:7.0f}%  {:7.2f}%  {:11d} / {:11d}  {:10d}".format(
+        sparsity * 100, pruned_accuracy * 100, quantization.flash_bytes(pruned), quantization.flash_bytes(pruned, True),
+        quantization.mac_count(pruned, True)))
 
-# "hard"max (should give same results but easier to implement on Arduino)   probabilities don't add up to 1 obviously
-fixedpoint_predictions = np.argmax(layer2, axis=1)
+
+################################################################################
+# 8-bit weights vs. 4-bit weights packed two per byte
+# (with the 16-bit blocks of the range analysis, like the exported firmware)
+print("Weights  Accuracy  Flash [bytes]  Weight bytes read/image  16-bit blocks")
+for weight_bits in quantization.WEIGHT_BITS:
+    quantized = quantization.quantize_model(*float_weights, weight_bits=weight_bits)
+    analysis = quantization.analyze_accumulators(quantized)
+    quantized = quantized.with_blocks(analysis["l1_block"], analysis["l2_block"])
+    quantized_accuracy = np.mean(quantized.predict(test_images) == test_labels)
+    weight_bytes = quantization.flash_bytes(quantized) - quantized.l1_size - quantized.l2_size
+    print("{:5d}-bit  {:7.2f}%  {:13d}  {:23d}  {:6d} / {:d}".format(
+        weight_bits, quantized_accuracy * 100, quantization.flash_bytes(quantized), weight_bytes,
+        quantized.l1_block, quantized.l2_block))
+
+
+################################################################################
+# 8-bit pixels vs. binarized input (1 bit per pixel): accuracy, bytes on the wire and MACs
+# (the binarized model thresholds the same test images, layer 1 only adds the weights of the set pixels)
+if os.path.exists(args.binary):
+    binary_network = FixedPointNetwork.load(args.binary)
+    binary_predictions = binary_network.predict(test_images)
+    print("Input   Accuracy  Pixel bytes/image  MACs/image (zero pixels skipped)")
+    for name, model, predictions, pixel_bytes in (
+            ("8-bit", network, fixedpoint_predictions, network.img_size),
+            ("1-bit", binary_network, binary_predictions, (binary_network.img_size + 7) // 8)):
+        print("{:5s}  {:8.2f}%  {:17d}  {:10.0f}".format(name, np.mean(predictions == test_labels) * 100,
+                                                        pixel_bytes, quantization.input_mac_count(model, test_images)))
+    print("Accuracy cost of the binarized input: {:.2f} %".format(
+        (np.mean(fixedpoint_predictions == test_labels) - np.mean(binary_predictions == test_labels)) * 100))
+else:
+    print("No binarized input model ({}), see 04_quantize_model.py --binary".format(args.binary))
 
 
 ################################################################################
 # use tensorflow model to compute predictions
-small_model = keras.models.load_model("trained_models/small_mnist_model.h5")
-# print(small_model.summary())
-
-# reshape and normalize images
-test_images = test_images.reshape(-1, 14, 14) / 256
-# evaluate tensorflow model
-loss, acc = small_model.evaluate(test_images, test_labels)
-tensorflow_predictions = small_model.predict(test_images)
+if args.float == "tensorflow":
+    from tensorflow import keras
+
+    small_model = keras.models.load_model(args.float_model)
+    # print(small_model.summary())
+
+    # normalize images
+    test_images = test.normalized()
+    # predict once, the accuracy is computed from the predictions below
+    # (see quantization_sweep.py for many quantization configurations at once)
+    tensorflow_predictions = small_model.predict(test_images)
+else:
+    # same float model computed with numpy (cached logits)
+    import quantization_sweep
+    tensorflow_predictions = quantization_sweep.cached_float_logits(args.float_model, args.dataset)
 tensorflow_predictions = np.argmax(tensorflow_predictions, axis=1)
 
 
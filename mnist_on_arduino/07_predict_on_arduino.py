@@ -4,71 +4,86 @@
 # Email:    michael.rinderle@tum.de
 # Created:  28.04.2019
 #
-# Revisions: ---
+# Revisions: 18.10.2026 - binary protocol mode (serial_protocol.py)
+#            18.10.2026 - pipelined mode with several images in flight
+#            18.10.2026 - memory mapped dataset cache (data_cache.py)
+#            18.10.2026 - event driven client with futures (arduino_client.py)
+#            18.10.2026 - command line options
 #
 # Description: This script sends the small 14x14 pixel MNIST pictures 1 by 1
 #              to the Arduino and gathers the prediction from the Arduino.
-#              Predictions take ~ 45 ms/image
+#              Predictions take ~ 45 ms/image in ASCII protocol mode.
+#              In binary protocol mode each image is sent as one compact frame.
+#              In pipelined mode the next image is transferred while the
+#              arduino computes the current one.
+#
+#              Usage: python 07_predict_on_arduino.py --port /dev/ttyACM0 [--count 1000]
+#                     python 07_predict_on_arduino.py --sim      (virtual arduino)
+#                     (or python cli.py predict ...)
 #
 ################################################################################
 
 
-import serial
+import argparse
 import time
-import h5py
 import numpy as np
 
-# load MNIST dataset
-with h5py.File("mnist_small.h5", "r") as file:
-    test_images = np.array(file.get("test_images"))
-    test_labels = np.array(file.get("test_labels"))
+import data_cache
+import serial_protocol as sp
+from arduino_client import ArduinoClient
+
+parser = argparse.ArgumentParser(description="Classify the test images on the arduino")
+parser.add_argument("--port", default="/dev/ttyACM0", help="serial port of the arduino")
+parser.add_argument("--baudrate", type=int, default=1000000)
+parser.add_argument("--protocol", default="pipelined", choices=sorted(sp.PROTOCOLS))
+parser.add_argument("--timeout", type=float, default=2.0)
+parser.add_argument("--count", type=int, default=1000, help="number of test images")
+parser.add_argument("--dataset", default="mnist_small.h5")
+parser.add_argument("--sim", action="store_true", help="use a virtual arduino instead of --port")
+parser.add_argument("--model", default="trained_models/fixedpoint_mnist_model.h5", help="model of the virtual arduino")
+args = parser.parse_args()
+
+# load MNIST dataset (memory mapped, only the images which are sent are read)
+test = data_cache.open_split(args.dataset, "test")
+test_labels = test.labels
 
 # flatten images
-test_images = np.reshape(test_images, (-1, 14 * 14))
+test_images = test.flat()
 # print(test_images.shape)
 
-# setup arduino serial communication
-arduino = serial.Serial('/dev/ttyACM0', 1000000, timeout=0.050)
-print(arduino.name)
-
-# reset arduino and whait for it to be ready
-arduino.setDTR(False)
-time.sleep(1)
-arduino.setDTR(True)
-while (True):
-    line = arduino.readline()
-    if "Arduino is ready" in line.decode():
-        break
-
 # define how many images should be sent and prdicted by arduino
-img_count = 1000
+img_count = min(args.count, len(test_images))
+
+device = None
+port = args.port
+if args.sim:
+    from fixedpoint import FixedPointNetwork
+    from virtual_arduino import VirtualArduino
+    device = VirtualArduino(FixedPointNetwork.load(args.model))
+    device.start()
+    port = device.port
 
 # initialize array for predictions
 arduino_predictions = np.zeros(img_count, dtype=np.int8)
 
-start = time.time()
-
-for idx in range(img_count):
-    # send image to arduino
-    arduino.write(b"S")
-    for num in test_images[idx]:
-        arduino.write(bytes(str(num) + ", ", "utf-8"))
-    arduino.write(b"E")
-
-    # receive result from arduino
-    while (True):
-        if arduino.in_waiting:
-            line = arduino.readline()
-            # print(line)
+# setup arduino serial communication, reset arduino and whait for it to be ready,
+# select protocol mode ("sparse", "pipelined", "binary" or "ascii"), old firmware falls back to simpler modes
+try:
+    with ArduinoClient(port, args.baudrate, protocol=args.protocol, timeout=args.timeout) as arduino:
+        print(arduino.port)
+        print("Protocol:", arduino.protocol)
 
-            if "RESULT" in line.decode():
-                data = arduino.readline()
-                break
+        start = time.time()
 
-    # store prediction in array
-    arduino_predictions[idx] = int(data)
+        # send images to arduino and receive results in order, store predictions in array
+        # (in pipelined mode the next images are sent while the arduino computes)
+        for idx, prediction in enumerate(arduino.predict_many(test_images[:img_count])):
+            arduino_predictions[idx] = prediction
 
-end = time.time()
+        end = time.time()
+finally:
+    if device is not None:
+        device.stop()
 
 
 arduino_wrongs = np.nonzero(arduino_predictions - test_labels[:img_count])[0].shape[0]
@@ -4,89 +4,127 @@
 # Email:    michael.rinderle@tum.de
 # Created:  06.07.2019
 #
-# Revisions: ---
+# Revisions: 18.10.2026 - binary protocol mode (serial_protocol.py)
+#            18.10.2026 - parallel, cached preprocessing and parameter sweep (photo_pipeline.py)
+#            18.10.2026 - event driven client with futures (arduino_client.py)
+#            18.10.2026 - command line options
+#            18.10.2026 - binarized photos for the binarized input model (--binary)
 #
 # Description: This script classifies MNIST digits from photos taken from a printout of MNIST digits
 #              The accuracy is 127 out of 160 images using 180 as a value for the edge filter
 #              and nearest neighbour interpolation
+#              Optionally the edge filter value and the interpolation are first
+#              tuned on the fixed point model, only the best configuration is
+#              classified on the arduino.
+#              Frames of a camera or a video file are classified continuously
+#              by "video_stream.py".
+#              With --binary the photos are binarized by the edge filter and
+#              sent with 1 bit per pixel to the firmware of the network with
+#              binarized input ("04_quantize_model.py --binary").
+#
+#              Usage: python 08_classify_from_photos.py --port COM22 [--sweep]
+#                     python 08_classify_from_photos.py --sim      (virtual arduino)
+#                     python 08_classify_from_photos.py --binary --sim
+#                     (or python cli.py photos ...)
 #
 ################################################################################
 
 
-import serial
-import time
-import h5py
+import argparse
 import numpy as np
-import glob
 import cv2
 import os
 
-# setup arduino serial communication
-#arduino = serial.Serial('/dev/ttyACM0', 1000000, timeout=0.050)
-arduino = serial.Serial('COM22', 1000000, timeout=0.050)
-print(arduino.name)
-
-# reset arduino and whait for it to be ready
-arduino.setDTR(False)
-time.sleep(1)
-arduino.setDTR(True)
-while (True):
-    line = arduino.readline()
-    if "Arduino is ready" in line.decode():
-        break
-
-pred_images = 0
-correct_images = 0
-        
-# high value for simple edge filter
-highVal = 180
-files = glob.glob("Raw_Photos/*.jpg")
-
-for myFile in files:
-    img_ = cv2.imread(myFile, cv2.IMREAD_ANYCOLOR)
-    gray = cv2.cvtColor(img_, cv2.COLOR_BGR2GRAY)
-    img_ = cv2.resize(gray,(14,14), interpolation = cv2.INTER_NEAREST)
-    
-    # bad pixels
-    img_[9][0] = img_[10][0]
-    
-    captured_image = np.asarray(img_)
-    high_values_flags = captured_image > highVal  # Where values are low
-    captured_image[high_values_flags] = 255  # All low values set to 0
-    
-    newFileName = "Processed_Photos/" + os.path.basename(myFile)
-    sep = ' '
-    ref = os.path.basename(myFile).split(sep, 1)[0]
-    print("Result should be %s" % ref)
-    
-    captured_image = cv2.bitwise_not(captured_image)
-    img_resized = cv2.imwrite(filename=newFileName, img=captured_image)
-
-    image = np.array(captured_image)
-    image = np.reshape(image, (-1, 14*14))
-    # send image to arduino
-    arduino.write(b"S")
-    for row in image:
-        for num in row:
-            arduino.write(bytes(str(num) + ", ", "utf-8"))
-    arduino.write(b"E")
-
-    # receive result from arduino
-    while (True):
-        if arduino.in_waiting:
-            line = arduino.readline()
-            print(line)
-
-            if "R" in line.decode():
-                data = arduino.readline()
-                print("Prediction on Arduino: %d" % int(data))
-                if (int(data) == int(ref)):
+import photo_pipeline
+import serial_protocol as sp
+from arduino_client import ArduinoClient
+from fixedpoint import FixedPointNetwork
+
+# the process pool re-imports this script on Windows, so everything runs in the main guard
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify the photos of printed digits on the arduino")
+    #parser.add_argument("--port", default="/dev/ttyACM0", help="serial port of the arduino")
+    parser.add_argument("--port", default="COM22", help="serial port of the arduino")
+    parser.add_argument("--baudrate", type=int, default=1000000)
+    parser.add_argument("--protocol", default="binary", choices=sorted(sp.PROTOCOLS))
+    parser.add_argument("--photos", default="Raw_Photos/*.jpg")
+    parser.add_argument("--output-dir", default="Processed_Photos", help="preprocessed images are written here")
+    parser.add_argument("--high-val", type=int, default=180, help="high value of the edge filter")
+    parser.add_argument("--interpolation", default="nearest", choices=sorted(photo_pipeline.INTERPOLATIONS))
+    parser.add_argument("--sweep", action="store_true", help="tune edge filter and interpolation first")
+    parser.add_argument("--model", default="trained_models/fixedpoint_mnist_model.h5")
+    parser.add_argument("--sim", action="store_true", help="use a virtual arduino instead of --port")
+    parser.add_argument("--binary", action="store_true",
+                        help="binarized photos for the binarized input model (defaults: protocol bits, "
+                             "trained_models/fixedpoint_binary_model.h5)")
+    args = parser.parse_args()
+    if args.binary:
+        parser.set_defaults(protocol="bits", model="trained_models/fixedpoint_binary_model.h5")
+        args = parser.parse_args()
+
+    # high value for simple edge filter and interpolation for resizing
+    highVal = args.high_val
+    interpolation = args.interpolation
+
+    # tune edge filter and interpolation on the fixed point model before using the arduino
+    sweep = args.sweep
+    sweep_high_vals = range(100, 255, 5)
+    sweep_interpolations = ("nearest", "linear", "area", "cubic")
+
+    files = photo_pipeline.find_photos(args.photos)
+
+    if sweep:
+        network = FixedPointNetwork.load(args.model)
+        results = photo_pipeline.sweep(network, files, sweep_high_vals, sweep_interpolations, binary=args.binary)
+        for acc, interp, high_val in results[:5]:
+            print("Fixed point accuracy {:.3f} with {} interpolation and edge filter {}".format(acc, interp, high_val))
+        _, interpolation, highVal = results[0]
+
+    # decode and resize all photos in parallel (cached), then edge filter and invert
+    gray = photo_pipeline.load_photos(files, 14, interpolation)
+    captured_images = photo_pipeline.finalize(gray, highVal, binary=args.binary)
+
+    pred_images = 0
+    correct_images = 0
+
+    # bits mode: the firmware has to binarize at the threshold of the model
+    threshold = (FixedPointNetwork.load(args.model).input_threshold or None) if args.binary else None
+
+    device = None
+    port = args.port
+    if args.sim:
+        from virtual_arduino import VirtualArduino
+        device = VirtualArduino(FixedPointNetwork.load(args.model))
+        device.start()
+        port = device.port
+
+    # setup arduino serial communication, reset arduino and whait for it to be ready,
+    # select protocol mode ("binary" or "ascii"), old firmware falls back to "ascii"
+    try:
+        with ArduinoClient(port, args.baudrate, protocol=args.protocol, threshold=threshold) as arduino:
+            print(arduino.port)
+            print("Protocol:", arduino.protocol)
+
+            # send images to arduino and receive results in order
+            images = (np.reshape(captured_image, (-1, 14*14)) for captured_image in captured_images)
+            predictions = arduino.predict_many(images)
+
+            for myFile, captured_image, prediction in zip(files, captured_images, predictions):
+                ref = photo_pipeline.photo_label(myFile)
+                print("Result should be %d" % ref)
+
+                newFileName = os.path.join(args.output_dir, os.path.basename(myFile))
+                cv2.imwrite(filename=newFileName, img=captured_image)
+
+                print("Prediction on Arduino: %d" % prediction)
+                if (prediction == ref):
                     correct_images += 1
-                
+
                 pred_images += 1
-                #print(int(data))
-                break    
+    finally:
+        if device is not None:
+            device.stop()
 
-result = correct_images/pred_images
-print("%d out of %d correct predicted" % (correct_images, pred_images))
-print("Accuracy: {:.3f}".format(result))
\ No newline at end of file
+    result = correct_images/pred_images
+    print("%d out of %d correct predicted" % (correct_images, pred_images))
+    print("Accuracy: {:.3f}".format(result))
@@ -0,0 +1,188 @@
+################################################################################
+# File:     architecture_search.py
+# Author:   Richard Freitag
+# Email:    richard.freitag@uadm.uu.se
+# Created:  18.10.2026
+#
+# Revisions: ---
+#
+# Description: Hardware aware search over network architectures for the
+#              Arduino Uno. Candidate networks (hidden layer size x input
+#              resolution: 14x14 from mnist_small.h5, 7x7 from mnist_tiny.h5)
+#              are trained in parallel worker processes, quantized like in
+#              "04_quantize_model.py" and scored by their fixed point accuracy
+#              and a cost model of the firmware:
+#                  flash:  PROGMEM bytes of weights and biases + program code
+#                  sram:   image buffers, layer1/layer2 accumulators + globals
+#                  cycles: estimated clock cycles of compute_network() from the
+#                          MAC count and the accumulator width (16-bit blocks
+#                          of the range analysis or 32 bits)
+#              The Pareto front (accuracy, flash, sram, cycles) of the
+#              candidates which fit into the Uno is printed and saved as JSON.
+#              A chosen point can be exported directly as network.h and
+#              fixed point model.
+#
+#              Only the 2 layer topology of the firmware is searched, deeper
+#              networks would need a generic compute_network().
+#
+#              Usage: python architecture_search.py --hidden 16 32 64 --resolutions 7 14
+#                                                   --export best
+#
+################################################################################
+
+
+import argparse
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import data_cache
+import quantization
+
+# datasets of the input resolutions (created by 01_mnist_preprocessing.py)
+DATASETS = {14: "mnist_small.h5", 7: "mnist_tiny.h5"}
+
+# Arduino Uno: 32 kB flash (0.5 kB bootloader), 2 kB SRAM, 16 MHz
+FLASH_LIMIT = 32256
+SRAM_LIMIT = 2048
+CLOCK = 16e6
+
+# rough estimates of the firmware without the network and of a multiply-accumulate
+# step incl. pgm_read_byte and loop overhead (avr-gcc -Os)
+FIRMWARE_FLASH = 4000
+FIRMWARE_SRAM = 400         # serial buffers, receive state, stack
+IMAGE_BUFFERS = 2
+CYCLES_PER_MAC_32 = 60      # 32x32 bit multiply (__mulsi3) and 32-bit add
+CYCLES_PER_MAC_16 = 14      # 16-bit multiply and add
+CYCLES_PER_BLOCK = 20       # adding a 16-bit block sum to the 32-bit accumulator
+
+
+def train_candidate(candidate):
+    """Train one candidate network (runs in a worker process), returns its float weights."""
+    import tensorflow as tf
+    from tensorflow import keras
+
+    import input_pipeline
+
+    hidden, resolution, epochs, seed = candidate
+    tf.random.set_seed(seed)
+
+    model = keras.Sequential([
+        keras.layers.Flatten(input_shape=(resolution, resolution)),
+        keras.layers.Dense(hidden, activation=tf.nn.relu),
+        keras.layers.Dense(10, activation=tf.nn.softmax),
+    ])
+    model.compile(optimizer="adam", loss="sparse_categorical_crossentropy", metrics=["accuracy"])
+    model.fit(input_pipeline.make_dataset(DATASETS[resolution], "train", seed=seed), epochs=epochs, verbose=0)
+
+    test = data_cache.open_split(DATASETS[resolution], "test")
+    _, float_accuracy = model.evaluate(test.normalized(), np.array(test.labels), verbose=0)
+
+    l1_weights, l1_bias = model.layers[1].get_weights()
+    l2_weights, l2_bias = model.layers[2].get_weights()
+    return {"hidden": hidden, "resolution": resolution, "float_accuracy": float(float_accuracy),
+            "weights": (l1_weights, l1_bias, l2_weights, l2_bias)}
+
+
+def layer_cycles(inputs, outputs, block):
+    if block <= 0:
+        return inputs * outputs * CYCLES_PER_MAC_32
+    blocks = -(-inputs // block)
+    return outputs * (inputs * CYCLES_PER_MAC_16 + blocks * CYCLES_PER_BLOCK)
+
+
+def cost_model(network, analysis, sparse=False):
+    """Estimated flash bytes, SRAM bytes and compute cycles of a FixedPointNetwork on the Uno."""
+    # image buffers with sequence numbers, long layer1/layer2 arrays
+    sram = IMAGE_BUFFERS * (network.img_size + 1) + 4 * (network.l1_size + network.l2_size) + FIRMWARE_SRAM
+    cycles = (layer_cycles(network.img_size, network.l1_size, analysis["l1_block"])
+              + layer_cycles(network.l1_size, network.l2_size, analysis["l2_block"]))
+    return {
+        "flash": int(quantization.flash_bytes(network, sparse) + FIRMWARE_FLASH),
+        "sram": int(sram),
+        "macs": int(quantization.mac_count(network, sparse)),
+        "cycles": int(cycles),
+        "ms": cycles / CLOCK * 1000,
+    }
+
+
+def score_candidate(result):
+    """Quantize a trained candidate and add fixed point accuracy and costs."""
+    network = quantization.quantize_model(*result["weights"])
+    analysis = quantization.analyze_accumulators(network)
+    # score the network with the accumulators of the exported firmware
+    network = network.with_blocks(analysis["l1_block"], analysis["l2_block"])
+
+    test = data_cache.open_split(DATASETS[result["resolution"]], "test")
+    accuracy = np.mean(network.predict(test.flat()) == test.labels)
+
+    scored = {key: value for key, value in result.items() if key != "weights"}
+    scored.update(accuracy=float(accuracy), l1_block=analysis["l1_block"], l2_block=analysis["l2_block"],
+                  **cost_model(network, analysis))
+    scored["fits"] = scored["flash"] <= FLASH_LIMIT and scored["sram"] <= SRAM_LIMIT
+    return scored, network, analysis
+
+
+def pareto_front(points, maximize=("accuracy",), minimize=("flash", "sram", "cycles")):
+    """Indices of the points which are not dominated by any other point."""
+    values = np.array([[-point[key] for key in maximize] + [point[key] for key in minimize] for point in points])
+    front = []
+    for idx, value in enumerate(values):
+        dominated = np.any(np.all(values <= value, axis=1) & np.any(values < value, axis=1))
+        if not dominated:
+            front.append(idx)
+    return front
+
+
+def search(hidden_sizes, resolutions, epochs=5, seed=0, workers=None):
+    """Train and score all candidates, returns (scored candidates, networks, analyses)."""
+    candidates = [(hidden, resolution, epochs, seed) for resolution in resolutions for hidden in hidden_sizes]
+
+    # tensorflow does not like to be forked, start fresh worker processes
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        trained = list(pool.map(train_candidate, candidates))
+    return [score_candidate(result) for result in trained]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hardware aware architecture search for the Arduino Uno")
+    parser.add_argument("--hidden", nargs="+", type=int, default=[8, 16, 24, 32, 48, 64])
+    parser.add_argument("--resolutions", nargs="+", type=int, default=[7, 14], choices=sorted(DATASETS))
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default="architecture_search.json")
+    parser.add_argument("--export", default=None,
+                        help="export a Pareto point as network.h: its index in the front or 'best' (most accurate)")
+    args = parser.parse_args()
+
+    results = search(args.hidden, args.resolutions, args.epochs, args.seed, args.workers)
+    scored = [result[0] for result in results]
+    feasible = [idx for idx, point in enumerate(scored) if point["fits"]]
+    front = [feasible[idx] for idx in pareto_front([scored[idx] for idx in feasible])]
+    front.sort(key=lambda idx: scored[idx]["cycles"])
+
+    print("Pareto front (fits into the Arduino Uno):")
+    print("  #  input  hidden  accuracy  float acc.  flash [B]  sram [B]  cycles     ms")
+    for number, idx in enumerate(front):
+        point = scored[idx]
+        print("{:3d}  {:2d}x{:<2d}  {:6d}  {:7.2f}%  {:9.2f}%  {:9d}  {:8d}  {:7d}  {:5.2f}".format(
+            number, point["resolution"], point["resolution"], point["hidden"], point["accuracy"] * 100,
+            point["float_accuracy"] * 100, point["flash"], point["sram"], point["cycles"], point["ms"]))
+
+    with open(args.output, "w") as file:
+        json.dump({"candidates": scored, "pareto_front": front}, file, indent=2)
+    print("Results written to", args.output)
+
+    if args.export is not None:
+        if args.export == "best":
+            chosen = max(front, key=lambda idx: scored[idx]["accuracy"])
+        else:
+            chosen = front[int(args.export)]
+        _, network, analysis = results[chosen]
+        quantization.write_header("network.h", network, analysis)
+        quantization.save_fixedpoint("trained_models/fixedpoint_mnist_model.h5", network, analysis)
+        print("Exported {0[resolution]}x{0[resolution]} input, {0[hidden]} hidden nodes to network.h "
+              "(use {1} for the images)".format(scored[chosen], DATASETS[scored[chosen]["resolution"]]))
@@ -0,0 +1,379 @@
+################################################################################
+# File:     arduino_client.py
+# Author:   Richard Freitag
+# Email:    richard.freitag@uadm.uu.se
+# Created:  18.10.2026
+#
+# Revisions: 18.10.2026 - timing records (firmware built with TIMING)
+#            18.10.2026 - sparse protocol
+#            18.10.2026 - bits protocol
+#
+# Description: Event driven client for "mnist_on_arduino.ino" used by
+#              "07_predict_on_arduino.py" and "08_classify_from_photos.py".
+#
+#              The port is opened, the arduino reset and the protocol
+#              negotiated once (see "serial_protocol.py"). Afterwards a
+#              background thread blocks on the port and matches the incoming
+#              results to the requests, nothing polls in_waiting.
+#              predict() returns a concurrent.futures.Future, requests are
+#              queued and sent as soon as the arduino has a free image buffer
+#              (window images in flight in pipelined, sparse and bits mode,
+#              at most PIPELINE_BUFFERS, one otherwise).
+#              predict_many() streams the predictions of an iterable of images
+#              in order.
+#
+#              Every request has to be answered within timeout seconds after
+#              it was sent, otherwise its future fails with ResponseTimeout.
+#              After a timeout, a ready banner in the middle of the session
+#              (the arduino was reset) or a lost connection the client
+#              re-synchronizes: it reconnects if necessary, resets the arduino,
+#              negotiates the protocol again and resends the requests which
+#              were in flight.
+#
+#              In bits mode the images are binarized at the threshold the
+#              arduino reports during the negotiation, the threshold of the
+#              model (threshold=) has to match it.
+#
+#              Timing records of firmware built with TIMING are decoded and
+#              passed to the on_timing callback (e.g. a board_timing.TimingCollector).
+#
+################################################################################
+
+
+import collections
+import threading
+import time
+from concurrent.futures import Future
+
+import serial
+
+import serial_protocol as sp
+
+# serial read timeout: longest time the reader blocks before it checks the deadlines
+READ_TIMEOUT = 0.1
+
+# seconds between reconnection attempts
+RECONNECT_INTERVAL = 1.0
+
+
+class _Request:
+    def __init__(self, image):
+        self.image = image
+        self.future = Future()
+        self.seq = None
+        self.deadline = None
+        self.retries = 0
+
+
+class ArduinoClient:
+    """Classifier client for one arduino, use as context manager:
+
+        with ArduinoClient('/dev/ttyACM0') as arduino:
+            digit = arduino.predict(image).result()
+            digits = list(arduino.predict_many(images))
+    """
+
+    def __init__(self, port, baudrate=1000000, protocol="pipelined", window=sp.PIPELINE_BUFFERS,
+                 timeout=2.0, reset_timeout=10, reconnect=True, retries=2, on_timing=None, threshold=None):
+        if not 1 <= window <= sp.PIPELINE_BUFFERS:
+            raise ValueError("window must be between 1 and {}, got {}".format(sp.PIPELINE_BUFFERS, window))
+        self.port = port
+        self.baudrate = baudrate
+        self.requested_protocol = protocol
+        self.protocol = None
+        self.requested_threshold = threshold    # bits mode: threshold of the model, checked against the firmware
+        self.threshold = None
+        self.window = window
+        self.timeout = timeout
+        self.reset_timeout = reset_timeout
+        self.reconnect = reconnect
+        self.retries = retries        # resends of a request after checksum/length errors
+        self.on_timing = on_timing    # called with the dict of every timing record
+        self.resyncs = 0
+
+        self._serial = None
+        self._lock = threading.RLock()
+        self._queue = collections.deque()       # requests which are not sent yet
+        self._in_flight = collections.OrderedDict()   # seq (or counter) --> request, in send order
+        self._counter = 0
+        self._ready = False
+        self._closing = False
+        self._thread = None
+        self._reset_parser()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self):
+        """Open the port, reset the arduino, negotiate the protocol and start the reader thread."""
+        self._connect()
+        self._thread = threading.Thread(target=self._run, name="arduino-client " + self.port, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Stop the reader thread and fail all requests which are not answered yet."""
+        with self._lock:
+            self._closing = True
+            self._ready = False
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            self._fail_all(sp.ProtocolError("client closed"))
+        if self._serial is not None:
+            self._serial.close()
+
+    ############################################################################
+    # requests
+
+    def predict(self, image, retries=None):
+        """Queue one flattened uint8 image, returns a Future of the predicted digit."""
+        request = _Request(image)
+        request.retries = self.retries if retries is None else retries
+        with self._lock:
+            if self._closing:
+                raise sp.ProtocolError("client closed")
+            self._queue.append(request)
+            self._pump()
+        return request.future
+
+    def predict_many(self, images, lookahead=None):
+        """Yield the predictions of images in order, at most lookahead requests are queued."""
+        lookahead = lookahead or 2 * self.window
+        pending = collections.deque()
+        for image in images:
+            pending.append(self.predict(image))
+            if len(pending) >= lookahead:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    @property
+    def capacity(self):
+        """Number of requests the arduino accepts at once."""
+        return self.window if self.protocol in sp.TAGGED_PROTOCOLS else 1
+
+    def _next_seq(self):
+        # modes with sequence numbers: sequence number which is not in flight, otherwise an increasing key
+        while True:
+            self._counter += 1
+            seq = self._counter & 0xFF if self.protocol in sp.TAGGED_PROTOCOLS else self._counter
+            if seq not in self._in_flight:
+                return seq
+
+    def _encode(self, request):
+        if self.protocol in sp.TAGGED_PROTOCOLS:
+            return sp.tagged_encoder(self.protocol, self.threshold)(request.image, request.seq)
+        return sp.ENCODERS[self.protocol](request.image)
+
+    def _pump(self):
+        """Send queued requests while the arduino has free image buffers (lock held)."""
+        while self._ready and self._queue and len(self._in_flight) < self.capacity:
+            request = self._queue.popleft()
+            if request.future.cancelled():
+                continue
+            request.seq = self._next_seq()
+            request.deadline = None if self.timeout is None else time.monotonic() + self.timeout
+            self._in_flight[request.seq] = request
+            try:
+                self._serial.write(self._encode(request))
+            except (serial.SerialException, OSError):
+                # the reader notices the lost connection and resends the request
+                self._ready = False
+
+    def _complete(self, request, value):
+        """Resolve a request with a result frame (binary modes) or a digit (ascii)."""
+        if self.protocol != "ascii":
+            try:
+                value = sp.decode_result_byte(value)
+            except sp.ProtocolError as error:
+                if value in (sp.ERROR_CHECKSUM, sp.ERROR_LENGTH):
+                    self._retry(request, error)
+                elif not request.future.done():
+                    request.future.set_exception(error)
+                return
+        if not request.future.done():
+            request.future.set_result(value)
+
+    def _retry(self, request, error):
+        """Transmission error: send the image again, fail the request if it has no retries left."""
+        if request.retries > 0:
+            request.retries -= 1
+            self._queue.appendleft(request)
+        elif not request.future.done():
+            request.future.set_exception(error)
+
+    def _fail_all(self, error):
+        requests = list(self._in_flight.values()) + list(self._queue)
+        self._in_flight.clear()
+        self._queue.clear()
+        for request in requests:
+            if not request.future.done():
+                request.future.set_exception(error)
+
+    ############################################################################
+    # connection
+
+    def _connect(self, reset=True):
+        """Open the port (if needed), reset the arduino and negotiate the protocol."""
+        if self._serial is None or not self._serial.is_open:
+            self._serial = serial.Serial(self.port, self.baudrate, timeout=READ_TIMEOUT)
+            reset = True
+        if reset:
+            sp.reset_arduino(self._serial, self.reset_timeout)
+        protocol, threshold = sp.negotiate(self._serial, self.requested_protocol)
+        sp.check_threshold(threshold, self.requested_threshold)
+        with self._lock:
+            self.protocol = protocol
+            self.threshold = threshold
+            self._reset_parser()
+            self._ready = True
+            self._pump()
+
+    def _resync(self, reset=True):
+        """Put the requests in flight back into the queue and connect again.
+
+        reset=False if the arduino has just been reset (ready banner received).
+        """
+        with self._lock:
+            self._ready = False
+            self.resyncs += 1
+            self._queue.extendleft(reversed(self._in_flight.values()))
+            self._in_flight.clear()
+
+        while not self._closing:
+            try:
+                self._connect(reset)
+                return
+            except (serial.SerialException, OSError, sp.ProtocolError):
+                if not self.reconnect:
+                    with self._lock:
+                        self._fail_all(sp.ProtocolError("connection to {} lost".format(self.port)))
+                        self._closing = True
+                    return
+                if self._serial is not None:
+                    self._serial.close()
+                reset = True
+                self._expire(waiting=True)
+                time.sleep(RECONNECT_INTERVAL)
+
+    def _expire(self, waiting=False):
+        """Fail requests which are not answered in time, returns True if one was in flight.
+
+        While the arduino is not connected (waiting=True) the queued requests
+        time out as well.
+        """
+        now = time.monotonic()
+        expired = False
+        with self._lock:
+            requests = list(self._in_flight.items())
+            if waiting:
+                requests += [(None, request) for request in self._queue]
+            for key, request in requests:
+                if request.deadline is None and self.timeout is not None:
+                    request.deadline = now + self.timeout
+                if request.deadline is not None and now > request.deadline:
+                    if key is not None:
+                        del self._in_flight[key]
+                        expired = True
+                    else:
+                        self._queue.remove(request)
+                    if not request.future.done():
+                        request.future.set_exception(sp.ResponseTimeout("no response from arduino"))
+        return expired
+
+    ############################################################################
+    # reader thread
+
+    def _reset_parser(self):
+        self._text = b""
+        self._code = None           # pipelined mode: result byte waiting for its sequence number
+        self._timing = None         # bytes of a timing record which is being received
+        self._result_line = False   # ascii mode: RESULT line was received
+
+    def _run(self):
+        while not self._closing:
+            try:
+                data = self._serial.read(self._serial.in_waiting or 1)
+            except (serial.SerialException, OSError, TypeError):
+                # TypeError: pyserial reading from a port closed by another thread
+                if not self._closing:
+                    self._resync()
+                continue
+
+            banner = False
+            if data:
+                with self._lock:
+                    banner = self._parse(data)
+                    self._pump()
+            if banner:
+                # the arduino was reset, it is in ascii mode again and lost the images in flight
+                self._resync(reset=False)
+            elif self._expire():
+                # the arduino lost a frame, its state is unknown
+                self._resync()
+
+    def _parse(self, data):
+        """Match received bytes to the requests in flight, returns True if the ready banner was seen."""
+        if self.protocol == "ascii":
+            self._text += data
+            *lines, self._text = self._text.split(b"\n")
+            return any(self._parse_line(line.decode(errors="ignore")) for line in lines)
+
+        reset = False
+        for value in data:
+            if self._timing is not None:
+                self._timing.append(value)
+                if len(self._timing) == sp.TIMING_SIZE:
+                    self._report_timing(sp.decode_timing(self._timing))
+                    self._timing = None
+            elif self._code is None and value == sp.TIMING_FRAME:
+                self._timing = bytearray()
+            elif self._code is not None:
+                request = self._in_flight.pop(value, None)
+                if request is not None:
+                    self._complete(request, self._code)
+                self._code = None
+            elif value >= 0x80:
+                # result and error frames (text is 7-bit ASCII)
+                if self.protocol in sp.TAGGED_PROTOCOLS:
+                    self._code = value
+                elif self._in_flight:
+                    self._complete(self._in_flight.popitem(last=False)[1], value)
+            elif value == ord("\n"):
+                reset |= sp.READY_BANNER in self._text.decode(errors="ignore")
+                self._text = b""
+            else:
+                self._text += bytes((value,))
+        return reset
+
+    def _report_timing(self, record):
+        if self.on_timing is not None:
+            self.on_timing(record)
+
+    def _parse_line(self, line):
+        if sp.READY_BANNER in line:
+            return True
+        try:
+            record = sp.parse_timing_line(line)
+        except ValueError:
+            return False        # garbled timing record, dropped
+        if record is not None:
+            self._report_timing(record)
+            return False
+        if sp.RESULT_LINE in line:
+            self._result_line = True
+        elif self._result_line and line.strip():
+            self._result_line = False
+            if self._in_flight:
+                request = self._in_flight.popitem(last=False)[1]
+                try:
+                    digit = int(line)
+                except ValueError:
+                    self._retry(request, sp.ProtocolError("unexpected result line {!r}".format(line.strip())))
+                    return False
+                self._complete(request, digit)
+        return False
@@ -0,0 +1,215 @@
+################################################################################
+# File:     artifacts.py
+# Author:   Richard Freitag
+# Email:    richard.freitag@uadm.uu.se
+# Created:  18.10.2026
+#
+# Revisions: 18.10.2026 - checksum published in a zenodo record
+#
+# Description: Download and extraction of the dataset and model archive, as
+#              used by "00_download_data.py".
+#              The archive is streamed to disk in chunks into a ".part" file
+#              which is renamed when it is complete. An interrupted download
+#              is resumed with an HTTP range request (servers which ignore the
+#              range restart it). The checksum ("md5:<hex>", "sha256:<hex>",
+#              ...) is computed while streaming and verified before the archive
+#              is used. published_checksum() looks up the md5 a zenodo record
+#              lists for a file.
+#              Only the archive members matching a list of patterns are
+#              extracted (each one atomically). A small JSON marker records the
+#              archive checksum and the sizes and CRCs of the extracted files;
+#              if they are all present the download is skipped completely.
+#
+################################################################################
+
+
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
+import time
+import zipfile
+import zlib
+
+import requests
+
+CHUNK_SIZE = 1 << 20
+TIMEOUT = 30
+RETRIES = 5
+MARKER = ".artifacts.json"
+
+
+class ChecksumError(Exception):
+    """The downloaded archive does not match the expected checksum."""
+
+
+def _hasher(checksum):
+    algorithm = checksum.split(":", 1)[0] if checksum else "sha256"
+    return hashlib.new(algorithm)
+
+
+def _format_checksum(hasher):
+    return "{}:{}".format(hasher.name, hasher.hexdigest())
+
+
+def _hash_file(hasher, filename, chunk_size=CHUNK_SIZE):
+    """Add the contents of a file to hasher, returns the number of bytes."""
+    size = 0
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            hasher.update(chunk)
+            size += len(chunk)
+    return size
+
+
+def _check(hasher, checksum, filename):
+    actual = _format_checksum(hasher)
+    if checksum and actual.lower() != checksum.lower():
+        raise ChecksumError("{}: expected {}, got {}".format(filename, checksum, actual))
+    return actual
+
+
+def published_checksum(record_url, filename, timeout=TIMEOUT):
+    """Checksum ("md5:<hex>") of filename listed in the JSON of a zenodo record (its /api/records/ URL)."""
+    response = requests.get(record_url, timeout=timeout)
+    response.raise_for_status()
+    for entry in response.json().get("files", []):
+        if entry.get("key", entry.get("filename")) == filename and entry.get("checksum"):
+            return entry["checksum"]
+    raise ChecksumError("{}: no checksum listed in {}".format(filename, record_url))
+
+
+def download(url, filename, checksum=None, chunk_size=CHUNK_SIZE, timeout=TIMEOUT, retries=RETRIES):
+    """Stream url to filename, resuming a partial download, returns the checksum of the file.
+
+    An existing complete file is only verified. With checksum=None nothing is
+    verified, the sha256 checksum of the file is returned.
+    """
+    if os.path.exists(filename):
+        hasher = _hasher(checksum)
+        _hash_file(hasher, filename, chunk_size)
+        return _check(hasher, checksum, filename)
+
+    part = filename + ".part"
+    for attempt in range(retries + 1):
+        # hash the data which is already on disk, then continue with the stream
+        hasher = _hasher(checksum)
+        offset = _hash_file(hasher, part, chunk_size) if os.path.exists(part) else 0
+
+        headers = {"Range": "bytes={}-".format(offset)} if offset else {}
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=timeout, allow_redirects=True) as response:
+                if response.status_code == 416:
+                    # the part file is already complete
+                    break
+                response.raise_for_status()
+                if offset and response.status_code != 206:
+                    # range not supported, start again
+                    hasher = _hasher(checksum)
+                    offset = 0
+                with open(part, "ab" if offset else "wb") as file:
+                    for chunk in response.iter_content(chunk_size):
+                        file.write(chunk)
+                        hasher.update(chunk)
+            break
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+            if attempt == retries:
+                raise
+            time.sleep(min(2 ** attempt, 30))
+
+    try:
+        actual = _check(hasher, checksum, filename)
+    except ChecksumError:
+        os.remove(part)
+        raise
+    os.replace(part, filename)
+    return actual
+
+
+def _matches(name, patterns):
+    # patterns match the member path, optionally below one top level directory
+    return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(name, "*/" + pattern) for pattern in patterns)
+
+
+def _target(dest, name):
+    target = os.path.realpath(os.path.join(dest, name))
+    if os.path.commonpath([target, os.path.realpath(dest)]) != os.path.realpath(dest):
+        raise ValueError("archive member outside of the destination: " + name)
+    return target
+
+
+def extract(archive, dest=".", patterns=("*",)):
+    """Extract the members of a zip archive matching patterns, returns {name: {size, crc}}."""
+    extracted = {}
+    with zipfile.ZipFile(archive, "r") as zip_file:
+        for info in zip_file.infolist():
+            if info.is_dir() or not _matches(info.filename, patterns):
+                continue
+            target = _target(dest, info.filename)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with zip_file.open(info) as source, open(target + ".part", "wb") as file:
+                shutil.copyfileobj(source, file, CHUNK_SIZE)
+            os.replace(target + ".part", target)
+            extracted[info.filename] = {"size": info.file_size, "crc": info.CRC}
+
+        names = zip_file.namelist()
+
+    missing = [pattern for pattern in patterns if not any(_matches(name, [pattern]) for name in extracted)]
+    if missing:
+        raise FileNotFoundError("no members of {} match {} (members: {})".format(
+            archive, ", ".join(missing), ", ".join(names)))
+    return extracted
+
+
+def _crc(filename, chunk_size=CHUNK_SIZE):
+    crc = 0
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def verified(dest=".", checksum=None, patterns=("*",), deep=False):
+    """True if all files of the marker in dest are present with the recorded sizes.
+
+    The marker has to be from the same archive and patterns, deep=True also checks the CRCs.
+    """
+    try:
+        with open(os.path.join(dest, MARKER)) as file:
+            marker = json.load(file)
+    except (OSError, ValueError):
+        return False
+    if checksum and marker.get("checksum", "").lower() != checksum.lower():
+        return False
+    if marker.get("patterns") != list(patterns):
+        return False
+
+    for name, info in marker.get("members", {}).items():
+        target = os.path.join(dest, name)
+        if not os.path.isfile(target) or os.path.getsize(target) != info["size"]:
+            return False
+        if deep and _crc(target) != info["crc"]:
+            return False
+    return True
+
+
+def fetch(url, archive, dest=".", checksum=None, patterns=("*",), keep_archive=False, deep=False):
+    """Download, verify and extract an archive unless the extracted files are already verified.
+
+    Returns False if nothing had to be done.
+    """
+    if verified(dest, checksum, patterns, deep):
+        return False
+
+    actual = download(url, archive, checksum)
+    members = extract(archive, dest, patterns)
+
+    marker = os.path.join(dest, MARKER)
+    with open(marker + ".part", "w") as file:
+        json.dump({"url": url, "checksum": actual, "patterns": list(patterns), "members": members}, file, indent=2)
+    os.replace(marker + ".part", marker)
+
+    if not keep_archive:
+        os.remove(archive)
+    return True
@@ -0,0 +1,343 @@
+################################################################################
+# File:     benchmark.py
+# Author:   Richard Freitag
+# Email:    richard.freitag@uadm.uu.se
+# Created:  18.10.2026
+#
+# Revisions: 18.10.2026 - sparse protocol, bytes and MACs per image
+#            18.10.2026 - bits protocol
+#            18.10.2026 - response timeouts, protocol errors for unknown results
+#
+# Description: Benchmark suite for the host side inference over the serial
+#              port. Every combination of image count, protocol variant and
+#              target (a serial port or "sim" for the virtual arduino) is run
+#              on a fixed, seeded subset of the mnist_small.h5 test images
+#              after a number of warm-up images.
+#
+#              For every image the time is split into
+#                  transmit: writing the frame to the serial port
+#                  wait:     end of the write until the first response byte
+#                  parse:    first response byte until the decoded result
+#              and latency percentiles (p50/p95/p99), images/sec and the
+#              accuracy are reported. The results are written as JSON to
+#              track regressions across firmware and host changes.
+#
+#              For the images of every count (and the photos of
+#              "08_classify_from_photos.py" with --photos) the average frame
+#              size of every protocol and the MACs per image of the dense
+#              network and with the zero pixels skipped (as computed by the
+#              firmware) are reported as well. Both shrink with the number of
+#              zero pixels in the sparse protocol. The bits protocol is only
+#              run on firmware of a network with binarized input (--model of
+#              "04_quantize_model.py --binary" for target "sim"), its frame
+#              size is always reported.
+#
+#              Usage: python benchmark.py --targets sim /dev/ttyACM0
+#                                         --protocols ascii binary pipelined sparse bits
+#                                         --counts 100 1000 --output bench.json
+#                                         [--photos "Raw_Photos/*.jpg"]
+#
+################################################################################
+
+
+import argparse
+import contextlib
+import json
+import platform
+import time
+
+import h5py
+import numpy as np
+import serial
+
+import quantization
+import serial_protocol as sp
+
+PHASES = ("transmit", "wait", "parse")
+PERCENTILES = (50, 95, 99)
+
+# seconds the arduino has to answer a request, a sp.ResponseTimeout is raised otherwise
+TIMEOUT = 2.0
+
+
+def load_images(filename="mnist_small.h5", count=1000, warmup=20, seed=0):
+    """Fixed random subset of the test set: count + warmup images, labels and indices."""
+    with h5py.File(filename, "r") as file:
+        total = file["test_images"].shape[0]
+        indices = np.sort(np.random.default_rng(seed).choice(total, min(total, count + warmup), replace=False))
+        images = file["test_images"][indices]
+        labels = file["test_labels"][indices]
+    return images.reshape(len(images), -1), labels, indices
+
+
+def load_photos(pattern="Raw_Photos/*.jpg", high_val=180, interpolation="nearest"):
+    """Preprocessed photos of "08_classify_from_photos.py" (N, 196)."""
+    import photo_pipeline
+
+    files = photo_pipeline.find_photos(pattern)
+    if not files:
+        raise FileNotFoundError("no photos match '{}'".format(pattern))
+    images = photo_pipeline.finalize(photo_pipeline.load_photos(files, 14, interpolation), high_val)
+    return images.reshape(len(images), -1)
+
+
+def frame_bytes(images, protocol):
+    """Average number of bytes sent per image by the host with the given protocol."""
+    if protocol in sp.TAGGED_PROTOCOLS:
+        sizes = [len(sp.TAGGED_ENCODERS[protocol](image, 0)) for image in images]
+    else:
+        sizes = [len(sp.ENCODERS[protocol](image)) for image in images]
+    return float(np.mean(sizes))
+
+
+def encoding_stats(images, network, protocols):
+    """Nonzero pixels, bytes per image of every protocol and MACs per image (dense and zero pixels skipped)."""
+    return {
+        "images": len(images),
+        "nonzero_pixels": float(np.count_nonzero(images, axis=1).mean()),
+        "bytes_per_image": {protocol: frame_bytes(images, protocol) for protocol in protocols},
+        "macs_per_image": {"dense": int(quantization.mac_count(network)),
+                           "skip_zero": quantization.input_mac_count(network, images)},
+    }
+
+
+def format_stats(name, stats):
+    frames = "  ".join("{} {:.1f}".format(protocol, size) for protocol, size in stats["bytes_per_image"].items())
+    return ("{} ({} images, {:.1f} nonzero pixels): bytes/image {}  MACs/image {} dense, {:.0f} zero pixels skipped"
+            .format(name, stats["images"], stats["nonzero_pixels"], frames, stats["macs_per_image"]["dense"],
+                    stats["macs_per_image"]["skip_zero"]))
+
+
+@contextlib.contextmanager
+def open_target(target, baudrate=1000000, sim_options=None):
+    """Open a serial port (or a virtual arduino for target "sim") and wait until it is ready."""
+    device = None
+    if target == "sim":
+        from fixedpoint import FixedPointNetwork
+        from virtual_arduino import VirtualArduino
+
+        options = dict(sim_options or {})
+        model = options.pop("model", "trained_models/fixedpoint_mnist_model.h5")
+        device = VirtualArduino(FixedPointNetwork.load(model), baudrate, **options)
+        device.start()
+        target = device.port
+
+    arduino = serial.Serial(target, baudrate, timeout=0.050)
+    try:
+        sp.reset_arduino(arduino)
+        yield arduino
+    finally:
+        arduino.close()
+        if device is not None:
+            device.stop()
+
+
+def _read_byte(arduino, timeout=TIMEOUT):
+    deadline = time.perf_counter() + timeout
+    data = arduino.read(1)
+    while not data:
+        if time.perf_counter() > deadline:
+            raise sp.ResponseTimeout("no response from arduino within {} s".format(timeout))
+        data = arduino.read(1)
+    return data
+
+
+def _timed_request(arduino, image, protocol, timeout=TIMEOUT):
+    """Send one image and return (prediction, (transmit, wait, parse)).
+
+    Raises a sp.ResponseTimeout if the arduino does not answer within timeout
+    seconds and a sp.ProtocolError for error frames and garbled results.
+    """
+    frame = sp.ENCODERS[protocol](image)
+
+    t_start = time.perf_counter()
+    arduino.write(frame)
+    t_sent = time.perf_counter()
+    first = _read_byte(arduino, timeout)
+    t_first = time.perf_counter()
+
+    if protocol == "binary":
+        prediction = sp.decode_result_byte(first[0])
+    else:
+        line = first.decode(errors="ignore") + sp.read_line(arduino, timeout)
+        while sp.RESULT_LINE not in line:
+            line = sp.read_line(arduino, timeout)
+        line = sp.read_line(arduino, timeout)
+        try:
+            prediction = int(line)
+        except ValueError:
+            raise sp.ProtocolError("unexpected result line {!r}".format(line.strip())) from None
+    t_done = time.perf_counter()
+
+    return prediction, (t_sent - t_start, t_first - t_sent, t_done - t_first)
+
+
+def _run_sequential(arduino, images, protocol, timeout=TIMEOUT):
+    predictions = np.zeros(len(images), dtype=np.int64)
+    phases = np.zeros((len(images), len(PHASES)))
+    for idx, image in enumerate(images):
+        predictions[idx], phases[idx] = _timed_request(arduino, image, protocol, timeout)
+    return predictions, phases
+
+
+def _run_pipelined(arduino, images, window, encode=sp.encode_pipelined, timeout=TIMEOUT):
+    predictions = np.zeros(len(images), dtype=np.int64)
+    phases = np.zeros((len(images), len(PHASES)))
+    in_flight = {}      # sequence number --> (image index, end of write)
+    next_idx = 0
+
+    while next_idx < len(images) or in_flight:
+        while next_idx < len(images) and len(in_flight) < window:
+            seq = next_idx & 0xFF
+            t_start = time.perf_counter()
+            arduino.write(encode(images[next_idx], seq))
+            t_sent = time.perf_counter()
+            phases[next_idx, 0] = t_sent - t_start
+            in_flight[seq] = (next_idx, t_sent)
+            next_idx += 1
+
+        first = _read_byte(arduino, timeout)
+        t_first = time.perf_counter()
+        seq = _read_byte(arduino, timeout)[0]
+        try:
+            digit = sp.decode_result_byte(first[0])
+        except sp.ProtocolError as error:
+            error.seq = seq
+            raise
+        t_done = time.perf_counter()
+
+        if seq not in in_flight:
+            raise sp.ProtocolError("result 0x{:02X} for unknown sequence number {}".format(first[0], seq))
+        idx, t_sent = in_flight.pop(seq)
+        predictions[idx] = digit
+        phases[idx, 1:] = t_first - t_sent, t_done - t_first
+
+    return predictions, phases
+
+
+def _summary(values_ms):
+    summary = {"p{}".format(p): float(np.percentile(values_ms, p)) for p in PERCENTILES}
+    summary["mean"] = float(np.mean(values_ms))
+    return summary
+
+
+def run_case(arduino, images, labels, protocol, warmup=20, window=sp.PIPELINE_BUFFERS, threshold=None):
+    """Benchmark one protocol on an opened arduino, the first warmup images are not counted.
+
+    threshold is the binarization threshold of the model, checked in bits mode.
+    """
+    active, active_threshold = sp.negotiate(arduino, protocol)
+    if active != protocol:
+        return {"protocol": protocol, "skipped": "firmware answered with protocol '{}'".format(active)}
+    try:
+        sp.check_threshold(active_threshold, threshold)
+    except sp.ProtocolError as error:
+        return {"protocol": protocol, "skipped": str(error)}
+
+    run = (lambda batch: _run_pipelined(arduino, batch, window, sp.tagged_encoder(protocol, active_threshold))) \
+        if protocol in sp.TAGGED_PROTOCOLS else (lambda batch: _run_sequential(arduino, batch, protocol))
+
+    run(images[:warmup])
+    start = time.perf_counter()
+    predictions, phases = run(images[warmup:])
+    wall = time.perf_counter() - start
+
+    phases_ms = phases * 1000
+    result = {
+        "protocol": protocol,
+        "images": len(predictions),
+        "wall_s": wall,
+        "images_per_sec": len(predictions) / wall,
+        "latency_ms": _summary(phases_ms.sum(axis=1)),
+        "phases_ms": {name: _summary(phases_ms[:, i]) for i, name in enumerate(PHASES)},
+        "accuracy": float(np.mean(predictions == labels[warmup:])),
+    }
+    if protocol in sp.TAGGED_PROTOCOLS:
+        result["window"] = window
+    return result
+
+
+def run_suite(targets, protocols, counts, dataset="mnist_small.h5", warmup=20, seed=0,
+              window=sp.PIPELINE_BUFFERS, baudrate=1000000, sim_options=None, photos=None):
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "dataset": dataset,
+            "warmup": warmup,
+            "seed": seed,
+            "baudrate": baudrate,
+            "sim_options": sim_options or {},
+        },
+        "results": [],
+        "encoding": [],
+    }
+
+    from fixedpoint import FixedPointNetwork
+
+    network = FixedPointNetwork.load((sim_options or {}).get("model", "trained_models/fixedpoint_mnist_model.h5"))
+    if photos is not None:
+        stats = encoding_stats(load_photos(photos), network, protocols)
+        stats.update(source=photos)
+        report["encoding"].append(stats)
+        print(format_stats(photos, stats))
+
+    for count in counts:
+        images, labels, indices = load_images(dataset, count, warmup, seed)
+        stats = encoding_stats(images[warmup:], network, protocols)
+        stats.update(source=dataset, count=count)
+        report["encoding"].append(stats)
+        print(format_stats("{} n={}".format(dataset, count), stats))
+        for target in targets:
+            for protocol in protocols:
+                # every case starts from a freshly reset arduino
+                with open_target(target, baudrate, sim_options) as arduino:
+                    result = run_case(arduino, images, labels, protocol, warmup, window,
+                                      network.input_threshold or None)
+                result.update(target=target, count=count)
+                report["results"].append(result)
+                print(format_result(result))
+
+    return report
+
+
+def format_result(result):
+    if "skipped" in result:
+        return "{target} {protocol:9s} n={count}: skipped ({skipped})".format(**result)
+    return ("{target} {protocol:9s} n={count}: {ips:8.1f} img/s  latency p50 {p50:.2f} p95 {p95:.2f} "
+            "p99 {p99:.2f} ms  (transmit {tx:.2f} / wait {wait:.2f} / parse {parse:.2f} ms)  acc {acc:.4f}"
+            .format(target=result["target"], protocol=result["protocol"], count=result["count"],
+                    ips=result["images_per_sec"], acc=result["accuracy"], **result["latency_ms"],
+                    tx=result["phases_ms"]["transmit"]["p50"], wait=result["phases_ms"]["wait"]["p50"],
+                    parse=result["phases_ms"]["parse"]["p50"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark host side inference on the arduino")
+    parser.add_argument("--targets", nargs="+", default=["sim"], help="serial ports and/or 'sim'")
+    parser.add_argument("--protocols", nargs="+", default=["ascii", "binary", "pipelined", "sparse", "bits"],
+                        choices=sorted(sp.PROTOCOLS))
+    parser.add_argument("--counts", nargs="+", type=int, default=[1000], help="numbers of measured images")
+    parser.add_argument("--dataset", default="mnist_small.h5")
+    parser.add_argument("--photos", default=None, help="also report bytes and MACs per image of these photos")
+    parser.add_argument("--model", default="trained_models/fixedpoint_mnist_model.h5",
+                        help="fixed point model (MACs per image and virtual arduino)")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--window", type=int, default=sp.PIPELINE_BUFFERS,
+                        help="images in flight (tagged protocols), at most {}".format(sp.PIPELINE_BUFFERS))
+    parser.add_argument("--baudrate", type=int, default=1000000)
+    parser.add_argument("--sim-byte-latency", type=float, default=0.0)
+    parser.add_argument("--sim-compute-delay", type=float, default=0.0)
+    parser.add_argument("--output", default="bench.json")
+    args = parser.parse_args()
+    if not 1 <= args.window <= sp.PIPELINE_BUFFERS:
+        parser.error("--window must be between 1 and {}".format(sp.PIPELINE_BUFFERS))
+
+    report = run_suite(args.targets, args.protocols, args.counts, args.dataset, args.warmup, args.seed,
+                       args.window, args.baudrate, {"model": args.model, "byte_latency": args.sim_byte_latency,
+                                                    "compute_delay": args.sim_compute_delay}, args.photos)
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print("Results written to", args.output)
@@ -0,0 +1,136 @@
+################################################################################
+# File:     board_timing.py
+# Author:   Richard Freitag
+# Email:    richard.freitag@uadm.uu.se
+# Created:  18.10.2026
+#
+# Revisions: ---
+#
+# Description: Collector for the on-board timing records of
+#              "mnist_on_arduino.ino" built with TIMING (see
+#              "serial_protocol.py" for the record format). Every result is
+#              followed by the durations of the phases of its image, measured
+#              with micros() on the board:
+#                  receive:   first byte of the frame until the frame is complete
+#                  parse:     parse_buffer()/atoi() (ASCII mode only)
+#                  wait:      frame complete until compute_network() starts
+#                  layer1:    layer 1 MAC loops (without poll)
+#                  layer2:    layer 2 MAC loops
+#                  poll:      receiving the next image during compute_network()
+#                  send:      send_result()
+#              and the free SRAM between heap and stack in compute_network().
+#              The records are aggregated into per-phase statistics and
+#              histograms.
+#
+#              Usage: python board_timing.py --port /dev/ttyACM0 --protocol pipelined
+#                     python board_timing.py --sim --sim-compute-delay 0.004
+#
+################################################################################
+
+
+import argparse
+import json
+
+import numpy as np
+
+import serial_protocol as sp
+
+HISTOGRAM_WIDTH = 40
+
+
+class TimingCollector:
+    """Aggregates timing records, can be used directly as on_timing callback of ArduinoClient."""
+
+    def __init__(self, fields=sp.TIMING_FIELDS):
+        self.fields = fields
+        self.records = {field: [] for field in fields}
+
+    def __call__(self, record):
+        for field in self.fields:
+            self.records[field].append(record[field])
+
+    def __len__(self):
+        return len(self.records[self.fields[0]])
+
+    def values(self, field):
+        return np.array(self.records[field], dtype=np.int64)
+
+    def summary(self):
+        """Mean, median, 95th percentile and maximum of every field."""
+        result = {}
+        for field in self.fields:
+            values = self.values(field)
+            if len(values):
+                result[field] = {"mean": float(values.mean()), "p50": float(np.percentile(values, 50)),
+                                 "p95": float(np.percentile(values, 95)), "max": int(values.max())}
+        return result
+
+    def histogram(self, field, bins=10):
+        """(counts, bin edges) of one field."""
+        return np.histogram(self.values(field), bins=bins)
+
+    def format_summary(self):
+        lines = ["{:>10}  {:>9}  {:>9}  {:>9}  {:>9}".format("phase", "mean", "p50", "p95", "max")]
+        for field, stats in self.summary().items():
+            unit = "B" if field == "free_sram" else "us"
+            lines.append("{:>10}  {:7.1f}{:2}  {:7.1f}{:2}  {:7.1f}{:2}  {:7d}{:2}".format(
+                field, stats["mean"], unit, stats["p50"], unit, stats["p95"], unit, stats["max"], unit))
+        return "\n".join(lines)
+
+    def format_histogram(self, field, bins=10, width=HISTOGRAM_WIDTH):
+        counts, edges = self.histogram(field, bins)
+        scale = width / max(counts.max(), 1)
+        lines = ["{} ({} records)".format(field, len(self))]
+        for count, low, high in zip(counts, edges[:-1], edges[1:]):
+            lines.append("  {:9.1f} - {:9.1f}  {:6d}  {}".format(low, high, count, "#" * int(round(count * scale))))
+        return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Collect on-board timing records (firmware built with TIMING)")
+    parser.add_argument("--port", help="serial port of the arduino")
+    parser.add_argument("--sim", action="store_true", help="use a virtual arduino instead of --port")
+    parser.add_argument("--sim-compute-delay", type=float, default=0.004)
+    parser.add_argument("--model", default="trained_models/fixedpoint_mnist_model.h5")
+    parser.add_argument("--dataset", default="mnist_small.h5")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--protocol", default="pipelined", choices=sorted(sp.PROTOCOLS))
+    parser.add_argument("--bins", type=int, default=10)
+    parser.add_argument("--output", help="write all records as JSON")
+    args = parser.parse_args()
+
+    import data_cache
+    from arduino_client import ArduinoClient
+
+    images = data_cache.open_split(args.dataset, "test").flat(0, args.count)
+    collector = TimingCollector()
+
+    device = None
+    port = args.port
+    if args.sim:
+        from fixedpoint import FixedPointNetwork
+        from virtual_arduino import VirtualArduino
+        device = VirtualArduino(FixedPointNetwork.load(args.model), compute_delay=args.sim_compute_delay, timing=True)
+        device.start()
+        port = device.port
+    elif port is None:
+        parser.error("--port or --sim is required")
+
+    try:
+        with ArduinoClient(port, protocol=args.protocol, on_timing=collector) as arduino:
+            print("Protocol:", arduino.protocol)
+            predictions = list(arduino.predict_many(images))
+            print("Classified {} images".format(len(predictions)))
+    finally:
+        if device is not None:
+            device.stop()
+
+    if not len(collector):
+        print("No timing records received, is the firmware built with TIMING?")
+    else:
+        print(collector.format_summary())
+        for field in collector.fields:
+            print(collector.format_histogram(field, args.bins))
+        if args.output:
+            with open(args.output, "w") as file:
+                json.dump(collector.records, file)
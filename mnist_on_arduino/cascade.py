@@ -0,0 +1,178 @@
+################################################################################
+# File:     cascade.py
+# Author:   Richard Freitag
+# Email:    richard.freitag@uadm.uu.se
+# Created:  18.10.2026
+#
+# Revisions: ---
+#
+# Description: Early-exit cascade of two fixed point networks as computed by
+#              the firmware (CASCADE in network.h):
+#                  stage 1: a small network on the 7x7 image, 2x2 max pooled
+#                           on the arduino from the received 14x14 image
+#                           (the same as the 7x7 dataset mnist_tiny.h5)
+#                  stage 2: the 14x14 network
+#              If the margin between the two largest outputs of stage 1 is
+#              at least the exit margin, its first largest output is the
+#              result and stage 2 is skipped. Easy digits only cost the MACs
+#              of stage 1.
+#
+#              The threshold table evaluates all exit margins at once from
+#              one computation of both stages: exit rate, average MACs per
+#              image and accuracy. "04_quantize_model.py" uses it to choose
+#              the exported margin on the training set.
+#
+#              The first stage is trained with
+#                  python 03_mnist_small_training.py --stage1
+#              and exported together with the 14x14 network by
+#                  python 04_quantize_model.py --stage1-model trained_models/tiny_mnist_model.h5
+#
+#              Usage: python cascade.py [--stage1 trained_models/fixedpoint_tiny_model.h5]
+#
+################################################################################
+
+
+import argparse
+
+import numpy as np
+
+import quantization
+from fixedpoint import BATCH_SIZE, FixedPointNetwork, argmax_firmware
+
+# the first stage gets the image max pooled in POOL x POOL blocks (14x14 --> 7x7)
+POOL = 2
+
+# largest exit margin of network.h (never exit)
+NEVER = 2 ** 31 - 1
+
+
+def pool_images(images, pool=POOL):
+    """Max pooling of square uint8 images (N, side * side) or (N, side, side) like the firmware."""
+    images = np.asarray(images)
+    side = int(round(np.sqrt(images[0].size)))
+    images = images.reshape(len(images), side // pool, pool, side // pool, pool)
+    return images.max(axis=(2, 4)).reshape(len(images), -1)
+
+
+def top_margins(logits):
+    """First largest output (digit) and difference of the two largest outputs of every image."""
+    top2 = np.partition(logits, -2, axis=1)[:, -2:]
+    return np.argmax(logits, axis=1), top2[:, 1] - top2[:, 0]
+
+
+class Cascade:
+    """Stage 1 FixedPointNetwork on pooled images and stage 2 FixedPointNetwork, same interface as the networks."""
+
+    def __init__(self, stage1, stage2, exit_margin, pool=POOL):
+        self.stage1 = stage1
+        self.stage2 = stage2
+        self.exit_margin = int(exit_margin)
+        self.pool = pool
+
+        self.img_size = stage2.img_size
+        self.l2_size = stage2.l2_size
+
+    @classmethod
+    def load(cls, stage1_file="trained_models/fixedpoint_tiny_model.h5",
+             stage2_file="trained_models/fixedpoint_mnist_model.h5"):
+        """Load the fixed point models written by "04_quantize_model.py" (the margin is stored with stage 1)."""
+        import h5py
+
+        with h5py.File(stage1_file, "r") as file:
+            exit_margin = file.attrs.get("exit_margin", NEVER)
+        return cls(FixedPointNetwork.load(stage1_file), FixedPointNetwork.load(stage2_file), exit_margin)
+
+    def _compute(self, images):
+        images = np.asarray(images).reshape(-1, self.img_size)
+        logits = self.stage1.logits(pool_images(images, self.pool))
+        digits, margins = top_margins(logits)
+        exits = margins >= self.exit_margin
+        predictions = digits.copy()
+        if not exits.all():
+            stage2 = self.stage2.logits(images[~exits])
+            logits[~exits] = stage2
+            predictions[~exits] = argmax_firmware(stage2)
+        return logits, predictions, exits
+
+    def compute(self, images, batch_size=BATCH_SIZE):
+        """Outputs of the stage that answered, predicted digits and exit flags (answered by stage 1)."""
+        logits = np.empty((len(images), self.l2_size), dtype=np.int64)
+        predictions = np.empty(len(images), dtype=np.int64)
+        exits = np.empty(len(images), dtype=bool)
+        for start in range(0, len(images), batch_size):
+            stop = start + batch_size
+            logits[start:stop], predictions[start:stop], exits[start:stop] = self._compute(images[start:stop])
+        return logits, predictions, exits
+
+    def logits(self, images, batch_size=BATCH_SIZE):
+        return self.compute(images, batch_size)[0]
+
+    def predict(self, images, batch_size=BATCH_SIZE):
+        return self.compute(images, batch_size)[1]
+
+
+def threshold_table(stage1, stage2, images, labels, margins=None, extra_margins=(), sparse=False, pool=POOL):
+    """Exit rate, average MACs per image and accuracy of the cascade for every exit margin.
+
+    Both stages are computed once for all images. margins defaults to the
+    percentiles of the stage 1 margins, extra_margins and "never exit" are
+    always evaluated. Returns one dict per margin, sorted by margin.
+    """
+    labels = np.asarray(labels)
+    digits, image_margins = top_margins(stage1.logits(pool_images(images, pool)))
+    stage2_predictions = stage2.predict(images)
+    if margins is None:
+        margins = np.percentile(image_margins, np.arange(0, 101, 5))
+    margins = np.unique(np.concatenate([margins, extra_margins, [NEVER]]).astype(np.int64))
+
+    stage1_macs = quantization.mac_count(stage1)
+    stage2_macs = quantization.mac_count(stage2, sparse)
+    rows = []
+    for margin in margins:
+        exits = image_margins >= margin
+        predictions = np.where(exits, digits, stage2_predictions)
+        rows.append({"margin": int(margin), "exit_rate": float(exits.mean()),
+                     "macs": stage1_macs + (1 - exits.mean()) * stage2_macs,
+                     "accuracy": float((predictions == labels).mean()),
+                     "exit_accuracy": float((digits[exits] == labels[exits]).mean()) if exits.any() else None})
+    return rows
+
+
+def choose_margin(rows, max_loss=0.002):
+    """Row of the table with the fewest MACs whose accuracy is at most max_loss below the stage 2 accuracy."""
+    reference = [row for row in rows if row["margin"] == NEVER][0]["accuracy"]
+    candidates = [row for row in rows if row["accuracy"] >= reference - max_loss]
+    return min(candidates, key=lambda row: (row["macs"], -row["accuracy"]))
+
+
+def format_table(rows):
+    lines = ["{:>10} {:>10} {:>10} {:>10} {:>14}".format("margin", "exit rate", "MACs", "accuracy", "exit accuracy")]
+    for row in rows:
+        margin = "never" if row["margin"] == NEVER else row["margin"]
+        exit_accuracy = "-" if row["exit_accuracy"] is None else "{:.4f}".format(row["exit_accuracy"])
+        lines.append("{:>10} {:>10.3f} {:>10.0f} {:>10.4f} {:>14}".format(
+            margin, row["exit_rate"], row["macs"], row["accuracy"], exit_accuracy))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exit rate, MACs and accuracy of the cascade for many exit margins")
+    parser.add_argument("--stage1", default="trained_models/fixedpoint_tiny_model.h5")
+    parser.add_argument("--model", default="trained_models/fixedpoint_mnist_model.h5")
+    parser.add_argument("--dataset", default="mnist_small.h5")
+    parser.add_argument("--split", default="test")
+    parser.add_argument("--sparse", action="store_true", help="MACs of the sparse export of the 14x14 network")
+    parser.add_argument("--margins", nargs="+", type=int, default=None, help="exit margins (default percentiles)")
+    args = parser.parse_args()
+
+    import data_cache
+
+    cascade = Cascade.load(args.stage1, args.model)
+    split = data_cache.open_split(args.dataset, args.split)
+    rows = threshold_table(cascade.stage1, cascade.stage2, split.flat(), split.labels, args.margins,
+                           [cascade.exit_margin], args.sparse)
+    print(format_table(rows))
+    exported = [row for row in rows if row["margin"] == cascade.exit_margin][0]
+    print("Exported margin {}: exit rate {:.3f}, {:.0f} MACs per image, accuracy {:.4f}".format(
+        "never" if cascade.exit_margin == NEVER else cascade.exit_margin, exported["exit_rate"], exported["macs"],
+        exported["accuracy"]))
@@ -0,0 +1,74 @@
+################################################################################
+# File:     cli.py
+# Author:   Richard Freitag
+# Email:    richard.freitag@uadm.uu.se
+# Created:  18.10.2026
+#
+# Revisions: 18.10.2026 - native command
+#            18.10.2026 - cascade command
+#
+# Description: Single command line entry point for the pipeline stages (the
+#              numbered scripts) and the tools of this folder:
+#
+#                  python cli.py <command> [options of the command]
+#                  python cli.py <command> --help
+#
+#              The command runs its script as "__main__" with the remaining
+#              arguments, nothing else is imported. The scripts parse their
+#              options before they import tensorflow, OpenCV or matplotlib,
+#              so only the commands which need them pay for the import
+#              (e.g. "compare --float numpy" and "predict" start without
+#              tensorflow).
+#
+################################################################################
+
+
+import argparse
+import collections
+import os
+import runpy
+import sys
+
+# command --> (script, description)
+COMMANDS = collections.OrderedDict([
+    ("download", ("00_download_data.py", "download and extract the datasets and trained models")),
+    ("preprocess", ("01_mnist_preprocessing.py", "download MNIST and create the 14x14 and 7x7 datasets")),
+    ("train", ("03_mnist_small_training.py", "train the 14x14 network (optionally pruned)")),
+    ("train-full", ("02_mnist_training.py", "train the 28x28 reference network")),
+    ("quantize", ("04_quantize_model.py", "quantize the trained network, write network.h")),
+    ("compare", ("05_compare_models.py", "compare the fixed point and the float model")),
+    ("predict", ("07_predict_on_arduino.py", "classify the test images on the arduino")),
+    ("photos", ("08_classify_from_photos.py", "classify the photos of printed digits on the arduino")),
+    ("stream", ("video_stream.py", "classify camera or video frames on the arduino")),
+    ("native", ("native_network.py", "cross-check the firmware's network code built for the host")),
+    ("cascade", ("cascade.py", "exit rate, MACs and accuracy of the early-exit cascade")),
+    ("sweep", ("quantization_sweep.py", "evaluate many quantization configurations")),
+    ("search", ("architecture_search.py", "hardware aware architecture search")),
+    ("benchmark", ("benchmark.py", "latency and throughput of the serial protocols")),
+    ("timing", ("board_timing.py", "collect on-board timing records")),
+    ("devices", ("multi_device.py", "evaluate the test set on several arduinos")),
+    ("simulate", ("virtual_arduino.py", "run a virtual arduino on a pseudo terminal")),
+])
+
+
+def _command_list():
+    return "commands:\n" + "\n".join("  {:12}{}".format(name, description)
+                                     for name, (_, description) in COMMANDS.items())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="cli.py", description="Pipeline stages and tools of mnist_on_arduino",
+                                     formatter_class=argparse.RawDescriptionHelpFormatter,
+                                     epilog=_command_list() + "\n\nOptions of a command: python cli.py <command> --help")
+    parser.add_argument("command", choices=COMMANDS, metavar="command")
+    parser.add_argument("options", nargs=argparse.REMAINDER, help="options of the command")
+    args = parser.parse_args(argv)
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), COMMANDS[args.command][0])
+    # the script only sees its own options
+    sys.argv = [script] + args.options
+    runpy.run_path(script, run_name="__main__")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+################################################################################
+# File:     data_cache.py
+# Author:   Richard Freitag
+# Email:    richard.freitag@uadm.uu.se
+# Created:  18.10.2026
+#
+# Revisions: 18.10.2026 - h5py is only imported to build the cache
+#
+# Description: Shared access to the hdf5 datasets (mnist.h5, mnist_small.h5,
+#              ...) through memory mapped uint8 arrays.
+#              Each split (e.g. "train", "test") is copied once from the hdf5
+#              file into uncompressed .npy files in the cache directory, block
+#              by block, together with a small JSON metadata sidecar. After
+#              that the images and labels are memory mapped read-only: slices
+#              are zero-copy views, only the pages which are touched are read
+#              and several processes share one physical copy in the page
+#              cache. Normalized float32 images are only computed for the
+#              batches that are requested.
+#              The cache is rebuilt automatically if the hdf5 file changes.
+#
+################################################################################
+
+
+import json
+import os
+
+import numpy as np
+
+CACHE_DIR = "Data_Cache"
+CACHE_VERSION = 1
+
+# number of images copied at once when the cache is built
+BLOCK_SIZE = 8192
+
+
+class CachedSplit:
+    """Memory mapped images (N, H, W) and labels (N,) of one dataset split."""
+
+    def __init__(self, images, labels, meta):
+        self.images = images
+        self.labels = labels
+        self.meta = meta
+
+    def __len__(self):
+        return len(self.images)
+
+    def flat(self, start=0, stop=None):
+        """Zero-copy view of the images as (N, H * W) vectors."""
+        images = self.images[start:stop]
+        return images.reshape(len(images), -1)
+
+    def normalized(self, start=0, stop=None, flatten=False):
+        """Images divided by 256 as float32 (only the requested range is read and converted)."""
+        images = self.flat(start, stop) if flatten else self.images[start:stop]
+        return images.astype(np.float32) * np.float32(1 / 256)
+
+    def batches(self, batch_size=1024, normalize=True, flatten=False, start=0, stop=None):
+        """Yield (images, labels) batches, normalized lazily batch by batch."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        for begin in range(start, stop, batch_size):
+            end = min(begin + batch_size, stop)
+            if normalize:
+                images = self.normalized(begin, end, flatten)
+            else:
+                images = self.flat(begin, end) if flatten else self.images[begin:end]
+            yield images, self.labels[begin:end]
+
+
+def _source_meta(dataset, split):
+    stat = os.stat(dataset)
+    return {"source": os.path.abspath(dataset), "split": split, "size": stat.st_size,
+            "mtime": stat.st_mtime, "version": CACHE_VERSION}
+
+
+def _materialize(dataset, split, prefix, meta):
+    """Copy one split from the hdf5 file into .npy files, written atomically."""
+    import h5py
+
+    suffix = ".{}.tmp".format(os.getpid())
+    with h5py.File(dataset, "r") as file:
+        for name in ("images", "labels"):
+            source = file["{}_{}".format(split, name)]
+            target = np.lib.format.open_memmap(prefix + "_" + name + ".npy" + suffix, mode="w+",
+                                               dtype=source.dtype, shape=source.shape)
+            for start in range(0, source.shape[0], BLOCK_SIZE):
+                target[start:start + BLOCK_SIZE] = source[start:start + BLOCK_SIZE]
+            target.flush()
+            meta[name] = {"shape": list(source.shape), "dtype": str(source.dtype)}
+            del target
+
+    for name in ("images", "labels"):
+        os.replace(prefix + "_" + name + ".npy" + suffix, prefix + "_" + name + ".npy")
+    # the sidecar is written last, it marks the cache as complete
+    with open(prefix + ".json" + suffix, "w") as file:
+        json.dump(meta, file, indent=2)
+    os.replace(prefix + ".json" + suffix, prefix + ".json")
+
+
+def open_split(dataset="mnist_small.h5", split="test", cache_dir=CACHE_DIR):
+    """Memory mapped split of a dataset file, the cache is created on first use."""
+    name = os.path.splitext(os.path.basename(dataset))[0]
+    prefix = os.path.join(cache_dir, "{}_{}".format(name, split))
+    meta = _source_meta(dataset, split)
+
+    cached = None
+    if os.path.exists(prefix + ".json"):
+        with open(prefix + ".json") as file:
+            cached = json.load(file)
+    if cached is None or any(cached.get(key) != value for key, value in meta.items()):
+        os.makedirs(cache_dir, exist_ok=True)
+        _materialize(dataset, split, prefix, meta)
+        cached = meta
+
+    images = np.load(prefix + "_images.npy", mmap_mode="r")
+    labels = np.load(prefix + "_labels.npy", mmap_mode="r")
+    return CachedSplit(images, labels, cached)
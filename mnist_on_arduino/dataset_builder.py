@@ -0,0 +1,151 @@
+################################################################################
+# File:     dataset_builder.py
+# Author:   Richard Freitag
+# Email:    richard.freitag@uadm.uu.se
+# Created:  18.10.2026
+#
+# Revisions: 18.10.2026 - binarized datasets
+#
+# Description: Helper functions to build (multi-resolution) MNIST datasets.
+#              Images are downsampled in one batched array operation by
+#              reshaping every image into non-overlapping pool windows
+#              (max pooling, mean pooling or plain striding, e.g. 28 -> 14 -> 7)
+#              instead of looping over single pixels.
+#              The datasets are written to chunked, compressed hdf5 files one
+#              block of images at a time, so that large (augmented or photo
+#              derived) datasets never have to be held in memory completely.
+#              Binarized datasets are thresholded after the pooling: pixels
+#              >= threshold become 255, all others 0 (the threshold is stored
+#              as attribute of the file).
+#
+################################################################################
+
+
+import h5py
+import numpy as np
+
+# pooling modes supported by pool_images()
+POOL_MODES = ("max", "mean", "stride")
+
+# default number of images processed and stored per block / hdf5 chunk
+CHUNK_SIZE = 4096
+
+
+def pool_images(images, pool_size=2, mode="max"):
+    """Downsample a batch of images (N, H, W) with non-overlapping windows.
+
+    mode "max" and "mean" reduce each pool_size x pool_size window, "stride"
+    keeps the top left pixel of each window. Rows/columns that do not fill a
+    complete window are dropped. The dtype of the images is preserved, mean
+    values of integer images are rounded to the nearest integer.
+    """
+    if mode not in POOL_MODES:
+        raise ValueError("unknown pooling mode '{}', use one of {}".format(mode, POOL_MODES))
+
+    images = np.asarray(images)
+    if pool_size == 1:
+        return images
+
+    count, height, width = images.shape
+    out_h, out_w = height // pool_size, width // pool_size
+
+    if mode == "stride":
+        return np.ascontiguousarray(images[:, :out_h * pool_size:pool_size, :out_w * pool_size:pool_size])
+
+    # (N, H, W) --> (N, H/p, p, W/p, p) without copying the data
+    windows = images[:, :out_h * pool_size, :out_w * pool_size].reshape(count, out_h, pool_size, out_w, pool_size)
+
+    if mode == "max":
+        return windows.max(axis=(2, 4))
+
+    if np.issubdtype(images.dtype, np.integer):
+        # integer mean with round half up, the sum of a window fits easily into 32 bits
+        area = pool_size * pool_size
+        sums = windows.sum(axis=(2, 4), dtype=np.int32)
+        return ((sums + area // 2) // area).astype(images.dtype)
+    return windows.mean(axis=(2, 4), dtype=np.float32).astype(images.dtype)
+
+
+def binarize_images(images, threshold):
+    """Pixels >= threshold set to 255, all others to 0 (same dtype)."""
+    images = np.asarray(images)
+    return np.where(images >= threshold, 255, 0).astype(images.dtype)
+
+
+def iter_blocks(images, labels, chunk_size=CHUNK_SIZE):
+    """Yield (images, labels) blocks of at most chunk_size images.
+
+    images/labels can be anything that supports len() and slicing (numpy
+    arrays, memory maps, hdf5 datasets). Only one block is read at a time.
+    """
+    for start in range(0, len(images), chunk_size):
+        stop = min(start + chunk_size, len(images))
+        yield np.asarray(images[start:stop]), np.asarray(labels[start:stop])
+
+
+def write_split(file, name, blocks, pool_size=1, mode="max", chunk_size=CHUNK_SIZE,
+                compression="gzip", compression_opts=4, threshold=None):
+    """Pool (and binarize) image blocks and append them to "<name>_images"/"<name>_labels" of an open hdf5 file.
+
+    blocks is an iterable of (images, labels) tuples, e.g. from iter_blocks()
+    or from a generator producing augmented or photo derived images. The hdf5
+    datasets are resizable, chunked and compressed and grow block by block.
+    Returns the number of images written.
+    """
+    images_ds = labels_ds = None
+    count = 0
+
+    for images, labels in blocks:
+        images = pool_images(images, pool_size, mode)
+        if threshold is not None:
+            images = binarize_images(images, threshold)
+        labels = np.asarray(labels)
+
+        if images_ds is None:
+            images_ds = file.create_dataset(name + "_images", shape=(0,) + images.shape[1:],
+                                            maxshape=(None,) + images.shape[1:], dtype=images.dtype,
+                                            chunks=(chunk_size,) + images.shape[1:],
+                                            compression=compression, compression_opts=compression_opts)
+            labels_ds = file.create_dataset(name + "_labels", shape=(0,), maxshape=(None,), dtype=labels.dtype,
+                                            chunks=(chunk_size,),
+                                            compression=compression, compression_opts=compression_opts)
+
+        images_ds.resize(count + len(images), axis=0)
+        labels_ds.resize(count + len(labels), axis=0)
+        images_ds[count:count + len(images)] = images
+        labels_ds[count:count + len(labels)] = labels
+        count += len(images)
+
+    return count
+
+
+def build_dataset(filename, splits, pool_size=1, mode="max", chunk_size=CHUNK_SIZE, threshold=None, **kwargs):
+    """Write a dataset file with one "<split>_images"/"<split>_labels" pair per split.
+
+    splits maps the split name (e.g. "train", "test") to an (images, labels)
+    tuple of sliceable arrays or to an iterable of (images, labels) blocks.
+    With a threshold the images are binarized.
+    """
+    with h5py.File(filename, "w") as file:
+        if threshold is not None:
+            file.attrs.create("threshold", threshold)
+        for name, split in splits.items():
+            if isinstance(split, tuple):
+                split = iter_blocks(*split, chunk_size=chunk_size)
+            write_split(file, name, split, pool_size, mode, chunk_size, threshold=threshold, **kwargs)
+
+
+def build_resolutions(source, targets, chunk_size=CHUNK_SIZE, **kwargs):
+    """Build several downsampled datasets from one full size hdf5 dataset file.
+
+    targets maps output file names to (pool_size, mode) or (pool_size, mode,
+    threshold) tuples for binarized datasets, e.g.
+    {"mnist_small.h5": (2, "max"), "mnist_small_binary.h5": (2, "max", 128)}.
+    The source file is read block by block for every target.
+    """
+    with h5py.File(source, "r") as src:
+        splits = sorted(key[:-len("_images")] for key in src.keys() if key.endswith("_images"))
+        for filename, target in targets.items():
+            pool_size, mode, threshold = (tuple(target) + (None,))[:3]
+            build_dataset(filename, {name: (src[name + "_images"], src[name + "_labels"]) for name in splits},
+                          pool_size, mode, chunk_size, threshold, **kwargs)
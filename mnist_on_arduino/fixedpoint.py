@@ -0,0 +1,248 @@
+################################################################################
+# File:     fixedpoint.py
+# Author:   Richard Freitag
+# Email:    richard.freitag@uadm.uu.se
+# Created:  18.10.2026
+#
+# Revisions: 18.10.2026 - 16-bit block accumulation (l1_block/l2_block)
+#            18.10.2026 - 4-bit weights packed two per byte
+#            18.10.2026 - h5py is only imported to load a model
+#            18.10.2026 - binarized input (input_threshold)
+#
+# Description: Batched fixed point implementation of the neural network
+#              exactly as it is computed by "compute_network()" and
+#              "send_result()" in "mnist_on_arduino.ino":
+#              32-bit accumulators, arithmetic right shifts, 8-bit biases,
+#              relu and an argmax which starts with max_val = 0 (if no
+#              output is positive the prediction is 0, ties pick the lower
+#              index).
+#              Each layer is computed as one large matrix multiplication over
+#              a batch of images. The products are summed in float64, which is
+#              exact as long as the accumulators stay below 2**53 (checked when
+#              the network is loaded), and are then wrapped to 32 bits like
+#              the long accumulators on the arduino.
+#              If a layer uses 16-bit block accumulation (see quantization.py),
+#              the partial sums of every block are wrapped to 16 bits before
+#              they are added to the 32-bit accumulator, exactly like the
+#              int accumulators of the firmware.
+#              4-bit weights are stored packed like in network.h (two weights
+#              per byte, the even input in the low nibble) and are unpacked
+#              from these bytes when the model is loaded, so the emulation
+#              uses exactly the values the firmware unpacks.
+#              Networks with binarized input (BINARY_INPUT in network.h)
+#              take the same uint8 images: pixels >= input_threshold are 1,
+#              all others 0 (img_bits = 0), layer 1 is the sum of the weights
+#              of the set pixels.
+#
+################################################################################
+
+
+import numpy as np
+
+# fractional bits of images
+IMG_BITS = 8
+
+# default threshold of binarized images (pixels >= BINARY_THRESHOLD are set)
+BINARY_THRESHOLD = 128
+
+# default number of images computed at once (bounds the peak memory)
+BATCH_SIZE = 8192
+
+# float64 sums of integers are exact below this magnitude
+EXACT_FLOAT_LIMIT = 2 ** 53
+
+
+def shift_right(values, bits):
+    """Arithmetic right shift like ">>" on signed integers (negative bits shift left)."""
+    if bits >= 0:
+        return np.right_shift(values, bits)
+    return np.left_shift(values, -bits)
+
+
+def wrap_int32(values):
+    """Wrap int64 values to the range of the 32-bit long accumulators."""
+    return values.astype(np.int32).astype(np.int64)
+
+
+def wrap_int16(values):
+    """Wrap int64 values to the range of the 16-bit int accumulators."""
+    return values.astype(np.int16).astype(np.int64)
+
+
+def pack_int4(matrix):
+    """Pack the rows of a (outputs, inputs) matrix of signed 4-bit values, two per byte.
+
+    Input 2k is stored in the low nibble, input 2k+1 in the high nibble, odd
+    rows are padded with a zero weight.
+    """
+    matrix = np.asarray(matrix, dtype=np.int64)
+    if matrix.shape[1] % 2:
+        matrix = np.pad(matrix, ((0, 0), (0, 1)))
+    nibbles = matrix.astype(np.uint8) & 0x0F
+    return nibbles[:, 0::2] | (nibbles[:, 1::2] << 4)
+
+
+def unpack_int4(packed, inputs):
+    """Signed 4-bit values (outputs, inputs) of rows packed by pack_int4()."""
+    packed = np.asarray(packed, dtype=np.uint8)
+    matrix = np.empty((packed.shape[0], 2 * packed.shape[1]), dtype=np.int64)
+    matrix[:, 0::2] = packed & 0x0F
+    matrix[:, 1::2] = packed >> 4
+    matrix[matrix > 7] -= 16
+    return matrix[:, :inputs]
+
+
+def argmax_firmware(logits):
+    """Argmax as in send_result(): the first index with the largest value above 0, otherwise 0."""
+    predictions = np.argmax(logits, axis=1)
+    predictions[np.max(logits, axis=1) <= 0] = 0
+    return predictions
+
+
+class FixedPointNetwork:
+    """Fixed point 2 layer network as computed on the arduino.
+
+    Weights are stored like in "fixedpoint_mnist_model.h5", i.e. with shape
+    (inputs, outputs), the *_bits are the numbers of fractional bits.
+    l1_block/l2_block are the numbers of inputs accumulated in 16 bits
+    (0: 32-bit accumulation only), weight_bits is 8 or 4 (packed weights).
+    input_threshold is 0 for 8-bit pixels, otherwise the pixels are
+    binarized at this threshold (use img_bits = 0).
+    """
+
+    def __init__(self, l1_weights, l1_bias, l2_weights, l2_bias,
+                 l1w_bits, l1b_bits, l2w_bits, l2b_bits, img_bits=IMG_BITS, l1_block=0, l2_block=0, weight_bits=8,
+                 input_threshold=0):
+        self.l1_weights = np.asarray(l1_weights, dtype=np.int64)
+        self.l1_bias = np.asarray(l1_bias, dtype=np.int64)
+        self.l2_weights = np.asarray(l2_weights, dtype=np.int64)
+        self.l2_bias = np.asarray(l2_bias, dtype=np.int64)
+
+        self.l1w_bits = int(l1w_bits)
+        self.l1b_bits = int(l1b_bits)
+        self.l2w_bits = int(l2w_bits)
+        self.l2b_bits = int(l2b_bits)
+        self.img_bits = int(img_bits)
+        self.l1_block = int(l1_block)
+        self.l2_block = int(l2_block)
+        self.weight_bits = int(weight_bits)
+        self.input_threshold = int(input_threshold)
+        # largest input of layer 1
+        self.input_max = 1 if self.input_threshold else 255
+
+        # layer dimensions
+        self.img_size = self.l1_weights.shape[0]
+        self.l1_size = self.l1_bias.shape[0]
+        self.l2_size = self.l2_bias.shape[0]
+
+        # bit-shift distances of layer 1 and layer 2
+        self.l1_shift = self.l1w_bits + self.img_bits - self.l1b_bits
+        self.l2_shift = self.l2w_bits + self.l1b_bits - self.l2b_bits
+
+        # float64 copies of the weights for exact BLAS matrix multiplications
+        self._l1_weights = self.l1_weights.astype(np.float64)
+        self._l2_weights = self.l2_weights.astype(np.float64)
+
+        # largest possible accumulator values (pixels, relu outputs of 32-bit layer 1)
+        l1_bound = self.input_max * np.abs(self.l1_weights).sum(axis=0).max()
+        l2_bound = (2 ** 31) * np.abs(self.l2_weights).sum(axis=0).max()
+        if l1_bound >= EXACT_FLOAT_LIMIT or l2_bound >= EXACT_FLOAT_LIMIT:
+            self._l1_weights = self._l2_weights = None   # fall back to integer matrix multiplications
+
+    @classmethod
+    def load(cls, filename="trained_models/fixedpoint_mnist_model.h5", img_bits=IMG_BITS):
+        """Load a fixed point model written by "04_quantize_model.py"."""
+        import h5py
+
+        with h5py.File(filename, "r") as file:
+            weight_bits = file.attrs.get("weight_bits", 8)
+            input_threshold = file.attrs.get("input_threshold", 0)
+            if input_threshold:
+                img_bits = 0
+            l1_weights = np.array(file.get("layer1_weights"))
+            l1_bias = np.array(file.get("layer1_bias"))
+            l2_weights = np.array(file.get("layer2_weights"))
+            l2_bias = np.array(file.get("layer2_bias"))
+            if weight_bits == 4:
+                # packed rows (outputs, inputs / 2) like in network.h
+                l1_weights = unpack_int4(l1_weights, file["layer1_weights"].attrs.get("inputs")).T
+                l2_weights = unpack_int4(l2_weights, file["layer2_weights"].attrs.get("inputs")).T
+
+            return cls(l1_weights, l1_bias, l2_weights, l2_bias,
+                       file["layer1_weights"].attrs.get("bits"),
+                       file["layer1_bias"].attrs.get("bits"),
+                       file["layer2_weights"].attrs.get("bits"),
+                       file["layer2_bias"].attrs.get("bits"),
+                       img_bits,
+                       file["layer1_weights"].attrs.get("block", 0),
+                       file["layer2_weights"].attrs.get("block", 0),
+                       weight_bits, input_threshold)
+
+    def with_blocks(self, l1_block, l2_block):
+        """The same network with other 16-bit block sizes (e.g. from the range analysis)."""
+        return FixedPointNetwork(self.l1_weights, self.l1_bias, self.l2_weights, self.l2_bias,
+                                 self.l1w_bits, self.l1b_bits, self.l2w_bits, self.l2b_bits, self.img_bits,
+                                 l1_block, l2_block, self.weight_bits, self.input_threshold)
+
+    def widened(self):
+        """The same network with 32-bit accumulation only (reference for the 16-bit blocks)."""
+        return self.with_blocks(0, 0)
+
+    def _matmul(self, inputs, weights, float_weights, block=0):
+        if float_weights is not None:
+            inputs = inputs.astype(np.float64)
+            weights = float_weights
+        if block <= 0:
+            return np.matmul(inputs, weights).astype(np.int64)
+
+        # 16-bit partial sums of every block of inputs, added up in 32 bits
+        result = np.zeros((len(inputs), weights.shape[1]), dtype=np.int64)
+        for start in range(0, weights.shape[0], block):
+            partial = np.matmul(inputs[:, start:start + block], weights[start:start + block]).astype(np.int64)
+            result += wrap_int16(partial)
+        return result
+
+    def inputs(self, images):
+        """Inputs of layer 1 (int64): the pixels or, with binarized input, 0 and 1."""
+        images = np.asarray(images).reshape(-1, self.img_size)
+        if self.input_threshold:
+            return (images >= self.input_threshold).astype(np.int64)
+        return images.astype(np.int64)
+
+    def _logits(self, images):
+        images = self.inputs(images)
+
+        # multiply image vectors and layer 1 weight matrix
+        layer1 = wrap_int32(self._matmul(images, self.l1_weights, self._l1_weights, self.l1_block))
+        # shift bits to have same precision as layer 1 bias
+        layer1 = shift_right(layer1, self.l1_shift)
+        # add layer 1 bias
+        layer1 += self.l1_bias
+        # relu activation
+        np.maximum(layer1, 0, out=layer1)
+
+        # multiply layer 1 vectors and layer 2 weight matrix
+        layer2 = wrap_int32(self._matmul(layer1, self.l2_weights, self._l2_weights, self.l2_block))
+        # shift bits to have same precision as layer 2 bias
+        layer2 = shift_right(layer2, self.l2_shift)
+        # add layer 2 bias
+        layer2 += self.l2_bias
+        return layer2
+
+    def logits(self, images, batch_size=BATCH_SIZE):
+        """Integer outputs of layer 2 (before the argmax) for a batch of images.
+
+        images can be any sliceable array (numpy array, memory map, hdf5
+        dataset) of uint8 images, it is processed batch_size images at a time.
+        """
+        logits = np.empty((len(images), self.l2_size), dtype=np.int64)
+        for start in range(0, len(images), batch_size):
+            logits[start:start + batch_size] = self._logits(images[start:start + batch_size])
+        return logits
+
+    def predict(self, images, batch_size=BATCH_SIZE):
+        """Predicted digits for a batch of images, identical to the arduino's results."""
+        predictions = np.empty(len(images), dtype=np.int64)
+        for start in range(0, len(images), batch_size):
+            predictions[start:start + batch_size] = argmax_firmware(self._logits(images[start:start + batch_size]))
+        return predictions
@@ -0,0 +1,93 @@
+################################################################################
+# File:     input_pipeline.py
+# Author:   Richard Freitag
+# Email:    richard.freitag@uadm.uu.se
+# Created:  18.10.2026
+#
+# Revisions: ---
+#
+# Description: Streaming tf.data input pipeline for the training scripts
+#              "02_mnist_training.py" and "03_mnist_small_training.py".
+#              The uint8 images are read from the hdf5 file in chunks (in a
+#              new random chunk order every epoch) and normalized to float32
+#              on the fly. The images are shuffled with a bounded buffer,
+#              optionally augmented in parallel (random shifts, noise and the
+#              simple edge filter of "08_classify_from_photos.py"), batched
+#              and prefetched. Only a few chunks and the shuffle buffer are in
+#              memory, independent of the size of the dataset.
+#
+################################################################################
+
+
+import h5py
+import numpy as np
+import tensorflow as tf
+
+CHUNK_SIZE = 4096
+SHUFFLE_BUFFER = 10000
+BATCH_SIZE = 32
+
+
+def _chunk_generator(filename, split, chunk_size, shuffle, seed):
+    rng = np.random.default_rng(seed)
+
+    def generator():
+        with h5py.File(filename, "r") as file:
+            images = file[split + "_images"]
+            labels = file[split + "_labels"]
+            starts = np.arange(0, len(images), chunk_size)
+            if shuffle:
+                rng.shuffle(starts)
+            for start in starts:
+                yield images[start:start + chunk_size], labels[start:start + chunk_size]
+
+    return generator
+
+
+def normalize(images, labels):
+    """uint8 images --> float32 images / 256, labels --> int32"""
+    return tf.cast(images, tf.float32) / 256, tf.cast(labels, tf.int32)
+
+
+def augment_image(image, shift=0, noise=0.0, high_val=None):
+    """Augment one normalized image (H, W).
+
+    shift:    random shift by up to shift pixels in both directions
+    noise:    standard deviation of gaussian noise (in units of the normalized pixels)
+    high_val: edge filter of 08_classify_from_photos.py, photo pixels brighter than
+              high_val become background, i.e. pixels below (255 - high_val) / 256 are set to 0
+    """
+    if shift:
+        size = tf.shape(image)
+        padded = tf.pad(image, [[shift, shift], [shift, shift]])
+        image = tf.image.random_crop(padded, size)
+    if noise:
+        image = tf.clip_by_value(image + tf.random.normal(tf.shape(image), stddev=noise), 0.0, 255 / 256)
+    if high_val is not None:
+        image = tf.where(image < (255 - high_val) / 256, tf.zeros_like(image), image)
+    return image
+
+
+def make_dataset(filename, split="train", batch_size=BATCH_SIZE, shuffle=True, shuffle_buffer=SHUFFLE_BUFFER,
+                 chunk_size=CHUNK_SIZE, augment=None, seed=None):
+    """tf.data.Dataset of normalized (images, labels) batches streamed from a hdf5 dataset file.
+
+    augment is a dict of keyword arguments for augment_image() or None.
+    """
+    with h5py.File(filename, "r") as file:
+        image_shape = file[split + "_images"].shape[1:]
+
+    dataset = tf.data.Dataset.from_generator(
+        _chunk_generator(filename, split, chunk_size, shuffle, seed),
+        output_signature=(tf.TensorSpec(shape=(None,) + image_shape, dtype=tf.uint8),
+                          tf.TensorSpec(shape=(None,), dtype=tf.uint8)))
+
+    # normalize whole chunks, then continue with single images
+    dataset = dataset.map(normalize, num_parallel_calls=tf.data.AUTOTUNE).unbatch()
+    if shuffle:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+    if augment:
+        dataset = dataset.map(lambda image, label: (augment_image(image, **augment), label),
+                              num_parallel_calls=tf.data.AUTOTUNE)
+
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
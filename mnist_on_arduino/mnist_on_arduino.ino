@@ -4,13 +4,75 @@
  * Email:    michael.rinderle@tum.de
  * Created:  27.04.2019
  *
- * Revisions: ---
+ * Revisions: 18.10.2026 - binary protocol mode
+ *            18.10.2026 - pipelined mode with double buffered receive
+ *            18.10.2026 - 16-bit block accumulation
+ *            18.10.2026 - sparse (compressed row) weights
+ *            18.10.2026 - 4-bit weights packed two per byte
+ *            18.10.2026 - optional timing instrumentation (TIMING)
+ *            18.10.2026 - network computation moved to network_compute.h
+ *            18.10.2026 - streaming layer 1 (COLUMN_MAJOR)
+ *            18.10.2026 - sparse mode (nonzero pixels as index/value pairs)
+ *            18.10.2026 - bits mode and binarized input (BINARY_INPUT)
  *
  * Description: This program implements the neural network to predict hand
  *              written digits from 14x14 pixel MNIST images.
  *              The images are received via the serial port and the predicted
  *              value is sent to the serial port.
  *
+ *              Two protocol modes are supported (see "serial_protocol.py"):
+ *              ASCII mode (default): S<p0>, <p1>, ..., E  -->  RESULT\n<digit>\n
+ *              Binary mode: 0xA5 <length> <pixels> <checksum>  -->  0xD0 | <digit>
+ *              Pipelined mode: 0xA5 <seq> <length> <pixels> <checksum>
+ *                              -->  0xD0 | <digit>, <seq>
+ *              Sparse mode: pipelined frames or
+ *                           0xA6 <seq> <count> <index> <value> ... <checksum>
+ *                           -->  0xD0 | <digit>, <seq>
+ *                           (only the nonzero pixels, indices increasing)
+ *              Bits mode: pipelined frames or
+ *                         0xA7 <seq> <length> <packed bits> <checksum>
+ *                         -->  0xD0 | <digit>, <seq>
+ *                         (1 bit per pixel, only with BINARY_INPUT)
+ *              The mode is selected by sending 'M' followed by 'A', 'B', 'P',
+ *              'Z' or 'T' and acknowledged with "<Mode X>" (bits mode:
+ *              "<Mode T img_threshold>").
+ *
+ *              network.h stores the weights either dense or, if SPARSE_WEIGHTS
+ *              is defined, as compressed rows of the nonzero weights only, or,
+ *              if PACKED_WEIGHTS is defined, as signed 4-bit weights packed
+ *              two per byte (one pgm_read_byte per pair of inputs).
+ *
+ *              Images are received into IMAGE_BUFFERS buffers. While one
+ *              image is computed the next one is received into another
+ *              buffer, so the host can keep up to IMAGE_BUFFERS images in
+ *              flight in pipelined mode.
+ *
+ *              If TIMING is defined, every result is followed by a timing
+ *              record with the durations (micros()) of the phases of the image
+ *              and the free SRAM:
+ *                  binary modes: 0xB7 <8 little endian uint16 values>
+ *                  ASCII mode:   TIMING <value>, <value>, ...\n
+ *              The values are receive, parse, wait, layer1, layer2, poll,
+ *              send (microseconds, at most 65535) and free SRAM (bytes), see
+ *              "board_timing.py".
+ *
+ *              compute_network() is in "network_compute.h", which is also
+ *              compiled natively on the host (see "native_network.py").
+ *
+ *              If network.h stores the layer 1 weights column-major
+ *              (COLUMN_MAJOR), the pixels received so far are multiplied into
+ *              the layer 1 sums of their receive buffer whenever no serial
+ *              data is waiting. After the last byte only the pixels which
+ *              were not multiplied yet, the bias, relu and layer 2 remain.
+ *              Reception has priority: at 1 Mbaud binary frames arrive faster
+ *              than 32 MACs per pixel, the gain is largest for slower links,
+ *              ASCII mode and gaps between frames.
+ *
+ *              If network.h defines BINARY_INPUT, the network was trained on
+ *              binarized images: pixels >= img_threshold count as 1, all
+ *              others as 0, and layer 1 only adds up the weights of the set
+ *              pixels. The set pixels of bit frames are stored as 255.
+ *
  ******************************************************************************/
 
 
@@ -18,20 +80,71 @@
 #define ENDMARKER 'E'
 #define SEPARATOR ','
 #define BUFFERSIZE 8
+#define MODEMARKER 'M'
+#define ASCII_MODE 'A'
+#define BINARY_MODE 'B'
+#define PIPELINED_MODE 'P'
+#define SPARSE_MODE 'Z'
+#define BITS_MODE 'T'
+#define FRAMESTART 0xA5
+#define SPARSE_FRAMESTART 0xA6
+#define BITS_FRAMESTART 0xA7
+#define RESULT_FRAME 0xD0
+#define ERROR_CHECKSUM 0xE1
+#define ERROR_LENGTH 0xE2
+#define TIMING_FRAME 0xB7
+// #define TIMING                 // send a timing record after every result
 char receivebuffer[BUFFERSIZE]; // array to store received characters
 byte buffer_idx = 0;
+char protocol_mode = ASCII_MODE;  // currently used protocol mode
 
 #include "network.h"            // include weights and biases of neural network
 
-byte image[img_size];           // array to store input image
-byte ctr = 0;
-bool imageReceived = false;
+#define img_bytes ((img_size + 7) / 8)   // payload of a bit frame
 
-long layer1[l1_size];           // array to store layer 1 results
-long layer2[l2_size];           // array to store layer 2 results
+#define IMAGE_BUFFERS 2
+byte image[IMAGE_BUFFERS][img_size];    // arrays to store input images
+byte image_seq[IMAGE_BUFFERS];          // sequence numbers of the images (pipelined, sparse and bits mode)
+bool imageReceived[IMAGE_BUFFERS];      // buffer holds a complete image which is not computed yet
+byte rx_buf = 0;                        // buffer the next image is received into
+byte compute_buf = 0;                   // buffer of the next image to compute
+byte ctr = 0;
 
-#define l1_shift (l1w_bits + img_bits - l1b_bits)       // bit-shift distance of layer 1
-#define l2_shift (l2w_bits + l1b_bits - l2b_bits)       // bit-shift distance of layer 2
+#ifdef TIMING
+// phase boundaries (micros()) of the images in the receive buffers and of the computed image
+unsigned long rx_start[IMAGE_BUFFERS];  // first byte of the frame
+unsigned long rx_end[IMAGE_BUFFERS];    // frame complete
+unsigned long parse_time[IMAGE_BUFFERS]; // time spent in parse_buffer() (ASCII mode)
+unsigned long compute_start, l1_end, compute_end, send_end;
+unsigned long poll_time;                // time spent receiving the next image during compute_network()
+int free_sram;                          // free SRAM between heap and stack in compute_network()
+#define TIMESTAMP(var) var = micros()
+#else
+#define TIMESTAMP(var)
+#endif
+
+// hooks of compute_network(): receive the next image while layer 1 is computed
+void receive_image();
+#ifdef TIMING
+int free_memory();
+#define COMPUTE_BEGIN() free_sram = free_memory(); poll_time = 0
+#define COMPUTE_POLL() { unsigned long poll_start = micros(); receive_image(); poll_time += micros() - poll_start; }
+#define COMPUTE_LAYER1_END() TIMESTAMP(l1_end)
+#else
+#define COMPUTE_POLL() receive_image()
+#endif
+
+#include "network_compute.h"    // compute_network() and network_result()
+
+#if defined(COLUMN_MAJOR)
+layer1_stream_t stream[IMAGE_BUFFERS];  // layer 1 sums of the images in the receive buffers
+bool rx_active = false;                 // a frame is being received into image[rx_buf]
+#define STREAM_START() stream_reset(&stream[rx_buf]); rx_active = true
+#define STREAM_END() rx_active = false
+#else
+#define STREAM_START()
+#define STREAM_END()
+#endif
 
 
 void setup() {
@@ -41,34 +154,104 @@ void setup() {
 
 void loop() {
     receive_image();
-
-    if (imageReceived) {
-        compute_network();
-        send_result();
-
-        imageReceived = false;
-        ctr = 0;
+#if defined(COLUMN_MAJOR)
+    stream_received();
+#endif
+
+    if (imageReceived[compute_buf]) {
+        TIMESTAMP(compute_start);
+#if defined(COLUMN_MAJOR)
+        compute_streamed(image[compute_buf], &stream[compute_buf]);
+#else
+        compute_network(image[compute_buf]);
+#endif
+        TIMESTAMP(compute_end);
+        send_result(image_seq[compute_buf]);
+        TIMESTAMP(send_end);
+#ifdef TIMING
+        send_timing(compute_buf);
+#endif
+
+        imageReceived[compute_buf] = false;
+        compute_buf = (compute_buf + 1) % IMAGE_BUFFERS;
     }
 }
 
 
 /**
  * Function to receive a 14x14 pixel image encoded in 8-bit unsigned integers
- * from the serial port
+ * from the serial port in the currently selected protocol mode
  */
 void receive_image() {
+    if (protocol_mode != ASCII_MODE) {
+        receive_binary_image();
+    } else {
+        receive_ascii_image();
+    }
+}
+
+/**
+ * Function to mark the receive buffer as complete and continue with the next buffer
+ */
+void image_complete() {
+    STREAM_END();
+    TIMESTAMP(rx_end[rx_buf]);
+    imageReceived[rx_buf] = true;
+    rx_buf = (rx_buf + 1) % IMAGE_BUFFERS;
+}
+
+/**
+ * Function to check if the results of the protocol mode carry sequence numbers
+ */
+bool tagged_mode() {
+    return protocol_mode == PIPELINED_MODE || protocol_mode == SPARSE_MODE || protocol_mode == BITS_MODE;
+}
+
+/**
+ * Function to switch the protocol mode and acknowledge the new mode
+ */
+void select_mode(char mode) {
+    if (mode == ASCII_MODE || mode == BINARY_MODE || mode == PIPELINED_MODE || mode == SPARSE_MODE) {
+        protocol_mode = mode;
+    }
+#if defined(BINARY_INPUT)
+    if (mode == BITS_MODE) {
+        protocol_mode = mode;
+    }
+#endif
+    Serial.print("<Mode ");
+    Serial.print(protocol_mode);
+#if defined(BINARY_INPUT)
+    if (protocol_mode == BITS_MODE) {
+        // threshold the host binarizes the images with
+        Serial.print(" ");
+        Serial.print(img_threshold);
+    }
+#endif
+    Serial.println(">");
+}
+
+/**
+ * Function to receive an image as comma separated ASCII numbers
+ */
+void receive_ascii_image() {
     static bool receiveFlag = false;
+    static bool modeFlag = false;
     char rc;
 
-    while (Serial.available() > 0 && imageReceived == false) {
+    while (Serial.available() > 0 && imageReceived[rx_buf] == false) {
         rc = Serial.read();     // read character from serial port
 
-        if (receiveFlag) {
+        if (modeFlag) {
+            modeFlag = false;
+            select_mode(rc);
+            return;
+        } else if (receiveFlag) {
             if (rc == ENDMARKER) {
                 // receivebuffer[buffer_idx] = '\n';  // terminate string
                 parse_buffer();                       // parse buffer
                 receiveFlag = false;
-                imageReceived = true;
+                image_complete();
             } else if (rc == SEPARATOR) {
                 // receivebuffer[buffer_idx] = '\n';  // terminate string
                 parse_buffer();                       // parse buffer
@@ -81,16 +264,166 @@ void receive_image() {
         } else if (rc == STARTMARKER) {
             receiveFlag = true;   // start receiving data
             buffer_idx = 0;       // reset buffer index
+            ctr = 0;              // reset pixel index
+            STREAM_START();       // reset layer 1 sums
+            TIMESTAMP(rx_start[rx_buf]);
+#ifdef TIMING
+            parse_time[rx_buf] = 0;
+#endif
+        } else if (rc == MODEMARKER) {
+            modeFlag = true;      // next character selects the mode
         }
     }
 }
 
+/**
+ * Function to receive an image as binary frame:
+ * start byte, (sequence number,) length byte, raw pixels,
+ * checksum (sum of sequence number, length and pixels)
+ * or in sparse mode as sparse frame: the length byte counts (index, value)
+ * pairs of the nonzero pixels, all other pixels are 0
+ * or in bits mode as bit frame: the length byte counts the bytes of packed
+ * bits (least significant bit first), set pixels are stored as 255
+ */
+void receive_binary_image() {
+    enum { IDLE, MODE, SEQUENCE, LENGTH, PAYLOAD, CHECKSUM };
+    static byte state = IDLE;
+    static byte length = 0;
+    static byte checksum = 0;
+    static byte frame = FRAMESTART;     // start byte of the frame
+    static bool index_received = false; // the index of the next pair was received
+    static byte index = 0;
+    static byte pairs = 0;
+    static bool bad_index = false;      // index out of range or not increasing
+    byte rc;
+
+    while (Serial.available() > 0 && imageReceived[rx_buf] == false) {
+        rc = Serial.read();     // read byte from serial port
+
+        switch (state) {
+            case IDLE:
+                if (rc == FRAMESTART || (rc == SPARSE_FRAMESTART && protocol_mode == SPARSE_MODE)
+                                     || (rc == BITS_FRAMESTART && protocol_mode == BITS_MODE)) {
+                    TIMESTAMP(rx_start[rx_buf]);
+#ifdef TIMING
+                    parse_time[rx_buf] = 0;
+#endif
+                    checksum = 0;
+                    frame = rc;
+                    state = (protocol_mode == BINARY_MODE) ? LENGTH : SEQUENCE;
+                } else if (rc == MODEMARKER) {
+                    state = MODE;
+                }
+                break;
+
+            case MODE:
+                state = IDLE;
+                select_mode(rc);
+                return;
+
+            case SEQUENCE:
+                image_seq[rx_buf] = rc;
+                checksum = rc;
+                state = LENGTH;
+                break;
+
+            case LENGTH:
+                length = rc;
+                checksum += rc;
+                ctr = 0;
+                if (frame == SPARSE_FRAMESTART) {
+                    // pixels which are not sent are 0
+                    memset(image[rx_buf], 0, img_size);
+                    index_received = false;
+                    pairs = 0;
+                    bad_index = false;
+                }
+                STREAM_START();
+                state = (length > 0) ? PAYLOAD : CHECKSUM;
+                break;
+
+            case PAYLOAD:
+                if (frame == BITS_FRAMESTART) {
+                    // ctr: bytes of 8 pixels
+                    for (byte b=0; b<8; ++b) {
+                        if (ctr * 8 + b < img_size) {
+                            image[rx_buf][ctr * 8 + b] = ((rc >> b) & 1) ? 255 : 0;
+                        }
+                    }
+                    checksum += rc;
+                    ctr++;
+                    if (ctr == length) {
+                        state = CHECKSUM;
+                    }
+                    break;
+                }
+                if (frame == SPARSE_FRAMESTART) {
+                    checksum += rc;
+                    if (!index_received) {
+                        index = rc;
+                        index_received = true;
+                        break;
+                    }
+                    // ctr: pixels up to the last index are complete
+                    if (index >= ctr && index < img_size) {
+                        image[rx_buf][index] = rc;
+                        ctr = index + 1;
+                    } else {
+                        bad_index = true;
+                    }
+                    index_received = false;
+                    pairs++;
+                    if (pairs == length) {
+                        state = CHECKSUM;
+                    }
+                    break;
+                }
+                if (ctr < img_size) {
+                    image[rx_buf][ctr] = rc;
+                }
+                checksum += rc;
+                ctr++;
+                if (ctr == length) {
+                    state = CHECKSUM;
+                }
+                break;
+
+            case CHECKSUM:
+                state = IDLE;
+                STREAM_END();
+                if (frame == SPARSE_FRAMESTART ? bad_index
+                        : length != (frame == BITS_FRAMESTART ? img_bytes : img_size)) {
+                    send_error(ERROR_LENGTH, image_seq[rx_buf]);
+                } else if (rc != checksum) {
+                    send_error(ERROR_CHECKSUM, image_seq[rx_buf]);
+                } else {
+                    image_complete();
+                }
+                break;
+        }
+    }
+}
+
+#if defined(COLUMN_MAJOR)
+/**
+ * Function to multiply the pixels received so far into the layer 1 sums of the
+ * receive buffer, one pixel at a time while no serial data is waiting
+ */
+void stream_received() {
+    layer1_stream_t *rx_stream = &stream[rx_buf];
+    while (rx_active && Serial.available() == 0 && rx_stream->pos < ctr && rx_stream->pos < img_size) {
+        stream_pixels(rx_stream, image[rx_buf], rx_stream->pos + 1);
+    }
+}
+#endif
+
 void parse_buffer() {
+#ifdef TIMING
+    unsigned long start = micros();
+#endif
     if (ctr < img_size) {
-        image[ctr] = atoi(receivebuffer);
+        image[rx_buf][ctr] = atoi(receivebuffer);
         ctr++;
-    } else {
-        imageReceived = true;
     }
 
     // reset buffer
@@ -98,69 +431,87 @@ void parse_buffer() {
         receivebuffer[i] = '\n';
     }
     buffer_idx = 0;
+#ifdef TIMING
+    parse_time[rx_buf] += micros() - start;
+#endif
 }
 
 
 /**
- * Function to compute the 2 layer neural network.
- * Weights and Biases are loaded from PROGMEM
+ * Function to send an error frame (binary modes)
  */
-void compute_network() {
-    // COMPUTE LAYER 1
-    for (byte i=0; i<l1_size; ++i) {
-        layer1[i] = 0;
-
-        // multiply matrix row i and vector
-        for (byte j=0; j<img_size; ++j) {
-            // layer1[i] += (long)image[j] * (long)(char)pgm_read_byte(&l1_weights[(int)j + (int)i * img_size]);
-            layer1[i] += (long)image[j] * (long)(char)pgm_read_byte(&l1_weights[i][j]);
-        }
-
-        // shift bits to have same precision as layer 1 bias
-        layer1[i] = layer1[i] >> l1_shift;
-
-        // add layer 1 bias
-        layer1[i] += (long)(char)pgm_read_byte(&l1_bias[i]);
-
-        // relu activation
-        if (layer1[i] < 0) {
-            layer1[i] = 0;
-        }
+void send_error(byte error, byte seq) {
+    Serial.write(error);
+    if (tagged_mode()) {
+        Serial.write(seq);
     }
+}
 
-    // COMPUTE LAYER 2
-    for (byte i=0; i<l2_size; ++i) {
-        layer2[i] = 0;
+/**
+ * Function to send the predicted value back to the serial port
+ */
+void send_result(byte seq) {
+    byte max_idx = network_result();
+
+    if (tagged_mode()) {
+        Serial.write(RESULT_FRAME | max_idx);
+        Serial.write(seq);
+    } else if (protocol_mode == BINARY_MODE) {
+        Serial.write(RESULT_FRAME | max_idx);
+    } else {
+        Serial.println("RESULT");
+        Serial.println(max_idx);
+    }
+}
 
-        // multiply matrix row i and vector
-        for (byte j=0; j<l1_size; ++j) {
-            // layer2[i] += layer1[j] * (long)(char)pgm_read_byte(&l2_weights[(int)j + (int)i * l1_size]);
-            layer2[i] += layer1[j] * (long)(char)pgm_read_byte(&l2_weights[i][j]);
-        }
 
-        // shift bits to have same precision as layer 2 bias
-        layer2[i] = layer2[i] >> l2_shift;
+#ifdef TIMING
+extern int __heap_start, *__brkval;
 
-        // add layer 2 bias
-        layer2[i] += (long)(char)pgm_read_byte(&l2_bias[i]);
-    }
+/**
+ * Function to compute the free SRAM between the heap and the stack
+ */
+int free_memory() {
+    char top;
+    return &top - (__brkval == 0 ? (char *)&__heap_start : (char *)__brkval);
 }
 
-
 /**
- * Function to send the predicted value back to the serial port
+ * Function to send one timing value, saturated to 16 bits
  */
-void send_result() {
-    byte max_idx = 0;
-    long max_val = 0;
-
-    for (byte i = 0; i < l2_size; ++i) {
-        if (layer2[i] > max_val) {
-            max_val = layer2[i];
-            max_idx = i;
+void send_timing_value(unsigned long value, bool last) {
+    if (value > 65535UL) {
+        value = 65535UL;
+    }
+    if (protocol_mode == ASCII_MODE) {
+        Serial.print(value);
+        if (last) {
+            Serial.println();
+        } else {
+            Serial.print(", ");
         }
+    } else {
+        Serial.write((byte)(value & 0xFF));
+        Serial.write((byte)(value >> 8));
     }
+}
 
-    Serial.println("RESULT");
-    Serial.println(max_idx);
+/**
+ * Function to send the timing record of the image in buffer buf after its result
+ */
+void send_timing(byte buf) {
+    if (protocol_mode == ASCII_MODE) {
+        Serial.print("TIMING ");
+    } else {
+        Serial.write(TIMING_FRAME);
+    }
+    send_timing_value(rx_end[buf] - rx_start[buf], false);                    // receive
+    send_timing_value(parse_time[buf], false);                                // parse
+    send_timing_value(compute_start - rx_end[buf], false);                    // wait
+    send_timing_value(l1_end - compute_start - poll_time, false);             // layer1
+    send_timing_value(compute_end - l1_end, false);                           // layer2
+    send_timing_value(poll_time, false);                                      // poll
+    send_timing_value(send_end - compute_end, false);                         // send
+    send_timing_value(free_sram, true);                                       // free SRAM
 }
+#endif
@@ -0,0 +1,177 @@
+################################################################################
+# File:     multi_device.py
+# Author:   Richard Freitag
+# Email:    richard.freitag@uadm.uu.se
+# Created:  18.10.2026
+#
+# Revisions: 18.10.2026 - sparse protocol
+#
+# Description: Evaluates the test set on several arduinos in parallel.
+#              The images are split into small shards which are put into a
+#              shared work queue. One worker thread per serial port pulls the
+#              next shard as soon as its device is done with the previous one,
+#              so faster devices automatically take more work. If a device
+#              stops answering or disappears, its current shard is put back
+#              into the queue and finished by the remaining devices.
+#              The predictions are merged in the original order of the images
+#              for one accuracy and confusion matrix report.
+#
+#              Usage: python multi_device.py --ports /dev/ttyACM0 /dev/ttyACM1
+#                     python multi_device.py --sim 4      (virtual arduinos)
+#
+################################################################################
+
+
+import argparse
+import queue
+import threading
+import time
+
+import h5py
+import numpy as np
+import serial
+
+import serial_protocol as sp
+
+SHARD_SIZE = 100
+
+
+class DeviceWorker(threading.Thread):
+    """Worker thread classifying shards of images on one serial device."""
+
+    def __init__(self, port, work, images, predictions, protocol="pipelined", window=sp.PIPELINE_BUFFERS,
+                 timeout=2.0, baudrate=1000000):
+        super().__init__(daemon=True)
+        self.port = port
+        self.work = work
+        self.images = images
+        self.predictions = predictions
+        self.protocol = protocol
+        self.threshold = None   # bits mode: threshold reported by the firmware
+        self.window = window
+        self.timeout = timeout
+        self.baudrate = baudrate
+
+        self.count = 0          # number of classified images
+        self.busy = 0.0         # seconds spent classifying
+        self.error = None       # reason the device dropped out
+
+    def _predict(self, arduino, images):
+        if self.protocol in sp.TAGGED_PROTOCOLS:
+            return sp.predict_pipelined(arduino, images, self.window, self.timeout, self.protocol, self.threshold)
+        return [sp.predict(arduino, image, self.protocol, self.timeout) for image in images]
+
+    def run(self):
+        try:
+            arduino = serial.Serial(self.port, self.baudrate, timeout=0.050)
+            sp.reset_arduino(arduino)
+            self.protocol, self.threshold = sp.negotiate(arduino, self.protocol)
+        except (serial.SerialException, OSError, sp.ProtocolError) as error:
+            self.error = error
+            return
+
+        with arduino:
+            # keep polling while shards are still in progress on other devices, they might drop out
+            while self.work.unfinished_tasks:
+                try:
+                    start, stop = self.work.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+
+                begin = time.time()
+                try:
+                    self.predictions[start:stop] = self._predict(arduino, self.images[start:stop])
+                except (serial.SerialException, OSError, sp.ProtocolError) as error:
+                    # device dropped out, give the shard to the other devices
+                    self.error = error
+                    self.work.put((start, stop))
+                    self.work.task_done()
+                    return
+
+                self.busy += time.time() - begin
+                self.count += stop - start
+                self.work.task_done()
+
+
+def evaluate(ports, images, protocol="pipelined", shard_size=SHARD_SIZE, window=sp.PIPELINE_BUFFERS,
+             timeout=2.0, baudrate=1000000):
+    """Classify images on all devices in parallel, returns (predictions, workers).
+
+    Raises a RuntimeError if all devices dropped out before the work was done.
+    """
+    images = np.reshape(images, (len(images), -1))
+    predictions = np.full(len(images), -1, dtype=np.int64)
+
+    work = queue.Queue()
+    for start in range(0, len(images), shard_size):
+        work.put((start, min(start + shard_size, len(images))))
+
+    workers = [DeviceWorker(port, work, images, predictions, protocol, window, timeout, baudrate)
+               for port in ports]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    if work.unfinished_tasks:
+        errors = ", ".join("{}: {}".format(worker.port, worker.error) for worker in workers)
+        raise RuntimeError("all devices dropped out ({})".format(errors))
+    return predictions, workers
+
+
+def confusion_matrix(labels, predictions, classes=10):
+    """Matrix of counts, rows are the true labels and columns the predictions."""
+    return np.bincount(np.asarray(labels, dtype=np.int64) * classes + predictions,
+                       minlength=classes * classes).reshape(classes, classes)
+
+
+def report(labels, predictions, workers, wall):
+    wrongs = np.count_nonzero(predictions != labels)
+    print("Wrong predictions from arduinos:", wrongs)
+    print("Accuracy of arduinos:  {:.2f} %".format((1 - wrongs / len(labels)) * 100))
+    print("Predictions took {:.2f} s --> {:.2f} ms/image".format(wall, wall / len(labels) * 1000))
+
+    for worker in workers:
+        rate = worker.count / worker.busy if worker.busy else 0.0
+        status = "dropped out: {}".format(worker.error) if worker.error else "ok"
+        print("  {:20s} {:6d} images  {:7.1f} img/s  {} ({})".format(worker.port, worker.count, rate,
+                                                                   worker.protocol, status))
+
+    print("Confusion matrix (rows: true label, columns: prediction):")
+    print(confusion_matrix(labels, predictions))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate the test set on several arduinos in parallel")
+    parser.add_argument("--ports", nargs="*", default=[], help="serial ports of the arduinos")
+    parser.add_argument("--sim", type=int, default=0, help="number of additional virtual arduinos")
+    parser.add_argument("--sim-compute-delay", type=float, default=0.0)
+    parser.add_argument("--dataset", default="mnist_small.h5")
+    parser.add_argument("--count", type=int, default=None, help="number of test images (default: all)")
+    parser.add_argument("--protocol", default="pipelined", choices=sorted(sp.PROTOCOLS))
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    parser.add_argument("--timeout", type=float, default=2.0, help="seconds until a device counts as dropped out")
+    args = parser.parse_args()
+
+    with h5py.File(args.dataset, "r") as file:
+        test_images = np.array(file["test_images"][:args.count])
+        test_labels = np.array(file["test_labels"][:args.count])
+
+    devices = []
+    if args.sim:
+        from fixedpoint import FixedPointNetwork
+        from virtual_arduino import VirtualArduino
+
+        network = FixedPointNetwork.load("trained_models/fixedpoint_mnist_model.h5")
+        devices = [VirtualArduino(network, compute_delay=args.sim_compute_delay) for _ in range(args.sim)]
+        for device in devices:
+            device.start()
+
+    try:
+        start = time.time()
+        arduino_predictions, workers = evaluate(args.ports + [device.port for device in devices], test_images,
+                                                args.protocol, args.shard_size, timeout=args.timeout)
+        report(test_labels, arduino_predictions, workers, time.time() - start)
+    finally:
+        for device in devices:
+            device.stop()
@@ -0,0 +1,292 @@
+################################################################################
+# File:     native_network.py
+# Author:   Richard Freitag
+# Email:    richard.freitag@uadm.uu.se
+# Created:  18.10.2026
+#
+# Revisions: 18.10.2026 - cascade headers (CASCADE), operations averaged over images
+#            18.10.2026 - operation counts with zero pixels skipped
+#
+# Description: Native host build of the firmware's network computation.
+#              "network_compute.h" (compute_network() and network_result() of
+#              "mnist_on_arduino.ino") is compiled together with a network.h
+#              into a shared library with gcc: PROGMEM is empty and
+#              pgm_read_byte()/pgm_read_word() read the arrays directly. The
+#              library is called with batches of images through ctypes.
+#
+#              The results are cross-checked against the NumPy fixed point
+#              implementation ("fixedpoint.py", used by "05_compare_models.py")
+#              on the whole test set, every image with different outputs is
+#              reported.
+#
+#              The build also counts the operations of compute_network(),
+#              averaged over the test images: multiply-accumulates into 16-bit
+#              and 32-bit accumulators, 16-bit block sums added to the 32-bit
+#              outputs and the bytes read from flash (weights, sparse indices,
+#              biases). Layer 1 skips the zero pixels, so the counts depend on
+#              the images (an image without zero pixels gives the worst case).
+#              Every MAC reads one activation from SRAM. The cycles are
+#              estimated with the cost model of "architecture_search.py".
+#
+#              With a cascade header (see "cascade.py") the outputs of the
+#              stage which answered are compared with cascade.Cascade and the
+#              operations are averaged over the images (stage 2 is skipped for
+#              the images answered by stage 1).
+#
+#              Usage: python native_network.py [--header network.h]
+#                                              [--model trained_models/fixedpoint_mnist_model.h5]
+#                                              [--stage1 trained_models/fixedpoint_tiny_model.h5]
+#
+################################################################################
+
+
+import argparse
+import ctypes
+import hashlib
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from fixedpoint import BATCH_SIZE
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+COMPUTE_HEADER = os.path.join(SOURCE_DIR, "network_compute.h")
+
+BUILD_DIR = "Native_Build"
+CC = os.environ.get("CC", "gcc")
+# -fwrapv: signed overflow wraps like the int/long accumulators on the arduino
+CFLAGS = ("-O2", "-fwrapv", "-shared", "-fPIC")
+
+# operation counters of the host build, in the order of the C enum
+COUNTERS = ("mac16", "mac32", "block_adds", "flash_weights", "flash_index", "flash_bias")
+
+HOST_SOURCE = r"""/* native host build of network_compute.h, generated by native_network.py */
+#include <stdint.h>
+#include <stddef.h>
+
+#define PROGMEM
+
+#include "@NETWORK_H@"
+
+enum { MAC16, MAC32, BLOCK_ADDS, FLASH_WEIGHTS, FLASH_INDEX, FLASH_BIAS, COUNTERS };
+static uint64_t counts[COUNTERS];
+
+#define IN_ARRAY(address, array) \
+    ((const char *)(address) >= (const char *)(array) && (const char *)(address) < (const char *)(array) + sizeof(array))
+
+static void count_flash(const void *address, int bytes) {
+    if (IN_ARRAY(address, l1_bias) || IN_ARRAY(address, l2_bias)) {
+        counts[FLASH_BIAS] += bytes;
+#if defined(CASCADE)
+    } else if (IN_ARRAY(address, s1_l1_bias) || IN_ARRAY(address, s1_l2_bias)) {
+        counts[FLASH_BIAS] += bytes;
+    } else if (IN_ARRAY(address, s1_l1_weights) || IN_ARRAY(address, s1_l2_weights)) {
+        counts[FLASH_WEIGHTS] += bytes;
+#endif
+#if defined(SPARSE_WEIGHTS)
+    } else if (IN_ARRAY(address, l1_weights_values) || IN_ARRAY(address, l2_weights_values)) {
+        counts[FLASH_WEIGHTS] += bytes;
+    } else {
+        counts[FLASH_INDEX] += bytes;
+#else
+    } else {
+        counts[FLASH_WEIGHTS] += bytes;
+#endif
+    }
+}
+
+/* flash reads of the 8-bit avr: one byte or one 16-bit word */
+#define pgm_read_byte(address) (count_flash((address), 1), (uint8_t)*(address))
+#define pgm_read_word(address) (count_flash((address), 2), (uint16_t)*(address))
+#define COUNT_MAC(type) (counts[sizeof(type) == 2 ? MAC16 : MAC32]++)
+#define COUNT_BLOCK() (counts[BLOCK_ADDS]++)
+
+#include "network_compute.h"
+
+void network_sizes(int *sizes) {
+    sizes[0] = img_size;
+    sizes[1] = l1_size;
+    sizes[2] = l2_size;
+}
+
+void compute_batch(const uint8_t *images, int count, int32_t *logits, uint8_t *results, uint8_t *exits) {
+    for (int n = 0; n < count; ++n) {
+        const int32_t *outputs = layer2;
+        compute_network(images + (size_t)n * img_size);
+        exits[n] = 0;
+#if defined(CASCADE)
+        if (stage1_exit) {
+            outputs = s1_layer2;
+            exits[n] = 1;
+        }
+#endif
+        for (int i = 0; i < l2_size; ++i) {
+            logits[(size_t)n * l2_size + i] = outputs[i];
+        }
+        results[n] = network_result();
+    }
+}
+
+void read_counts(uint64_t *values) {
+    for (int i = 0; i < COUNTERS; ++i) {
+        values[i] = counts[i];
+        counts[i] = 0;
+    }
+}
+"""
+
+
+def build(header="network.h", build_dir=BUILD_DIR, cc=CC, cflags=CFLAGS):
+    """Compile network_compute.h with a network.h into a shared library, returns its path.
+
+    The library is cached in build_dir by the contents of the sources and the flags.
+    """
+    source = HOST_SOURCE.replace("@NETWORK_H@", os.path.abspath(header).replace("\\", "/"))
+    key = hashlib.sha1()
+    for data in (source, " ".join((cc,) + tuple(cflags))):
+        key.update(data.encode())
+    for filename in (header, COMPUTE_HEADER):
+        with open(filename, "rb") as file:
+            key.update(file.read())
+
+    name = "network_{}".format(key.hexdigest()[:16])
+    library = os.path.abspath(os.path.join(build_dir, name + ".so"))
+    if os.path.exists(library):
+        return library
+
+    os.makedirs(build_dir, exist_ok=True)
+    source_file = os.path.join(build_dir, name + ".c")
+    with open(source_file, "w") as file:
+        file.write(source)
+    tmp_library = "{}.{}.tmp".format(library, os.getpid())
+    result = subprocess.run([cc] + list(cflags) + ["-I", SOURCE_DIR, "-o", tmp_library, source_file],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError("compiling {} with {} failed:\n{}".format(header, cc, result.stderr))
+    os.replace(tmp_library, library)
+    return library
+
+
+class NativeNetwork:
+    """compute_network() of the firmware compiled for the host, same interface as FixedPointNetwork."""
+
+    def __init__(self, header="network.h", build_dir=BUILD_DIR, cc=CC):
+        self.header = header
+        self.library = build(header, build_dir, cc)
+        self._lib = ctypes.CDLL(self.library)
+
+        uint8_array = np.ctypeslib.ndpointer(np.uint8, flags="C_CONTIGUOUS")
+        self._lib.compute_batch.argtypes = [uint8_array, ctypes.c_int,
+                                            np.ctypeslib.ndpointer(np.int32, flags="C_CONTIGUOUS"), uint8_array,
+                                            uint8_array]
+        self._lib.compute_batch.restype = None
+        self._lib.read_counts.argtypes = [np.ctypeslib.ndpointer(np.uint64, flags="C_CONTIGUOUS")]
+        self._lib.read_counts.restype = None
+
+        sizes = (ctypes.c_int * 3)()
+        self._lib.network_sizes(sizes)
+        self.img_size, self.l1_size, self.l2_size = sizes
+
+    def compute(self, images, batch_size=BATCH_SIZE):
+        """Layer 2 outputs (N, l2_size), predicted digits (N,) and cascade exits (N,) of a batch of uint8 images.
+
+        The outputs of images answered by the first stage of a cascade are the first stage outputs.
+        """
+        logits = np.empty((len(images), self.l2_size), dtype=np.int32)
+        predictions = np.empty(len(images), dtype=np.uint8)
+        exits = np.empty(len(images), dtype=np.uint8)
+        for start in range(0, len(images), batch_size):
+            batch = np.ascontiguousarray(images[start:start + batch_size], dtype=np.uint8).reshape(-1, self.img_size)
+            stop = start + len(batch)
+            self._lib.compute_batch(batch, len(batch), logits[start:stop], predictions[start:stop], exits[start:stop])
+        return logits.astype(np.int64), predictions.astype(np.int64), exits.astype(bool)
+
+    def logits(self, images, batch_size=BATCH_SIZE):
+        return self.compute(images, batch_size)[0]
+
+    def predict(self, images, batch_size=BATCH_SIZE):
+        return self.compute(images, batch_size)[1]
+
+    def operation_counts(self, images=None):
+        """Average operations of compute_network() per image (zero pixels are skipped, default: no zero pixels)."""
+        if images is None:
+            images = np.full((1, self.img_size), 255, dtype=np.uint8)
+        values = np.zeros(len(COUNTERS), dtype=np.uint64)
+        self._lib.read_counts(values)       # discard the counts of earlier calls
+        self.compute(images)
+        self._lib.read_counts(values)
+        counts = dict(zip(COUNTERS, (int(value) / len(images) for value in values)))
+        counts["macs"] = counts["mac16"] + counts["mac32"]
+        counts["flash_reads"] = counts["flash_weights"] + counts["flash_index"] + counts["flash_bias"]
+        counts["sram_reads"] = counts["macs"]       # one activation per MAC
+        return counts
+
+
+def estimate_cycles(counts):
+    """Clock cycles of compute_network() with the cost model of architecture_search.py."""
+    import architecture_search as cost
+    return (counts["mac16"] * cost.CYCLES_PER_MAC_16 + counts["mac32"] * cost.CYCLES_PER_MAC_32
+            + counts["block_adds"] * cost.CYCLES_PER_BLOCK)
+
+
+def cross_check(native, network, images, batch_size=BATCH_SIZE):
+    """Indices of the images whose outputs or predictions differ between native and network."""
+    mismatches = []
+    for start in range(0, len(images), batch_size):
+        batch = images[start:start + batch_size]
+        native_logits, native_predictions, _ = native.compute(batch, batch_size)
+        differs = np.any(native_logits != network.logits(batch, batch_size), axis=1)
+        differs |= native_predictions != network.predict(batch, batch_size)
+        mismatches.extend(start + np.nonzero(differs)[0])
+    return np.array(mismatches, dtype=np.int64)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cross-check the firmware's compute_network() built for the host")
+    parser.add_argument("--header", default="network.h")
+    parser.add_argument("--model", default="trained_models/fixedpoint_mnist_model.h5",
+                        help="fixed point model of the same network (written with network.h by 04_quantize_model.py)")
+    parser.add_argument("--stage1", default=None,
+                        help="fixed point first stage model of a cascade header (see cascade.py)")
+    parser.add_argument("--dataset", default="mnist_small.h5")
+    parser.add_argument("--count", type=int, default=None, help="number of test images (default all)")
+    parser.add_argument("--cc", default=CC)
+    args = parser.parse_args()
+
+    import data_cache
+    from fixedpoint import FixedPointNetwork
+
+    native = NativeNetwork(args.header, cc=args.cc)
+    if args.stage1 is not None:
+        from cascade import Cascade
+        network = Cascade.load(args.stage1, args.model)
+    else:
+        network = FixedPointNetwork.load(args.model)
+    images = data_cache.open_split(args.dataset, "test").flat(0, args.count)
+    print("Library:", native.library)
+
+    start = time.time()
+    native.compute(images)
+    native_time = time.time() - start
+    start = time.time()
+    network.predict(images)
+    numpy_time = time.time() - start
+    print("{} images: native {:.2f} s, numpy {:.2f} s".format(len(images), native_time, numpy_time))
+
+    counts = native.operation_counts(images)
+    print("Per image: {macs:.0f} MACs ({mac16:.0f} 16-bit, {mac32:.0f} 32-bit), {block_adds:.0f} block sums, "
+          "{sram_reads:.0f} SRAM activation reads".format(**counts))
+    print("Flash reads: {flash_reads:.0f} bytes ({flash_weights:.0f} weights, {flash_index:.0f} indices, "
+          "{flash_bias:.0f} biases)".format(**counts))
+    cycles = estimate_cycles(counts)
+    print("Estimated {:.0f} cycles = {:.2f} ms at 16 MHz".format(cycles, cycles / 16e3))
+
+    mismatches = cross_check(native, network, images)
+    if len(mismatches):
+        print("DIVERGENCE: {} of {} images differ from the numpy fixed point model, first: {}".format(
+            len(mismatches), len(images), mismatches[:10].tolist()))
+        sys.exit(1)
+    print("All {} images identical to the numpy fixed point model".format(len(images)))
@@ -61,4 +61,11 @@ const PROGMEM char l2_bias[10] = { -64,   89,   -4,  -29,   66,  117,  -54,   14
 #define l1_size 32
 #define l2_size 10
 
+// accumulator range analysis: largest absolute partial sums (worst case / observed)
+#define l1_acc_bound 486795L
+#define l2_acc_bound 3456935L
+// number of inputs accumulated in 16 bits (0: 32-bit accumulators only)
+#define l1_block 2
+#define l2_block 0
+
 #endif // NETWORK_H
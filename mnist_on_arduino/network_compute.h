@@ -0,0 +1,536 @@
+/******************************************************************************
+ * File:     network_compute.h
+ * Author:   Richard Freitag
+ * Email:    richard.freitag@uadm.uu.se
+ * Created:  18.10.2026
+ *
+ * Revisions: 18.10.2026 - early-exit cascade (CASCADE)
+ *            18.10.2026 - streaming layer 1 with column-major weights (COLUMN_MAJOR)
+ *            18.10.2026 - layer 1 skips the zero pixels
+ *            18.10.2026 - binarized input (BINARY_INPUT)
+ *            18.10.2026 - polls during layer 2, serial receive buffer limit
+ *
+ * Description: Computation of the 2 layer neural network of network.h,
+ *              shared by "mnist_on_arduino.ino" and the native host build of
+ *              "native_network.py". Include it after network.h.
+ *
+ *              The accumulators use fixed width types: int16_t for the 16-bit
+ *              blocks (int on the arduino) and int32_t for the layer outputs
+ *              (long on the arduino), so the host build computes exactly the
+ *              same values as the board.
+ *
+ *              Layer 1 only multiplies the nonzero pixels (the background of
+ *              the digits is 0), the products of zero pixels add nothing, so
+ *              the results are the same. The row-major layouts first collect
+ *              the indices of the nonzero pixels, the 16-bit blocks are kept
+ *              (a block sum of fewer pixels stays within the analysed range).
+ *
+ *              If network.h defines BINARY_INPUT, pixels >= img_threshold are
+ *              1 and all others 0: layer 1 adds up the weights of the set
+ *              pixels without multiplications (at most 255 8-bit weights
+ *              always fit into the 16-bit sum).
+ *
+ *              If network.h defines CASCADE, the small first stage network
+ *              (s1_*) is computed first on the 2x2 max pooled image. If the
+ *              two largest of its outputs differ by at least s1_margin, its
+ *              result is used and the network is skipped.
+ *
+ *              If network.h defines COLUMN_MAJOR, l1_weights[j] holds the
+ *              weights of pixel j for all layer 1 outputs. Layer 1 is then
+ *              computed pixel by pixel into a layer1_stream_t, the arduino
+ *              multiplies the pixels while the image is still received
+ *              (stream_pixels()) and compute_streamed() only multiplies the
+ *              remaining pixels before the bias, relu and layer 2.
+ *
+ *              Hooks, empty unless they are defined before the include:
+ *                  COMPUTE_BEGIN()       start of compute_network()
+ *                  COMPUTE_POLL()        after every layer 1 and layer 2
+ *                                        output, every remaining streamed
+ *                                        pixel and every pooled row and
+ *                                        output of the first stage (receive
+ *                                        the next image on the arduino)
+ *                  COMPUTE_LAYER1_END()  layer 1 is complete
+ *                  COUNT_MAC(type)       one multiply-accumulate into an
+ *                                        accumulator of type int16_t/int32_t
+ *                  COUNT_BLOCK()         a 16-bit block sum is added to the
+ *                                        32-bit output
+ *
+ *              The hardware serial receive buffer of the Uno holds 64 bytes,
+ *              640 us at 1 Mbaud (10 bits per byte). No byte of the next image
+ *              is lost while the computation between two polls is shorter:
+ *              one layer 1 output of img_size MACs takes ~180 us with 16-bit
+ *              blocks (14 cycles per MAC at 16 MHz, see
+ *              "architecture_search.py") but ~735 us with 32-bit accumulation
+ *              only (60 cycles per MAC). Networks without 16-bit blocks
+ *              (l1_block 0) need a baud rate of at most 500000 while images
+ *              are pipelined.
+ *
+ ******************************************************************************/
+
+#ifndef NETWORK_COMPUTE_H
+#define NETWORK_COMPUTE_H
+
+#include <stdint.h>
+
+#ifndef COMPUTE_BEGIN
+#define COMPUTE_BEGIN()
+#endif
+#ifndef COMPUTE_POLL
+#define COMPUTE_POLL()
+#endif
+#ifndef COMPUTE_LAYER1_END
+#define COMPUTE_LAYER1_END()
+#endif
+#ifndef COUNT_MAC
+#define COUNT_MAC(type)
+#endif
+#ifndef COUNT_BLOCK
+#define COUNT_BLOCK()
+#endif
+
+int32_t layer1[l1_size];        // array to store layer 1 results
+int32_t layer2[l2_size];        // array to store layer 2 results
+
+// number of inputs accumulated in 16 bits, determined by 04_quantize_model.py
+// (0: 32-bit accumulation only, default for network.h files without range analysis)
+#ifndef l1_block
+#define l1_block 0
+#endif
+#ifndef l2_block
+#define l2_block 0
+#endif
+
+#if defined(PACKED_WEIGHTS)
+// signed 4-bit weights of a packed byte (input 2k in the low nibble, 2k+1 in the high nibble)
+#define low_nibble(b) ((int8_t)((b) << 4) >> 4)
+#define high_nibble(b) ((int8_t)(b) >> 4)
+
+// packed rows are accumulated in blocks of L*_STEP inputs with sums of type l*_sum_t
+// (16-bit blocks if the range analysis allows, otherwise the whole row in 32 bits)
+#if l1_block > 0
+#define L1_STEP l1_block
+typedef int16_t l1_sum_t;
+#else
+#define L1_STEP img_size
+typedef int32_t l1_sum_t;
+#endif
+#if l2_block > 0
+#define L2_STEP l2_block
+typedef int16_t l2_sum_t;
+#else
+#define L2_STEP l1_size
+typedef int32_t l2_sum_t;
+#endif
+#endif
+
+#if defined(BINARY_INPUT)
+#define PIXEL_SET(pixel) ((pixel) >= img_threshold)
+#else
+#define PIXEL_SET(pixel) ((pixel) != 0)
+#endif
+
+#define l1_shift (l1w_bits + img_bits - l1b_bits)       // bit-shift distance of layer 1
+#define l2_shift (l2w_bits + l1b_bits - l2b_bits)       // bit-shift distance of layer 2
+
+
+#if defined(CASCADE)
+// first stage layers are accumulated in blocks of S1_L*_STEP inputs with sums of type s1_l*_sum_t
+#if s1_l1_block > 0
+#define S1_L1_STEP s1_l1_block
+typedef int16_t s1_l1_sum_t;
+#else
+#define S1_L1_STEP s1_img_size
+typedef int32_t s1_l1_sum_t;
+#endif
+#if s1_l2_block > 0
+#define S1_L2_STEP s1_l2_block
+typedef int16_t s1_l2_sum_t;
+#else
+#define S1_L2_STEP s1_l1_size
+typedef int32_t s1_l2_sum_t;
+#endif
+
+#define s1_l1_shift (s1_l1w_bits + img_bits - s1_l1b_bits)  // bit-shift distance of first stage layer 1
+#define s1_l2_shift (s1_l2w_bits + s1_l1b_bits - s1_l2b_bits) // bit-shift distance of first stage layer 2
+
+uint8_t s1_image[s1_img_size];  // max pooled image
+int32_t s1_layer1[s1_l1_size];  // array to store first stage layer 1 results
+int32_t s1_layer2[l2_size];     // array to store first stage layer 2 results
+uint8_t stage1_exit = 0;        // the first stage answered the last image
+uint8_t stage1_digit = 0;       // its result
+
+
+/**
+ * Function to compute the first stage of the cascade on the max pooled image.
+ * Returns 1 if the two largest outputs differ by at least s1_margin (the
+ * result is the first largest output, stage1_digit), otherwise 0.
+ */
+uint8_t compute_stage1(const uint8_t *image) {
+    // max pooling of s1_pool x s1_pool pixels
+    for (uint8_t r=0; r<s1_side; ++r) {
+        for (uint8_t c=0; c<s1_side; ++c) {
+            uint8_t value = 0;
+            for (uint8_t y=0; y<s1_pool; ++y) {
+                for (uint8_t x=0; x<s1_pool; ++x) {
+                    uint8_t pixel = image[(r * s1_pool + y) * (s1_side * s1_pool) + c * s1_pool + x];
+                    if (pixel > value) {
+                        value = pixel;
+                    }
+                }
+            }
+            s1_image[r * s1_side + c] = value;
+        }
+        COMPUTE_POLL();
+    }
+
+    // layer 1
+    for (uint8_t i=0; i<s1_l1_size; ++i) {
+        s1_layer1[i] = 0;
+        for (int j0=0; j0<s1_img_size; j0+=S1_L1_STEP) {
+            s1_l1_sum_t block_sum = 0;
+            int j1 = (j0 + S1_L1_STEP < s1_img_size) ? j0 + S1_L1_STEP : s1_img_size;
+            for (int j=j0; j<j1; ++j) {
+                if (s1_image[j] == 0) {
+                    continue;
+                }
+                block_sum += (s1_l1_sum_t)s1_image[j] * (s1_l1_sum_t)(int8_t)pgm_read_byte(&s1_l1_weights[i][j]);
+                COUNT_MAC(s1_l1_sum_t);
+            }
+            s1_layer1[i] += block_sum;
+            COUNT_BLOCK();
+        }
+        s1_layer1[i] = (s1_layer1[i] >> s1_l1_shift) + (int32_t)(int8_t)pgm_read_byte(&s1_l1_bias[i]);
+        if (s1_layer1[i] < 0) {
+            s1_layer1[i] = 0;
+        }
+        COMPUTE_POLL();
+    }
+
+    // layer 2 and the two largest outputs
+    int32_t top1 = 0;
+    int32_t top2 = 0;
+    for (uint8_t i=0; i<l2_size; ++i) {
+        s1_layer2[i] = 0;
+        for (int j0=0; j0<s1_l1_size; j0+=S1_L2_STEP) {
+            s1_l2_sum_t block_sum = 0;
+            int j1 = (j0 + S1_L2_STEP < s1_l1_size) ? j0 + S1_L2_STEP : s1_l1_size;
+            for (int j=j0; j<j1; ++j) {
+                block_sum += (s1_l2_sum_t)s1_layer1[j] * (s1_l2_sum_t)(int8_t)pgm_read_byte(&s1_l2_weights[i][j]);
+                COUNT_MAC(s1_l2_sum_t);
+            }
+            s1_layer2[i] += block_sum;
+            COUNT_BLOCK();
+        }
+        s1_layer2[i] = (s1_layer2[i] >> s1_l2_shift) + (int32_t)(int8_t)pgm_read_byte(&s1_l2_bias[i]);
+
+        if (i == 0 || s1_layer2[i] > top1) {
+            top2 = top1;
+            top1 = s1_layer2[i];
+            stage1_digit = i;
+        } else if (i == 1 || s1_layer2[i] > top2) {
+            top2 = s1_layer2[i];
+        }
+        COMPUTE_POLL();
+    }
+    return top1 - top2 >= s1_margin;
+}
+#endif
+
+
+/**
+ * Function to compute layer 2 from the layer 1 results
+ */
+void compute_layer2() {
+    for (uint8_t i=0; i<l2_size; ++i) {
+        layer2[i] = 0;
+
+        // multiply matrix row i and vector
+#if defined(SPARSE_WEIGHTS)
+        // only the nonzero weights of row i are stored (compressed rows)
+        uint16_t k_end = pgm_read_word(&l2_weights_row_ptr[i + 1]);
+        for (uint16_t k=pgm_read_word(&l2_weights_row_ptr[i]); k<k_end; ++k) {
+            layer2[i] += layer1[pgm_read_byte(&l2_weights_cols[k])] * (int32_t)(int8_t)pgm_read_byte(&l2_weights_values[k]);
+            COUNT_MAC(int32_t);
+        }
+#elif defined(PACKED_WEIGHTS)
+        // one byte holds the weights of two layer 1 outputs (blocks start at even outputs)
+        for (int j0=0; j0<l1_size; j0+=L2_STEP) {
+            l2_sum_t block_sum = 0;
+            int j1 = (j0 + L2_STEP < l1_size) ? j0 + L2_STEP : l1_size;
+            for (int j=j0; j<j1; j+=2) {
+                uint8_t pair = pgm_read_byte(&l2_weights[i][j >> 1]);
+                block_sum += (l2_sum_t)layer1[j] * low_nibble(pair);
+                COUNT_MAC(l2_sum_t);
+                if (j + 1 < j1) {
+                    block_sum += (l2_sum_t)layer1[j + 1] * high_nibble(pair);
+                    COUNT_MAC(l2_sum_t);
+                }
+            }
+            layer2[i] += block_sum;
+            COUNT_BLOCK();
+        }
+#elif l2_block > 0
+        // 16-bit products and partial sums of blocks of l2_block layer 1 outputs
+        // (cannot overflow, checked by the range analysis in 04_quantize_model.py)
+        for (int j0=0; j0<l1_size; j0+=l2_block) {
+            int16_t block_sum = 0;
+            int j1 = (j0 + l2_block < l1_size) ? j0 + l2_block : l1_size;
+            for (int j=j0; j<j1; ++j) {
+                block_sum += (int16_t)layer1[j] * (int16_t)(int8_t)pgm_read_byte(&l2_weights[i][j]);
+                COUNT_MAC(int16_t);
+            }
+            layer2[i] += block_sum;
+            COUNT_BLOCK();
+        }
+#else
+        for (uint8_t j=0; j<l1_size; ++j) {
+            layer2[i] += layer1[j] * (int32_t)(int8_t)pgm_read_byte(&l2_weights[i][j]);
+            COUNT_MAC(int32_t);
+        }
+#endif
+
+        // shift bits to have same precision as layer 2 bias
+        layer2[i] = layer2[i] >> l2_shift;
+
+        // add layer 2 bias
+        layer2[i] += (int32_t)(int8_t)pgm_read_byte(&l2_bias[i]);
+
+        COMPUTE_POLL();
+    }
+}
+
+
+#if defined(COLUMN_MAJOR)
+// layer 1 sums of an image whose pixels are multiplied as they arrive
+typedef struct {
+    int32_t acc[l1_size];       // sums of the pixels multiplied so far
+    uint16_t pos;               // number of pixels multiplied
+} layer1_stream_t;
+
+/**
+ * Function to start the layer 1 sums of a new image
+ */
+void stream_reset(layer1_stream_t *stream) {
+    for (uint8_t i=0; i<l1_size; ++i) {
+        stream->acc[i] = 0;
+    }
+    stream->pos = 0;
+}
+
+/**
+ * Function to multiply the pixels stream->pos ... count - 1 of image into the
+ * layer 1 sums, one column of weights per pixel (a uint8 pixel times an 8-bit
+ * weight always fits into the 16-bit product)
+ */
+void stream_pixels(layer1_stream_t *stream, const uint8_t *image, uint16_t count) {
+    for (; stream->pos < count; ++stream->pos) {
+        int16_t pixel = image[stream->pos];
+        if (pixel == 0) {
+            continue;
+        }
+        for (uint8_t i=0; i<l1_size; ++i) {
+            stream->acc[i] += (int16_t)(pixel * (int16_t)(int8_t)pgm_read_byte(&l1_weights[stream->pos][i]));
+            COUNT_MAC(int16_t);
+        }
+    }
+}
+
+/**
+ * Function to compute the 2 layer neural network from the layer 1 sums of the
+ * pixels multiplied during the reception, the remaining pixels are multiplied first
+ */
+void compute_streamed(const uint8_t *image, layer1_stream_t *stream) {
+    COMPUTE_BEGIN();
+
+#if defined(CASCADE)
+    // easy images are answered by the first stage
+    stage1_exit = compute_stage1(image);
+    if (stage1_exit) {
+        COMPUTE_LAYER1_END();
+        return;
+    }
+#endif
+
+    // COMPUTE LAYER 1
+    // multiply the remaining pixels one at a time, at most l1_size MACs between
+    // the polls (at 1 Mbaud most of the image is still left here)
+    while (stream->pos < img_size) {
+        stream_pixels(stream, image, stream->pos + 1);
+        COMPUTE_POLL();
+    }
+    for (uint8_t i=0; i<l1_size; ++i) {
+        // shift bits to have same precision as layer 1 bias, add layer 1 bias
+        layer1[i] = (stream->acc[i] >> l1_shift) + (int32_t)(int8_t)pgm_read_byte(&l1_bias[i]);
+
+        // relu activation
+        if (layer1[i] < 0) {
+            layer1[i] = 0;
+        }
+
+        COMPUTE_POLL();
+    }
+    COMPUTE_LAYER1_END();
+
+    // COMPUTE LAYER 2
+    compute_layer2();
+}
+
+/**
+ * Function to compute the 2 layer neural network of a complete image
+ */
+void compute_network(const uint8_t *image) {
+    static layer1_stream_t stream;
+
+    stream_reset(&stream);
+    compute_streamed(image, &stream);
+}
+
+#else
+#if !defined(SPARSE_WEIGHTS)
+uint8_t nonzero_pixels[img_size];   // indices of the nonzero (set) pixels of the image
+#endif
+
+/**
+ * Function to compute the 2 layer neural network.
+ * Weights and Biases are loaded from PROGMEM
+ * COMPUTE_POLL() is called after every layer 1 row, so the arduino receives
+ * the next image into the other buffer while this one is computed.
+ */
+void compute_network(const uint8_t *image) {
+    COMPUTE_BEGIN();
+
+#if defined(CASCADE)
+    // easy images are answered by the first stage
+    stage1_exit = compute_stage1(image);
+    if (stage1_exit) {
+        COMPUTE_LAYER1_END();
+        return;
+    }
+#endif
+
+    // COMPUTE LAYER 1
+#if !defined(SPARSE_WEIGHTS)
+    // zero pixels add nothing to layer 1
+    uint8_t nonzero_count = 0;
+    for (uint8_t j=0; j<img_size; ++j) {
+        if (PIXEL_SET(image[j])) {
+            nonzero_pixels[nonzero_count++] = j;
+        }
+    }
+#endif
+
+    for (uint8_t i=0; i<l1_size; ++i) {
+        layer1[i] = 0;
+
+        // multiply matrix row i and vector
+#if defined(SPARSE_WEIGHTS)
+        // only the nonzero weights of row i are stored (compressed rows),
+        // 16-bit products of uint8 pixels and 8-bit weights cannot overflow
+        uint16_t k_end = pgm_read_word(&l1_weights_row_ptr[i + 1]);
+        for (uint16_t k=pgm_read_word(&l1_weights_row_ptr[i]); k<k_end; ++k) {
+            uint8_t pixel = image[pgm_read_byte(&l1_weights_cols[k])];
+            if (pixel == 0) {
+                continue;
+            }
+            layer1[i] += (int16_t)pixel * (int16_t)(int8_t)pgm_read_byte(&l1_weights_values[k]);
+            COUNT_MAC(int32_t);
+        }
+#elif defined(BINARY_INPUT)
+        // the set pixels are 1: sum of their weights
+        int16_t weight_sum = 0;
+        for (uint8_t k=0; k<nonzero_count; ++k) {
+            weight_sum += (int8_t)pgm_read_byte(&l1_weights[i][nonzero_pixels[k]]);
+            COUNT_MAC(int16_t);
+        }
+        layer1[i] = weight_sum;
+#elif defined(PACKED_WEIGHTS)
+        // one byte holds the weights of two pixels (blocks start at even pixels),
+        // the nonzero pixels of every block of L1_STEP pixels are summed in l1_sum_t
+        for (uint8_t k=0; k<nonzero_count; ) {
+            l1_sum_t block_sum = 0;
+            int j1 = (nonzero_pixels[k] / L1_STEP + 1) * L1_STEP;
+            for (; k<nonzero_count && nonzero_pixels[k]<j1; ++k) {
+                uint8_t j = nonzero_pixels[k];
+                uint8_t pair = pgm_read_byte(&l1_weights[i][j >> 1]);
+                if (j & 1) {
+                    block_sum += (l1_sum_t)image[j] * high_nibble(pair);
+                } else {
+                    block_sum += (l1_sum_t)image[j] * low_nibble(pair);
+                    // one read for both pixels of the pair when the odd one is nonzero too
+                    if (k+1<nonzero_count && nonzero_pixels[k+1] == j+1) {
+                        ++k;
+                        block_sum += (l1_sum_t)image[j+1] * high_nibble(pair);
+                        COUNT_MAC(l1_sum_t);
+                    }
+                }
+                COUNT_MAC(l1_sum_t);
+            }
+            layer1[i] += block_sum;
+            COUNT_BLOCK();
+        }
+#elif l1_block > 0
+        // 16-bit products and partial sums of the nonzero pixels of blocks of l1_block pixels
+        // (cannot overflow, checked by the range analysis in 04_quantize_model.py)
+        for (uint8_t k=0; k<nonzero_count; ) {
+            int16_t block_sum = 0;
+            int j1 = (nonzero_pixels[k] / l1_block + 1) * l1_block;
+            for (; k<nonzero_count && nonzero_pixels[k]<j1; ++k) {
+                uint8_t j = nonzero_pixels[k];
+                block_sum += (int16_t)image[j] * (int16_t)(int8_t)pgm_read_byte(&l1_weights[i][j]);
+                COUNT_MAC(int16_t);
+            }
+            layer1[i] += block_sum;
+            COUNT_BLOCK();
+        }
+#else
+        for (uint8_t k=0; k<nonzero_count; ++k) {
+            uint8_t j = nonzero_pixels[k];
+            layer1[i] += (int32_t)image[j] * (int32_t)(int8_t)pgm_read_byte(&l1_weights[i][j]);
+            COUNT_MAC(int32_t);
+        }
+#endif
+
+        // shift bits to have same precision as layer 1 bias
+        layer1[i] = layer1[i] >> l1_shift;
+
+        // add layer 1 bias
+        layer1[i] += (int32_t)(int8_t)pgm_read_byte(&l1_bias[i]);
+
+        // relu activation
+        if (layer1[i] < 0) {
+            layer1[i] = 0;
+        }
+
+        COMPUTE_POLL();
+    }
+    COMPUTE_LAYER1_END();
+
+    // COMPUTE LAYER 2
+    compute_layer2();
+}
+#endif
+
+
+/**
+ * Function to find the predicted digit: the first output with the largest
+ * value above 0, otherwise 0 (or the result of the cascade's first stage)
+ */
+uint8_t network_result() {
+#if defined(CASCADE)
+    if (stage1_exit) {
+        return stage1_digit;
+    }
+#endif
+    uint8_t max_idx = 0;
+    int32_t max_val = 0;
+
+    for (uint8_t i = 0; i < l2_size; ++i) {
+        if (layer2[i] > max_val) {
+            max_val = layer2[i];
+            max_idx = i;
+        }
+    }
+    return max_idx;
+}
+
+#endif // NETWORK_COMPUTE_H
@@ -0,0 +1,142 @@
+################################################################################
+# File:     photo_pipeline.py
+# Author:   Richard Freitag
+# Email:    richard.freitag@uadm.uu.se
+# Created:  18.10.2026
+#
+# Revisions: 18.10.2026 - preprocessing of single video frames
+#            18.10.2026 - binarized photos
+#
+# Description: Preprocessing of photos of printed MNIST digits as done in
+#              "08_classify_from_photos.py":
+#                  decode --> grayscale --> resize to 14x14 --> bad pixel fix
+#                  --> simple edge filter (values > high_val set to 255)
+#                  --> invert
+#              Decoding and resizing run in a process pool and the resized
+#              grayscale images are cached on disk, keyed by the hash of the
+#              photo file and the resize parameters. The cheap threshold and
+#              invert steps are done on whole batches of cached images, so
+#              many threshold/interpolation combinations can be evaluated in
+#              one vectorized pass against the fixed point model.
+#              process_frame() runs all steps on one decoded frame of a camera
+#              or video (see "video_stream.py").
+#              Binarized photos (for the network with binarized input) set
+#              every pixel which is kept by the edge filter to 255, the edge
+#              filter is the threshold.
+#
+################################################################################
+
+
+import glob
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+INTERPOLATIONS = {
+    "nearest": cv2.INTER_NEAREST,
+    "linear": cv2.INTER_LINEAR,
+    "area": cv2.INTER_AREA,
+    "cubic": cv2.INTER_CUBIC,
+    "lanczos": cv2.INTER_LANCZOS4,
+}
+
+# bad pixels of the camera: (row, column) is replaced by (source row, source column)
+BAD_PIXELS = (((9, 0), (10, 0)),)
+
+CACHE_DIR = "Photo_Cache"
+CACHE_VERSION = 1
+
+
+def photo_label(filename):
+    """Digit shown on a photo, the file names start with it ("7 (3).jpg")."""
+    return int(os.path.basename(filename).split(" ", 1)[0])
+
+
+def resize_gray(img_, size=14, interpolation="nearest"):
+    """Grayscale image of a decoded (BGR or grayscale) image resized to size x size."""
+    if img_.ndim == 3:
+        img_ = cv2.cvtColor(img_, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(img_, (size, size), interpolation=INTERPOLATIONS[interpolation])
+
+
+def load_gray(filename, size=14, interpolation="nearest", cache_dir=CACHE_DIR):
+    """Decoded, grayscale and resized photo, cached by file hash and parameters."""
+    with open(filename, "rb") as file:
+        data = file.read()
+
+    cache_file = None
+    if cache_dir:
+        key = "{}_{}_{}_v{}".format(hashlib.sha1(data).hexdigest(), size, interpolation, CACHE_VERSION)
+        cache_file = os.path.join(cache_dir, key + ".npy")
+        if os.path.exists(cache_file):
+            return np.load(cache_file)
+
+    img_ = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_ANYCOLOR)
+    gray = resize_gray(img_, size, interpolation)
+
+    if cache_file:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a temporary file first, parallel workers may read the cache
+        tmp_file = "{}.{}.tmp.npy".format(cache_file[:-4], os.getpid())
+        np.save(tmp_file, gray)
+        os.replace(tmp_file, cache_file)
+    return gray
+
+
+def _load_gray(args):
+    return load_gray(*args)
+
+
+def load_photos(files, size=14, interpolation="nearest", cache_dir=CACHE_DIR, workers=None):
+    """Resized grayscale images (N, size, size) of all files, decoded in parallel."""
+    tasks = [(filename, size, interpolation, cache_dir) for filename in files]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return np.stack(list(pool.map(_load_gray, tasks, chunksize=8)))
+
+
+def finalize(gray, high_val=180, bad_pixels=BAD_PIXELS, binary=False):
+    """Bad pixel fix, edge filter and inversion of a batch of grayscale images (N, H, W).
+
+    With binary=True the pixels which are not removed by the edge filter are set to 255.
+    """
+    images = np.array(gray, dtype=np.uint8)
+    for (row, col), (src_row, src_col) in bad_pixels:
+        images[:, row, col] = images[:, src_row, src_col]
+    if binary:
+        return np.where(images > high_val, 0, 255).astype(np.uint8)
+    images[images > high_val] = 255
+    return 255 - images
+
+
+def process_frame(frame, size=14, interpolation="nearest", high_val=180, bad_pixels=BAD_PIXELS):
+    """All preprocessing steps of one decoded frame, returns a (size, size) uint8 image."""
+    return finalize(resize_gray(frame, size, interpolation)[None], high_val, bad_pixels)[0]
+
+
+def sweep(network, files, high_vals, interpolations=("nearest",), cache_dir=CACHE_DIR, workers=None, binary=False):
+    """Accuracy of the fixed point network for every (interpolation, high_val) combination.
+
+    All thresholds of one interpolation are computed as one stacked batch,
+    binary=True sweeps the binarized photos.
+    Returns a list of (accuracy, interpolation, high_val), best first.
+    """
+    labels = np.array([photo_label(filename) for filename in files])
+    high_vals = np.asarray(high_vals)
+    results = []
+
+    for interpolation in interpolations:
+        gray = load_photos(files, 14, interpolation, cache_dir, workers)
+        # (thresholds, N, 14, 14) --> one batch
+        batch = np.concatenate([finalize(gray, high_val, binary=binary) for high_val in high_vals])
+        predictions = network.predict(batch.reshape(len(batch), -1)).reshape(len(high_vals), len(files))
+        accuracies = np.mean(predictions == labels, axis=1)
+        results += [(float(acc), interpolation, int(high_val)) for acc, high_val in zip(accuracies, high_vals)]
+
+    return sorted(results, key=lambda result: -result[0])
+
+
+def find_photos(pattern="Raw_Photos/*.jpg"):
+    return sorted(glob.glob(pattern))
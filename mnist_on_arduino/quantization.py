@@ -0,0 +1,423 @@
+################################################################################
+# File:     quantization.py
+# Author:   Richard Freitag
+# Email:    richard.freitag@uadm.uu.se
+# Created:  18.10.2026
+#
+# Revisions: 18.10.2026 - magnitude pruning and sparse (compressed row) export
+#            18.10.2026 - 4-bit weights packed two per byte
+#            18.10.2026 - rounding modes and fractional bit offsets
+#            18.10.2026 - export of the cascade's first stage
+#            18.10.2026 - column-major layer 1 weights
+#            18.10.2026 - MACs with zero pixels skipped
+#            18.10.2026 - binarized input
+#            18.10.2026 - negative layer shifts rejected by the export
+#
+# Description: Quantization of the trained model to signed 8-bit fixed point
+#              numbers and export for the arduino (network.h) and for the
+#              fixed point emulation (fixedpoint_mnist_model.h5), as used by
+#              "04_quantize_model.py".
+#
+#              Accumulator range analysis: the partial sums of every layer
+#              are bounded from the integer weights and the input ranges
+#              (uint8 pixels, relu outputs of layer 1). For every layer the
+#              largest block of inputs is determined whose partial sums
+#              provably fit into a 16-bit int. The firmware accumulates these
+#              blocks with 16-bit additions and only adds the block sums to
+#              the 32-bit accumulator (block = number of inputs of the layer
+#              means pure 16-bit accumulation, 0 means 32-bit only).
+#              The bounds observed on a dataset are reported as well.
+#
+#              Pruning: the smallest weights of a layer can be set to zero
+#              (magnitude pruning). The weights can then be exported in a
+#              compressed row format (nonzero values, their column indices
+#              and row pointers), the firmware only multiplies nonzeros.
+#
+#              4-bit weights: the weights can be quantized to signed 4-bit
+#              integers instead of 8 bits (biases stay 8-bit). Two weights are
+#              packed into one PROGMEM byte (PACKED_WEIGHTS), which halves the
+#              flash of the weights and the pgm_read_byte calls per MAC.
+#              16-bit blocks of packed layers start at even inputs.
+#
+#              The rounding mode and offsets to the number of fractional bits
+#              of every tensor can be chosen (see "quantization_sweep.py"
+#              for a search over these configurations). The offsets of the
+#              biases also change the bit-shifts of the layers.
+#
+#              Cascade: a small first stage network on the 2x2 max pooled
+#              image can be exported together with the network (CASCADE,
+#              s1_* arrays and formats), see "cascade.py".
+#
+#              Column-major export: the layer 1 weights are stored as one row
+#              per pixel (COLUMN_MAJOR), the firmware multiplies every pixel
+#              into all layer 1 sums while the image is received.
+#
+#              Binarized input: the pixels are thresholded to 0 and 1
+#              (BINARY_INPUT, img_threshold), layer 1 only adds up the weights
+#              of the set pixels. The host sends 1 bit per pixel.
+#
+################################################################################
+
+
+import h5py
+import numpy as np
+
+from fixedpoint import FixedPointNetwork, IMG_BITS, pack_int4, shift_right
+
+# largest value of a signed 16-bit int
+INT16_MAX = 2 ** 15 - 1
+
+# supported number of bits of the weights (biases are always 8-bit)
+WEIGHT_BITS = (8, 4)
+
+# rounding of the scaled values to integers
+ROUNDING = {
+    "nearest": np.round,                                # half to even
+    "half_up": lambda values: np.floor(values + 0.5),
+    "floor": np.floor,
+    "trunc": np.trunc,
+}
+
+
+def load_float_weights(filename="trained_models/small_mnist_model.h5"):
+    """Weights and biases (l1_weights, l1_bias, l2_weights, l2_bias) of a trained keras model file."""
+    with h5py.File(filename, "r") as file:
+        model = file.get("model_weights")
+        layer1 = model.get("dense/dense")
+        l1_weights = np.array(layer1.get("kernel:0"))
+        l1_bias = np.array(layer1.get("bias:0"))
+        layer2 = model.get("dense_1/dense_1")
+        l2_weights = np.array(layer2.get("kernel:0"))
+        l2_bias = np.array(layer2.get("bias:0"))
+    return l1_weights, l1_bias, l2_weights, l2_bias
+
+
+def fractional_bits(values, total_bits=8):
+    """Number of fractional bits to represent the range of values as signed total_bits integers."""
+    return (total_bits - 1) - int(np.ceil(np.log2(np.max(np.abs(values)))))
+
+
+def quantize(values, bits, dtype=np.int8, total_bits=8, rounding="nearest"):
+    """Fixed point representation of values with the given number of fractional bits.
+
+    Values outside of the range of total_bits are saturated instead of wrapped.
+    """
+    limit = 2 ** (total_bits - 1)
+    return np.array(np.clip(ROUNDING[rounding](values * 2.0 ** bits), -limit, limit - 1), dtype=dtype)
+
+
+def quantize_model(l1_weights, l1_bias, l2_weights, l2_bias, img_bits=IMG_BITS, weight_bits=8,
+                   rounding="nearest", bit_offsets=(0, 0, 0, 0), input_threshold=0):
+    """Quantize float weights to signed weight_bits and biases to 8-bit integers, returns a FixedPointNetwork.
+
+    bit_offsets are added to the fractional bits (l1w, l1b, l2w, l2b) which just fit the value ranges,
+    positive offsets saturate the largest values. A network trained on binarized images (pixels 0 or 1.0)
+    gets the threshold of the images as input_threshold.
+    """
+    if weight_bits not in WEIGHT_BITS:
+        raise ValueError("weight_bits must be one of {}".format(WEIGHT_BITS))
+    if input_threshold:
+        # binarized pixels are integers (0 or 1)
+        img_bits = 0
+    l1w_bits = fractional_bits(l1_weights, weight_bits) + bit_offsets[0]
+    l1b_bits = fractional_bits(l1_bias) + bit_offsets[1]
+    l2w_bits = fractional_bits(l2_weights, weight_bits) + bit_offsets[2]
+    l2b_bits = fractional_bits(l2_bias) + bit_offsets[3]
+
+    return FixedPointNetwork(quantize(l1_weights, l1w_bits, total_bits=weight_bits, rounding=rounding),
+                             quantize(l1_bias, l1b_bits, rounding=rounding),
+                             quantize(l2_weights, l2w_bits, total_bits=weight_bits, rounding=rounding),
+                             quantize(l2_bias, l2b_bits, rounding=rounding),
+                             l1w_bits, l1b_bits, l2w_bits, l2b_bits, img_bits, weight_bits=weight_bits,
+                             input_threshold=input_threshold)
+
+
+def firmware_shifts(network):
+    """True if both layer shifts are right shifts (>= 0), the only ones the firmware computes."""
+    return network.l1_shift >= 0 and network.l2_shift >= 0
+
+
+################################################################################
+# pruning
+
+def magnitude_mask(weights, sparsity):
+    """Mask which removes the fraction sparsity of the weights with the smallest magnitude."""
+    mask = np.ones(weights.shape, dtype=weights.dtype)
+    count = int(round(sparsity * weights.size))
+    if count > 0:
+        mask.flat[np.argsort(np.abs(weights), axis=None, kind="stable")[:count]] = 0
+    return mask
+
+
+def prune_weights(l1_weights, l1_bias, l2_weights, l2_bias, sparsity):
+    """Magnitude pruning of both weight matrices to the given sparsity (biases are kept)."""
+    return (l1_weights * magnitude_mask(l1_weights, sparsity), l1_bias,
+            l2_weights * magnitude_mask(l2_weights, sparsity), l2_bias)
+
+
+def flash_bytes(network, sparse=False):
+    """PROGMEM bytes of weights and biases in dense (8-bit or packed 4-bit) or compressed row format."""
+    biases = network.l1_size + network.l2_size
+    if not sparse and network.weight_bits == 4:
+        # rows of (inputs + 1) // 2 bytes
+        return ((network.img_size + 1) // 2 * network.l1_size + (network.l1_size + 1) // 2 * network.l2_size
+                + biases)
+    if not sparse:
+        return network.l1_weights.size + network.l2_weights.size + biases
+    # 1 byte value + 1 byte column per nonzero, 2 byte row pointers
+    nonzeros = np.count_nonzero(network.l1_weights) + np.count_nonzero(network.l2_weights)
+    row_pointers = (network.l1_size + 1) + (network.l2_size + 1)
+    return 2 * nonzeros + 2 * row_pointers + biases
+
+
+def mac_count(network, sparse=False):
+    """Multiply-accumulate operations per image."""
+    if not sparse:
+        return network.l1_weights.size + network.l2_weights.size
+    return np.count_nonzero(network.l1_weights) + np.count_nonzero(network.l2_weights)
+
+
+def input_mac_count(network, images, sparse=False):
+    """Average multiply-accumulate operations per image when layer 1 skips the zero pixels."""
+    nonzero = network.inputs(images) != 0
+    if sparse:
+        l1_macs = nonzero @ np.count_nonzero(network.l1_weights, axis=1)
+        return float(l1_macs.mean()) + np.count_nonzero(network.l2_weights)
+    return float(nonzero.sum(axis=1).mean()) * network.l1_weights.shape[1] + network.l2_weights.size
+
+
+################################################################################
+# accumulator range analysis
+
+def layer1_output_max(network):
+    """Largest possible output of every layer 1 node (after relu)."""
+    positive = np.clip(network.l1_weights, 0, None).sum(axis=0) * network.input_max
+    return np.maximum(shift_right(positive, network.l1_shift) + network.l1_bias, 0)
+
+
+def worst_case_bound(weights, input_max):
+    """Largest absolute partial sum of every output for inputs in [0, input_max]."""
+    products = weights * np.asarray(input_max)[:, np.newaxis]
+    return np.maximum(np.clip(products, 0, None).sum(axis=0), -np.clip(products, None, 0).sum(axis=0))
+
+
+def safe_block(weights, input_max, limit=INT16_MAX, step=1):
+    """Largest number of consecutive inputs whose partial sums provably stay within +-limit.
+
+    Blocks smaller than the layer are multiples of step (2 for packed weights).
+    Returns 0 if even single products (or blocks of step inputs) can exceed the limit.
+    """
+    products = weights * np.asarray(input_max)[:, np.newaxis]
+    positive = np.clip(products, 0, None)
+    negative = -np.clip(products, None, 0)
+
+    sizes = [len(weights)] + list(range(len(weights) - 1 - (len(weights) - 1) % step, 0, -step))
+    for block in sizes:
+        starts = np.arange(0, len(weights), block)
+        block_max = np.maximum(np.add.reduceat(positive, starts, axis=0), np.add.reduceat(negative, starts, axis=0))
+        if block_max.max() <= limit:
+            return block
+    return 0
+
+
+def observed_bounds(network, images, batch_size=1024):
+    """Largest absolute partial sums of layer 1 and layer 2 observed on a set of images."""
+    l1_bound = l2_bound = 0
+    for start in range(0, len(images), batch_size):
+        batch = network.inputs(images[start:start + batch_size])
+
+        # partial sums in the order of the firmware loops: (images, inputs, outputs)
+        partial = np.cumsum(batch[:, :, np.newaxis] * network.l1_weights, axis=1)
+        l1_bound = max(l1_bound, int(np.abs(partial).max()))
+
+        layer1 = np.maximum(shift_right(partial[:, -1], network.l1_shift) + network.l1_bias, 0)
+        partial = np.cumsum(layer1[:, :, np.newaxis] * network.l2_weights, axis=1)
+        l2_bound = max(l2_bound, int(np.abs(partial).max()))
+    return l1_bound, l2_bound
+
+
+def analyze_accumulators(network, images=None):
+    """Worst case (and observed) accumulator bounds and safe 16-bit block sizes of both layers."""
+    pixel_max = np.full(network.img_size, network.input_max)
+    l1_max = layer1_output_max(network)
+    # packed weights are read in pairs, blocks have to start at even inputs
+    step = 2 if network.weight_bits == 4 else 1
+
+    analysis = {
+        "l1_acc_bound": int(worst_case_bound(network.l1_weights, pixel_max).max()),
+        "l2_acc_bound": int(worst_case_bound(network.l2_weights, l1_max).max()),
+        "l1_block": safe_block(network.l1_weights, pixel_max, step=step),
+        "l2_block": safe_block(network.l2_weights, l1_max, step=step),
+    }
+    if images is not None:
+        analysis["l1_acc_observed"], analysis["l2_acc_observed"] = observed_bounds(network, images)
+    return analysis
+
+
+################################################################################
+# export
+
+def _format_values(values):
+    return ", ".join("{:4d}".format(int(value)) for value in values)
+
+
+def _format_matrix(name, matrix):
+    rows = "},\n{".join(_format_values(row) for row in matrix)
+    return "const PROGMEM char {}[{:d}][{:d}] = {{\n{{{}}}}};\n\n".format(name, matrix.shape[0], matrix.shape[1], rows)
+
+
+def _format_vector(name, vector):
+    return "const PROGMEM char {}[{:d}] = {{{}}};\n\n".format(name, len(vector), _format_values(vector))
+
+
+def _format_sparse(name, matrix):
+    """Compressed rows of matrix: nonzero values, their column indices and row pointers."""
+    rows, cols = np.nonzero(matrix)
+    row_ptr = np.searchsorted(rows, np.arange(matrix.shape[0] + 1))
+    return ("const PROGMEM char {0}_values[{1:d}] = {{{2}}};\n\n"
+            "const PROGMEM unsigned char {0}_cols[{1:d}] = {{{3}}};\n\n"
+            "const PROGMEM unsigned int {0}_row_ptr[{4:d}] = {{{5}}};\n\n"
+            .format(name, len(rows), _format_values(matrix[rows, cols]), _format_values(cols),
+                    len(row_ptr), _format_values(row_ptr)))
+
+
+def _format_packed(name, matrix):
+    packed = pack_int4(matrix)
+    rows = "},\n{".join(_format_values(row) for row in packed)
+    return "const PROGMEM unsigned char {}[{:d}][{:d}] = {{\n{{{}}}}};\n\n".format(
+        name, packed.shape[0], packed.shape[1], rows)
+
+
+def _format_stage1(network, exit_margin, pool):
+    """Weights, formats and exit margin of the cascade's first stage (8-bit dense, s1_* names)."""
+    side = int(round(np.sqrt(network.img_size)))
+    text = ("// cascade: first stage on the {0}x{0} max pooled image, its result is used if the two\n"
+            "// largest outputs differ by at least s1_margin, otherwise the network above is computed\n"
+            "#define CASCADE\n\n".format(pool))
+    text += _format_matrix("s1_l1_weights", network.l1_weights.T)
+    text += _format_vector("s1_l1_bias", network.l1_bias)
+    text += _format_matrix("s1_l2_weights", network.l2_weights.T)
+    text += _format_vector("s1_l2_bias", network.l2_bias)
+    for name in ("l1w_bits", "l1b_bits", "l2w_bits", "l2b_bits"):
+        text += "#define s1_{} {}\n".format(name, getattr(network, name))
+    text += "\n#define s1_pool {}\n#define s1_side {}\n".format(pool, side)
+    text += "#define s1_img_size {}\n#define s1_l1_size {}\n".format(network.img_size, network.l1_size)
+    text += "#define s1_l1_block {}\n#define s1_l2_block {}\n".format(network.l1_block, network.l2_block)
+    text += "#define s1_margin {}L\n".format(int(exit_margin))
+    return text
+
+
+def write_header(filename, network, analysis=None, sparse=False, stage1=None, exit_margin=None, pool=2,
+                 column_major=False):
+    """Export weights, biases and formats of a FixedPointNetwork as "network.h" for the arduino.
+
+    With sparse=True the weights are stored as compressed rows (SPARSE_WEIGHTS),
+    4-bit weights are packed two per byte (PACKED_WEIGHTS). column_major=True
+    stores the 8-bit layer 1 weights with one row per pixel (COLUMN_MAJOR).
+    stage1 is the 8-bit FixedPointNetwork of the cascade on the pool x pool max
+    pooled image (with its 16-bit block sizes), exit_margin its exit threshold.
+    Networks with binarized input are exported as BINARY_INPUT (dense 8-bit only).
+    """
+    for net in (network, stage1):
+        if net is not None and not firmware_shifts(net):
+            raise ValueError("the firmware only shifts right, got l1_shift {} and l2_shift {}".format(
+                net.l1_shift, net.l2_shift))
+    if sparse and network.weight_bits == 4:
+        raise ValueError("4-bit weights can only be exported dense")
+    if network.input_threshold and (sparse or column_major or network.weight_bits == 4 or stage1 is not None):
+        raise ValueError("binarized input needs dense 8-bit weights without a cascade")
+    if column_major and (sparse or network.weight_bits == 4):
+        raise ValueError("only dense 8-bit weights can be exported column-major")
+    if stage1 is not None:
+        side = int(round(np.sqrt(network.img_size)))
+        if stage1.weight_bits != 8 or stage1.l2_size != network.l2_size:
+            raise ValueError("the first stage needs 8-bit weights and {} outputs".format(network.l2_size))
+        if side * side != network.img_size or side % pool or stage1.img_size != (side // pool) ** 2:
+            raise ValueError("the first stage needs {} inputs ({}x{} pooling of the image)".format(
+                (side // pool) ** 2, pool, pool))
+
+    with open(filename, "w") as file:
+        file.write("#ifndef NETWORK_H\n#define NETWORK_H\n\n")
+        if network.weight_bits == 4:
+            file.write("// two signed 4-bit weights per byte, the even input in the low nibble\n")
+            file.write("#define PACKED_WEIGHTS\n\n")
+            file.write(_format_packed("l1_weights", network.l1_weights.T))
+            file.write(_format_vector("l1_bias", network.l1_bias))
+            file.write(_format_packed("l2_weights", network.l2_weights.T))
+            file.write(_format_vector("l2_bias", network.l2_bias))
+        elif sparse:
+            file.write("#define SPARSE_WEIGHTS\n\n")
+            file.write(_format_sparse("l1_weights", network.l1_weights.T))
+            file.write(_format_vector("l1_bias", network.l1_bias))
+            file.write(_format_sparse("l2_weights", network.l2_weights.T))
+            file.write(_format_vector("l2_bias", network.l2_bias))
+        elif column_major:
+            file.write("// layer 1 weights of pixel j in row j (streaming layer 1)\n")
+            file.write("#define COLUMN_MAJOR\n\n")
+            file.write(_format_matrix("l1_weights", network.l1_weights))
+            file.write(_format_vector("l1_bias", network.l1_bias))
+            file.write(_format_matrix("l2_weights", network.l2_weights.T))
+            file.write(_format_vector("l2_bias", network.l2_bias))
+        else:
+            if network.input_threshold:
+                file.write("// binarized input: pixels >= img_threshold are 1, all others 0\n")
+                file.write("#define BINARY_INPUT\n#define img_threshold {}\n\n".format(network.input_threshold))
+            file.write(_format_matrix("l1_weights", network.l1_weights.T))
+            file.write(_format_vector("l1_bias", network.l1_bias))
+            file.write(_format_matrix("l2_weights", network.l2_weights.T))
+            file.write(_format_vector("l2_bias", network.l2_bias))
+
+        file.write("#define img_bits {}\n".format(network.img_bits))
+        file.write("#define l1w_bits {}\n".format(network.l1w_bits))
+        file.write("#define l1b_bits {}\n".format(network.l1b_bits))
+        file.write("#define l2w_bits {}\n".format(network.l2w_bits))
+        file.write("#define l2b_bits {}\n".format(network.l2b_bits))
+
+        file.write("\n#define img_size {}\n".format(network.img_size))
+        file.write("#define l1_size {}\n".format(network.l1_size))
+        file.write("#define l2_size {}\n".format(network.l2_size))
+
+        if analysis is not None:
+            file.write("\n// accumulator range analysis: largest absolute partial sums (worst case / observed)\n")
+            for name in ("l1_acc_bound", "l1_acc_observed", "l2_acc_bound", "l2_acc_observed"):
+                if name in analysis:
+                    file.write("#define {} {}L\n".format(name, analysis[name]))
+            file.write("// number of inputs accumulated in 16 bits (0: 32-bit accumulators only)\n")
+            file.write("#define l1_block {}\n".format(analysis["l1_block"]))
+            file.write("#define l2_block {}\n".format(analysis["l2_block"]))
+
+        if stage1 is not None:
+            file.write("\n" + _format_stage1(stage1, exit_margin, pool))
+
+        file.write("\n#endif // NETWORK_H\n")
+
+
+def save_fixedpoint(filename, network, analysis=None, exit_margin=None):
+    """Save a FixedPointNetwork to a hdf5 file (read by FixedPointNetwork.load()).
+
+    4-bit weights are stored packed like in network.h. exit_margin is stored
+    with the first stage of a cascade (read by cascade.Cascade.load()).
+    """
+    with h5py.File(filename, "w") as file:
+        if exit_margin is not None:
+            file.attrs.create("exit_margin", int(exit_margin))
+        if network.input_threshold:
+            file.attrs.create("input_threshold", network.input_threshold)
+        if network.weight_bits == 4:
+            file.attrs.create("weight_bits", 4)
+            h5_l1w = file.create_dataset("layer1_weights", data=pack_int4(network.l1_weights.T))
+            h5_l2w = file.create_dataset("layer2_weights", data=pack_int4(network.l2_weights.T))
+            h5_l1w.attrs.create("inputs", network.img_size)
+            h5_l2w.attrs.create("inputs", network.l1_size)
+        else:
+            h5_l1w = file.create_dataset("layer1_weights", data=network.l1_weights.astype(np.int8))
+            h5_l2w = file.create_dataset("layer2_weights", data=network.l2_weights.astype(np.int8))
+        h5_l1b = file.create_dataset("layer1_bias", data=network.l1_bias.astype(np.int8))
+        h5_l2b = file.create_dataset("layer2_bias", data=network.l2_bias.astype(np.int8))
+        h5_l1w.attrs.create("bits", network.l1w_bits)
+        h5_l1b.attrs.create("bits", network.l1b_bits)
+        h5_l2w.attrs.create("bits", network.l2w_bits)
+        h5_l2b.attrs.create("bits", network.l2b_bits)
+        if analysis is not None:
+            h5_l1w.attrs.create("block", analysis["l1_block"])
+            h5_l2w.attrs.create("block", analysis["l2_block"])
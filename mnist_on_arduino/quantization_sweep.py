@@ -0,0 +1,270 @@
+################################################################################
+# File:     quantization_sweep.py
+# Author:   Richard Freitag
+# Email:    richard.freitag@uadm.uu.se
+# Created:  18.10.2026
+#
+# Revisions: 18.10.2026 - configurations with negative shifts dropped
+#
+# Description: Evaluation of many quantization configurations in one pass
+#              over the test set. A configuration consists of the number of
+#              weight bits (8 or 4), the rounding mode and offsets to the
+#              fractional bits of the four tensors chosen by
+#              "04_quantize_model.py" (l1w, l1b, l2w, l2b). The bias offsets
+#              also change the bit-shifts of both layers.
+#
+#              The float model is run once and its logits are cached next to
+#              the dataset cache (see "data_cache.py"). The fixed point
+#              networks of all configurations are stacked and computed
+#              together: every batch of images is multiplied with the stacked
+#              weight matrices of a group of configurations at once, with the
+#              same integer arithmetic as "fixedpoint.py" (32-bit
+#              accumulators, the results are identical). For every
+#              configuration the accuracy and the number of predictions which
+#              flip compared to the float model are reported. Configurations
+#              with a negative layer shift are dropped, the firmware only
+#              shifts right. The chosen configuration is exported by setting
+#              weight_bits, rounding and bit_offsets in "04_quantize_model.py".
+#
+#              Usage: python quantization_sweep.py --weight-bits 8 4 --roundings nearest floor
+#                                                  --offsets -1 0 1 --top 20
+#
+################################################################################
+
+
+import argparse
+import collections
+import itertools
+import json
+import os
+
+import numpy as np
+
+import data_cache
+import quantization
+from fixedpoint import BATCH_SIZE, IMG_BITS, argmax_firmware
+
+# offsets to the fractional bits of the sweep by default
+OFFSETS = (-1, 0, 1)
+
+# number of configurations computed together (bounds the peak memory)
+GROUP_SIZE = 64
+
+
+class QuantConfig(collections.namedtuple("QuantConfig", "weight_bits rounding l1w l1b l2w l2b")):
+    """Weight bits, rounding mode and the offsets to the fractional bits (l1w, l1b, l2w, l2b)."""
+
+    @property
+    def bit_offsets(self):
+        return self.l1w, self.l1b, self.l2w, self.l2b
+
+
+def config_grid(weight_bits=(8,), roundings=("nearest",), offsets=OFFSETS, bias_offsets=None):
+    """All combinations of weight bits, rounding modes and offsets of the fractional bits."""
+    bias_offsets = offsets if bias_offsets is None else bias_offsets
+    return [QuantConfig(*config) for config in itertools.product(
+        weight_bits, roundings, offsets, bias_offsets, offsets, bias_offsets)]
+
+
+################################################################################
+# float model
+
+def float_logits(weights, images, batch_size=BATCH_SIZE):
+    """Outputs of the float model before the softmax (float32 like keras) for uint8 images."""
+    l1_weights, l1_bias, l2_weights, l2_bias = weights
+    logits = np.empty((len(images), len(l2_bias)), dtype=np.float32)
+    for start in range(0, len(images), batch_size):
+        batch = np.asarray(images[start:start + batch_size])
+        batch = batch.reshape(len(batch), -1).astype(np.float32) * np.float32(1 / 256)
+        hidden = np.maximum(batch @ l1_weights + l1_bias, 0)
+        logits[start:start + batch_size] = hidden @ l2_weights + l2_bias
+    return logits
+
+
+def cached_float_logits(model_file="trained_models/small_mnist_model.h5", dataset="mnist_small.h5", split="test",
+                        cache_dir=data_cache.CACHE_DIR):
+    """Float logits of a dataset split, computed once and rebuilt if the model or the dataset changes."""
+    test = data_cache.open_split(dataset, split, cache_dir)
+    stat = os.stat(model_file)
+    meta = {"model": os.path.abspath(model_file), "size": stat.st_size, "mtime": stat.st_mtime,
+            "dataset": test.meta["source"], "dataset_mtime": test.meta["mtime"], "split": split}
+
+    name = "{}_{}_{}_logits".format(os.path.splitext(os.path.basename(model_file))[0],
+                                    os.path.splitext(os.path.basename(dataset))[0], split)
+    prefix = os.path.join(cache_dir, name)
+    if os.path.exists(prefix + ".json"):
+        with open(prefix + ".json") as file:
+            if json.load(file) == meta:
+                return np.load(prefix + ".npy")
+
+    logits = float_logits(quantization.load_float_weights(model_file), test.images)
+    np.save(prefix + ".tmp.npy", logits)
+    os.replace(prefix + ".tmp.npy", prefix + ".npy")
+    with open(prefix + ".json.tmp", "w") as file:
+        json.dump(meta, file, indent=2)
+    os.replace(prefix + ".json.tmp", prefix + ".json")
+    return logits
+
+
+################################################################################
+# stacked fixed point networks
+
+def _wrap_int32(values):
+    # wrap float64 integers to the range of the 32-bit long accumulators
+    return np.mod(values + 2.0 ** 31, 2.0 ** 32) - 2.0 ** 31
+
+
+class StackedNetworks:
+    """FixedPointNetworks with the same layer sizes computed together (32-bit accumulators).
+
+    All values are integers in float64 (exact below 2**53 like in fixedpoint.py):
+    layer 1 of all networks is one matrix multiplication with the concatenated
+    weight matrices, the arithmetic shifts are multiplications with powers of
+    two followed by floor and the accumulators are only wrapped to 32 bits if
+    the worst case bounds exceed them.
+    """
+
+    def __init__(self, networks):
+        self.networks = list(networks)
+        self.img_size = self.networks[0].img_size
+        self.l1_size = self.networks[0].l1_size
+        self.l2_size = self.networks[0].l2_size
+        # the float64 sums are exact if they are exact for every single network
+        self.exact = all(network._l1_weights is not None for network in self.networks)
+
+        # (inputs, networks * l1_size) and (networks, l1_size, l2_size)
+        self.l1_weights = np.concatenate([network._l1_weights for network in self.networks], axis=1) \
+            if self.exact else None
+        self.l2_weights = np.stack([network.l2_weights for network in self.networks]).astype(np.float64)
+        self.l1_bias = np.stack([network.l1_bias for network in self.networks])[:, None, :].astype(np.float64)
+        self.l2_bias = np.stack([network.l2_bias for network in self.networks])[:, None, :].astype(np.float64)
+        self.l1_scale = 2.0 ** -np.array([network.l1_shift for network in self.networks])[:, None, None]
+        self.l2_scale = 2.0 ** -np.array([network.l2_shift for network in self.networks])[:, None, None]
+
+        # worst case accumulators (uint8 pixels, relu outputs of layer 1)
+        l1_bound = np.array([255 * np.abs(network.l1_weights).sum(axis=0).max() for network in self.networks])
+        l1_output = np.floor(l1_bound * self.l1_scale.ravel()) + np.abs(self.l1_bias).max(axis=(1, 2))
+        l2_bound = l1_output * np.abs(self.l2_weights).sum(axis=1).max(axis=1)
+        self.l1_wrap = bool(np.any(l1_bound >= 2 ** 31))
+        self.l2_wrap = bool(np.any(l1_output >= 2 ** 31) or np.any(l2_bound >= 2 ** 31))
+
+    def logits(self, images):
+        """Integer outputs of layer 2 (networks, images, outputs) for one batch of uint8 images."""
+        if not self.exact:
+            return np.stack([network.logits(images) for network in self.networks])
+        images = np.asarray(images).reshape(-1, self.img_size).astype(np.float64)
+
+        # multiply the images with the layer 1 weights of all networks at once
+        layer1 = np.matmul(images, self.l1_weights).reshape(len(images), -1, self.l1_size).transpose(1, 0, 2)
+        if self.l1_wrap:
+            layer1 = _wrap_int32(layer1)
+        # arithmetic shift, bias and relu
+        layer1 = np.floor(layer1 * self.l1_scale)
+        layer1 += self.l1_bias
+        np.maximum(layer1, 0, out=layer1)
+
+        layer2 = np.matmul(layer1, self.l2_weights)
+        if self.l2_wrap:
+            layer2 = _wrap_int32(layer2)
+        layer2 = np.floor(layer2 * self.l2_scale)
+        layer2 += self.l2_bias
+        return layer2.astype(np.int64)
+
+    def predict(self, images, batch_size=1024):
+        """Predicted digits (networks, images), identical to FixedPointNetwork.predict() of every network."""
+        predictions = np.empty((len(self.networks), len(images)), dtype=np.int64)
+        for start in range(0, len(images), batch_size):
+            logits = self.logits(images[start:start + batch_size])
+            predictions[:, start:start + batch_size] = argmax_firmware(
+                logits.reshape(-1, self.l2_size)).reshape(len(self.networks), -1)
+        return predictions
+
+
+################################################################################
+# sweep
+
+def sweep(float_weights, images, labels, reference_logits, configs, img_bits=IMG_BITS,
+          batch_size=1024, group_size=GROUP_SIZE):
+    """Accuracy and flips against the float model of every configuration, returns a list of dicts.
+
+    Configurations with a negative layer shift are dropped, the firmware only shifts right.
+    """
+    labels = np.asarray(labels)
+    float_predictions = np.argmax(reference_logits, axis=1)
+    float_correct = float_predictions == labels
+
+    rows = []
+    for start in range(0, len(configs), group_size):
+        group = configs[start:start + group_size]
+        networks = [quantization.quantize_model(*float_weights, img_bits=img_bits, weight_bits=config.weight_bits,
+                                                rounding=config.rounding, bit_offsets=config.bit_offsets)
+                    for config in group]
+        kept = [(config, network) for config, network in zip(group, networks)
+                if quantization.firmware_shifts(network)]
+        if not kept:
+            continue
+        group, networks = zip(*kept)
+        predictions = StackedNetworks(networks).predict(images, batch_size)
+
+        for config, network, prediction in zip(group, networks, predictions):
+            correct = prediction == labels
+            row = config._asdict()
+            row.update(l1w_bits=network.l1w_bits, l1b_bits=network.l1b_bits, l2w_bits=network.l2w_bits,
+                       l2b_bits=network.l2b_bits, l1_shift=network.l1_shift, l2_shift=network.l2_shift,
+                       accuracy=float(np.mean(correct)), float_accuracy=float(np.mean(float_correct)),
+                       flips=int(np.count_nonzero(prediction != float_predictions)),
+                       lost=int(np.count_nonzero(float_correct & ~correct)),
+                       gained=int(np.count_nonzero(~float_correct & correct)),
+                       flash=int(quantization.flash_bytes(network)))
+            rows.append(row)
+    return rows
+
+
+def format_report(rows, top=None):
+    """Table of the configurations, most accurate first (fewer flips break ties)."""
+    rows = sorted(rows, key=lambda row: (-row["accuracy"], row["flips"]))[:top]
+    lines = ["weights  rounding  offsets l1w/l1b/l2w/l2b  shifts  accuracy  flips  lost  gained  flash [B]"]
+    for row in rows:
+        lines.append("{:3d}-bit  {:8}  {:+3d} {:+3d} {:+3d} {:+3d}          {:3d} {:3d}  {:7.2f}%  {:5d}  {:4d}  {:6d}"
+                     "  {:9d}".format(row["weight_bits"], row["rounding"], row["l1w"], row["l1b"], row["l2w"],
+                                      row["l2b"], row["l1_shift"], row["l2_shift"], row["accuracy"] * 100,
+                                      row["flips"], row["lost"], row["gained"], row["flash"]))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate a grid of quantization configurations in one pass")
+    parser.add_argument("--model", default="trained_models/small_mnist_model.h5")
+    parser.add_argument("--dataset", default="mnist_small.h5")
+    parser.add_argument("--split", default="test")
+    parser.add_argument("--weight-bits", nargs="+", type=int, default=[8], choices=quantization.WEIGHT_BITS)
+    parser.add_argument("--roundings", nargs="+", default=["nearest"], choices=sorted(quantization.ROUNDING))
+    parser.add_argument("--offsets", nargs="+", type=int, default=list(OFFSETS),
+                        help="offsets to the fractional bits of the weights")
+    parser.add_argument("--bias-offsets", nargs="+", type=int, default=None,
+                        help="offsets to the fractional bits of the biases (also change the shifts), default --offsets")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--output", help="write all results as JSON")
+    args = parser.parse_args()
+
+    test = data_cache.open_split(args.dataset, args.split)
+    float_weights = quantization.load_float_weights(args.model)
+    reference_logits = cached_float_logits(args.model, args.dataset, args.split)
+
+    configs = config_grid(args.weight_bits, args.roundings, args.offsets, args.bias_offsets)
+    rows = sweep(float_weights, test.flat(), test.labels, reference_logits, configs, batch_size=args.batch_size)
+    if not rows:
+        parser.error("all configurations have negative layer shifts")
+    print("{} configurations on {} images ({} with negative shifts dropped), float model: {:.2f}%".format(
+        len(rows), len(test), len(configs) - len(rows), rows[0]["float_accuracy"] * 100))
+    print(format_report(rows, args.top))
+
+    best = max(rows, key=lambda row: (row["accuracy"], -row["flips"]))
+    print("Best configuration, set in 04_quantize_model.py:")
+    print("    weight_bits = {}\n    rounding = \"{}\"\n    bit_offsets = ({}, {}, {}, {})".format(
+        best["weight_bits"], best["rounding"], best["l1w"], best["l1b"], best["l2w"], best["l2b"]))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(rows, file, indent=2)
@@ -0,0 +1,379 @@
+################################################################################
+# File:     serial_protocol.py
+# Author:   Richard Freitag
+# Email:    richard.freitag@uadm.uu.se
+# Created:  18.10.2026
+#
+# Revisions: 18.10.2026 - pipelined mode
+#            18.10.2026 - response timeouts
+#            18.10.2026 - timing records of firmware built with TIMING
+#            18.10.2026 - sparse mode (nonzero pixels as index/value pairs)
+#            18.10.2026 - bits mode (binarized images, 1 bit per pixel)
+#
+# Description: Host side of the serial protocol spoken by "mnist_on_arduino.ino".
+#
+#              ASCII mode (default after reset, backwards compatible):
+#                  host:    S<p0>, <p1>, ... <p195>, E
+#                  arduino: RESULT\n<digit>\n
+#
+#              Binary mode:
+#                  host:    0xA5 <length> <length raw uint8 pixels> <checksum>
+#                  arduino: one byte 0xD0 | <digit>   (or an error byte 0xE?)
+#                  The checksum is the sum of the length byte and all pixels
+#                  modulo 256.
+#
+#              Pipelined mode (binary frames tagged with a sequence number):
+#                  host:    0xA5 <seq> <length> <pixels> <checksum>
+#                  arduino: 0xD0 | <digit>, <seq>   (or an error byte, <seq>)
+#                  The checksum additionally includes the sequence number.
+#                  Up to PIPELINE_BUFFERS images can be in flight, the
+#                  arduino receives the next image while computing one.
+#
+#              Sparse mode (pipelined mode with an additional sparse frame):
+#                  host:    0xA6 <seq> <count> <index> <value> ... <checksum>
+#                  arduino: like pipelined mode
+#                  Only the count nonzero pixels are sent as (index, value)
+#                  pairs with strictly increasing indices, all other pixels
+#                  are 0. The checksum is the sum of the sequence number, the
+#                  count and all pairs. The host sends every image in the
+#                  shorter of the two frames (encode_smallest()).
+#
+#              Bits mode (pipelined mode with an additional bit frame, only
+#              firmware of a network with binarized input):
+#                  host:    0xA7 <seq> <length> <packed bits> <checksum>
+#                  arduino: like pipelined mode
+#                  Pixel j is bit j % 8 (least significant first) of byte
+#                  j // 8, a pixel is set if it is >= the threshold of the
+#                  network (25 bytes for 196 pixels). The checksum is built
+#                  like in pipelined mode. The arduino reports the threshold
+#                  in the mode acknowledgement ("<Mode T 128>").
+#
+#              The mode is negotiated after the "<Arduino is ready>" banner:
+#              the host sends "M" followed by the mode character ("A", "B",
+#              "P", "Z" or "T") and the arduino acknowledges with "<Mode X>"
+#              of the mode that is active afterwards. Unsupported modes fall back to the
+#              next simpler one, old firmware does not answer at all and the
+#              host stays in ASCII mode.
+#
+#              Firmware built with TIMING follows every result with a timing
+#              record (see "board_timing.py"):
+#                  binary modes: 0xB7 <len(TIMING_FIELDS) little endian uint16>
+#                  ASCII mode:   TIMING <v0>, <v1>, ...\n
+#              The read functions below skip these records.
+#
+################################################################################
+
+
+import re
+import time
+
+import numpy as np
+
+from fixedpoint import BINARY_THRESHOLD
+
+READY_BANNER = "Arduino is ready"
+
+# ASCII framing
+START_MARKER = b"S"
+END_MARKER = b"E"
+RESULT_LINE = "RESULT"
+
+# mode negotiation
+MODE_MARKER = b"M"
+ASCII_MODE = "A"
+BINARY_MODE = "B"
+PIPELINED_MODE = "P"
+SPARSE_MODE = "Z"
+BITS_MODE = "T"
+PROTOCOLS = {"ascii": ASCII_MODE, "binary": BINARY_MODE, "pipelined": PIPELINED_MODE, "sparse": SPARSE_MODE,
+             "bits": BITS_MODE}
+FALLBACKS = {"bits": "pipelined", "sparse": "pipelined", "pipelined": "binary", "binary": "ascii"}
+# acknowledgement of the active mode, bits mode adds the threshold: "<Mode T 128>"
+MODE_ACK = re.compile(r"<Mode (\w)(?: (\d+))?>")
+
+# protocols whose frames and results carry sequence numbers
+TAGGED_PROTOCOLS = ("pipelined", "sparse", "bits")
+
+# number of image buffers of the firmware = maximum images in flight
+PIPELINE_BUFFERS = 2
+
+# binary framing
+FRAME_START = 0xA5
+SPARSE_FRAME_START = 0xA6
+BITS_FRAME_START = 0xA7
+RESULT_FRAME = 0xD0
+ERROR_CHECKSUM = 0xE1
+ERROR_LENGTH = 0xE2
+
+# timing records (firmware built with TIMING): durations in microseconds and free SRAM in bytes
+TIMING_FRAME = 0xB7
+TIMING_LINE = "TIMING"
+TIMING_FIELDS = ("receive", "parse", "wait", "layer1", "layer2", "poll", "send", "free_sram")
+TIMING_SIZE = 2 * len(TIMING_FIELDS)
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class ResponseTimeout(ProtocolError):
+    pass
+
+
+def _deadline(timeout):
+    return None if timeout is None else time.time() + timeout
+
+
+def _check(deadline):
+    if deadline is not None and time.time() > deadline:
+        raise ResponseTimeout("no response from arduino")
+
+
+def reset_arduino(arduino, timeout=10):
+    """Reset the arduino via DTR and wait for the ready banner."""
+    try:
+        arduino.setDTR(False)
+        time.sleep(1)
+        arduino.setDTR(True)
+    except OSError:
+        # ports without modem lines (e.g. pseudo terminals) reset on open
+        pass
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        line = arduino.readline()
+        if READY_BANNER in line.decode(errors="ignore"):
+            return
+    raise ProtocolError("arduino did not send the ready banner within {} s".format(timeout))
+
+
+def _read_mode_ack(arduino, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        match = MODE_ACK.search(arduino.readline().decode(errors="ignore"))
+        for protocol, mode in PROTOCOLS.items():
+            if match and match.group(1) == mode:
+                return protocol, None if match.group(2) is None else int(match.group(2))
+    return None, None
+
+
+def negotiate(arduino, protocol="binary", timeout=0.5):
+    """Ask the arduino to switch to the given protocol (one of PROTOCOLS).
+
+    Returns the protocol that is actually used and, in bits mode, the
+    threshold the firmware binarizes with (None otherwise). If the firmware
+    does not support the requested protocol the next simpler one is tried,
+    firmware without mode selection does not acknowledge at all and "ascii"
+    is returned.
+    """
+    while True:
+        arduino.write(MODE_MARKER + PROTOCOLS[protocol].encode())
+        active, threshold = _read_mode_ack(arduino, timeout)
+        if active is None:
+            return "ascii", None
+        if active == protocol or protocol not in FALLBACKS:
+            if active == "bits" and threshold is None:
+                raise ProtocolError("arduino did not report the threshold of bits mode")
+            return active, threshold
+        protocol = FALLBACKS[protocol]
+
+
+def negotiate_mode(arduino, protocol="binary", timeout=0.5):
+    """Like negotiate(), returns only the protocol that is actually used."""
+    return negotiate(arduino, protocol, timeout)[0]
+
+
+def check_threshold(threshold, expected):
+    """Raise a ProtocolError if the firmware's bits mode threshold is not the expected one of the model."""
+    if expected is not None and threshold is not None and threshold != expected:
+        raise ProtocolError("firmware binarizes at {}, the model at {}".format(threshold, expected))
+
+
+def checksum(payload):
+    return (len(payload) + sum(payload)) & 0xFF
+
+
+def encode_ascii(image):
+    """Encode a flattened uint8 image as one ASCII frame."""
+    pixels = np.asarray(image, dtype=np.uint8).ravel()
+    return START_MARKER + "".join("{}, ".format(num) for num in pixels).encode() + END_MARKER
+
+
+def encode_binary(image):
+    """Encode a flattened uint8 image as one binary frame."""
+    payload = np.asarray(image, dtype=np.uint8).ravel().tobytes()
+    if len(payload) > 255:
+        raise ValueError("binary frames hold at most 255 pixels, got {}".format(len(payload)))
+    return bytes((FRAME_START, len(payload))) + payload + bytes((checksum(payload),))
+
+
+def encode_pipelined(image, seq):
+    """Encode a flattened uint8 image as one binary frame tagged with seq (0..255)."""
+    payload = np.asarray(image, dtype=np.uint8).ravel().tobytes()
+    if len(payload) > 255:
+        raise ValueError("binary frames hold at most 255 pixels, got {}".format(len(payload)))
+    return bytes((FRAME_START, seq, len(payload))) + payload + bytes(((seq + checksum(payload)) & 0xFF,))
+
+
+def encode_sparse(image, seq):
+    """Encode the nonzero pixels of a flattened uint8 image as one sparse frame tagged with seq (0..255)."""
+    pixels = np.asarray(image, dtype=np.uint8).ravel()
+    if len(pixels) > 256:
+        raise ValueError("sparse frames address at most 256 pixels, got {}".format(len(pixels)))
+    indices = np.flatnonzero(pixels)
+    if len(indices) > 255:
+        raise ValueError("sparse frames hold at most 255 pixels, got {}".format(len(indices)))
+    payload = np.column_stack((indices, pixels[indices])).astype(np.uint8).tobytes()
+    return (bytes((SPARSE_FRAME_START, seq, len(indices))) + payload
+            + bytes(((seq + len(indices) + sum(payload)) & 0xFF,)))
+
+
+def encode_smallest(image, seq):
+    """Encode an image as sparse or pipelined frame tagged with seq, whichever is shorter."""
+    pixels = np.asarray(image, dtype=np.uint8).ravel()
+    if 2 * np.count_nonzero(pixels) < len(pixels):
+        return encode_sparse(pixels, seq)
+    return encode_pipelined(pixels, seq)
+
+
+def encode_bits(image, seq, threshold=BINARY_THRESHOLD):
+    """Encode a flattened uint8 image as one bit frame tagged with seq (0..255), pixels >= threshold are set."""
+    pixels = np.asarray(image, dtype=np.uint8).ravel()
+    payload = np.packbits(pixels >= threshold, bitorder="little").tobytes()
+    return bytes((BITS_FRAME_START, seq, len(payload))) + payload + bytes(((seq + checksum(payload)) & 0xFF,))
+
+
+def decode_result_byte(value):
+    """Decode one binary result frame into the predicted digit."""
+    if value & 0xF0 == RESULT_FRAME:
+        return value & 0x0F
+    if value == ERROR_CHECKSUM:
+        raise ProtocolError("arduino reported a checksum error")
+    if value == ERROR_LENGTH:
+        raise ProtocolError("arduino reported a wrong image length")
+    raise ProtocolError("unexpected result frame 0x{:02X}".format(value))
+
+
+def decode_timing(payload):
+    """Decode the payload of a binary timing record into a dict of TIMING_FIELDS."""
+    values = np.frombuffer(bytes(payload), dtype="<u2", count=len(TIMING_FIELDS))
+    return dict(zip(TIMING_FIELDS, values.tolist()))
+
+
+def parse_timing_line(line):
+    """Decode an ASCII timing record, returns None for other lines."""
+    if not line.startswith(TIMING_LINE):
+        return None
+    values = [int(value) for value in line[len(TIMING_LINE):].split(",")]
+    return dict(zip(TIMING_FIELDS, values))
+
+
+def _read_exactly(arduino, size, deadline):
+    data = b""
+    while len(data) < size:
+        _check(deadline)
+        data += arduino.read(size - len(data))
+    return data
+
+
+# the read functions wait forever by default, with a timeout (in seconds) a
+# ResponseTimeout is raised if the arduino does not answer in time
+
+def read_line(arduino, timeout=None, deadline=None):
+    """Read one complete line, readline() returns partial lines on timeouts."""
+    deadline = deadline or _deadline(timeout)
+    line = arduino.readline()
+    while not line.endswith(b"\n"):
+        _check(deadline)
+        line += arduino.readline()
+    return line.decode(errors="ignore")
+
+
+def read_result_ascii(arduino, timeout=None):
+    deadline = _deadline(timeout)
+    while RESULT_LINE not in read_line(arduino, deadline=deadline):
+        _check(deadline)
+    return int(read_line(arduino, deadline=deadline))
+
+
+def read_result_binary(arduino, timeout=None):
+    deadline = _deadline(timeout)
+    while True:
+        data = arduino.read(1)
+        if data and data[0] == TIMING_FRAME:
+            _read_exactly(arduino, TIMING_SIZE, deadline)
+        elif data:
+            return decode_result_byte(data[0])
+        _check(deadline)
+
+
+def read_result_pipelined(arduino, timeout=None):
+    """Read one tagged result frame and return (seq, digit).
+
+    Error frames raise a ProtocolError carrying the sequence number as .seq
+    """
+    deadline = _deadline(timeout)
+    data = _read_exactly(arduino, 1, deadline)
+    while data[0] == TIMING_FRAME:
+        _read_exactly(arduino, TIMING_SIZE, deadline)
+        data = _read_exactly(arduino, 1, deadline)
+    data += _read_exactly(arduino, 1, deadline)
+    try:
+        return data[1], decode_result_byte(data[0])
+    except ProtocolError as error:
+        error.seq = data[1]
+        raise
+
+
+ENCODERS = {"ascii": encode_ascii, "binary": encode_binary}
+READERS = {"ascii": read_result_ascii, "binary": read_result_binary}
+# encoders of the tagged protocols: (image, seq) --> frame
+TAGGED_ENCODERS = {"pipelined": encode_pipelined, "sparse": encode_smallest, "bits": encode_bits}
+
+
+def tagged_encoder(protocol, threshold=None):
+    """Encoder (image, seq) --> frame of a tagged protocol, bit frames are binarized at threshold."""
+    if protocol == "bits" and threshold is not None:
+        return lambda image, seq: encode_bits(image, seq, threshold)
+    return TAGGED_ENCODERS[protocol]
+
+
+def predict(arduino, image, protocol="binary", timeout=None):
+    """Send one image with a single write and return the arduino's prediction."""
+    arduino.write(ENCODERS[protocol](image))
+    return READERS[protocol](arduino, timeout)
+
+
+def predict_pipelined(arduino, images, window=PIPELINE_BUFFERS, timeout=None, protocol="pipelined",
+                      threshold=None):
+    """Classify a batch of images with up to window images in flight.
+
+    Results are matched to the images by their sequence numbers, the
+    predictions are returned in the order of the images. The firmware holds
+    PIPELINE_BUFFERS images (IMAGE_BUFFERS of the firmware), a larger window
+    would overrun its buffers. protocol is one of TAGGED_PROTOCOLS, in bits
+    mode the images are binarized at threshold (the one negotiate() returned,
+    default BINARY_THRESHOLD).
+    """
+    encode = tagged_encoder(protocol, threshold)
+    if not 1 <= window <= PIPELINE_BUFFERS:
+        raise ValueError("window must be between 1 and {}, got {}".format(PIPELINE_BUFFERS, window))
+
+    predictions = np.zeros(len(images), dtype=np.int8)
+    in_flight = {}      # sequence number --> image index
+    next_idx = 0
+
+    while next_idx < len(images) or in_flight:
+        # fill the window
+        while next_idx < len(images) and len(in_flight) < window:
+            seq = next_idx & 0xFF
+            arduino.write(encode(images[next_idx], seq))
+            in_flight[seq] = next_idx
+            next_idx += 1
+
+        seq, digit = read_result_pipelined(arduino, timeout)
+        if seq not in in_flight:
+            raise ProtocolError("result for unknown sequence number {}".format(seq))
+        predictions[in_flight.pop(seq)] = digit
+
+    return predictions
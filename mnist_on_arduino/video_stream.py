@@ -0,0 +1,281 @@
+################################################################################
+# File:     video_stream.py
+# Author:   Richard Freitag
+# Email:    richard.freitag@uadm.uu.se
+# Created:  18.10.2026
+#
+# Revisions: ---
+#
+# Description: Continuous classification of the frames of a camera or a
+#              recorded video file (cv2.VideoCapture) on the arduino.
+#              The frames pass three pipeline stages connected by bounded
+#              queues:
+#                  capture thread:    reads the frames (video files are played
+#                                     at their frame rate like a camera)
+#                  preprocess thread: resize, bad pixel fix, edge filter and
+#                                     invert like "08_classify_from_photos.py"
+#                                     (see photo_pipeline.process_frame())
+#                  classification:    sends the images with ArduinoClient as
+#                                     soon as the arduino has a free buffer
+#              If a stage is slower than the one before, the oldest waiting
+#              frame is dropped instead of queueing it, so the latency does
+#              not grow. The sustained rate of classified frames and the
+#              latency from capture to result are reported.
+#
+#              Usage: python video_stream.py --source 0 --port /dev/ttyACM0
+#                     python video_stream.py --source digits.avi --sim
+#
+################################################################################
+
+
+import argparse
+import queue
+import threading
+import time
+from functools import partial
+
+import cv2
+import numpy as np
+
+import photo_pipeline
+import serial_protocol as sp
+
+# frames waiting in front of a stage: only the newest one is kept by default
+QUEUE_SIZE = 1
+
+# marks the end of the stream in the queues
+END = None
+
+
+def open_source(source):
+    """cv2.VideoCapture of a camera index ("0") or a video file."""
+    capture = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+    if not capture.isOpened():
+        raise OSError("cannot open video source {}".format(source))
+    return capture
+
+
+def put_latest(frames, item):
+    """Put item into a bounded queue, dropping the oldest items if it is full, returns the number dropped."""
+    dropped = 0
+    while True:
+        try:
+            frames.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                frames.get_nowait()
+                dropped += 1
+            except queue.Empty:
+                pass
+
+
+class VideoClassifier:
+    """Capture --> preprocess --> classify pipeline for one video source and an open ArduinoClient.
+
+    on_result is called with (frame index, digit, latency in seconds, image)
+    from the client's reader thread.
+    """
+
+    def __init__(self, client, source, size=14, interpolation="nearest", high_val=180, queue_size=QUEUE_SIZE,
+                 realtime=None, on_result=None):
+        self.client = client
+        self.source = source
+        self.size = size
+        self.interpolation = interpolation
+        self.high_val = high_val
+        self.queue_size = queue_size
+        self.realtime = realtime      # play video files at their frame rate (None: files yes, cameras no)
+        self.on_result = on_result
+
+        self.captured = 0
+        self.dropped_frames = 0       # replaced in front of the preprocessing
+        self.dropped_images = 0       # replaced in front of the classification
+        self.classified = 0
+        self.errors = 0
+        self.latencies = []
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._start = None
+        self._end = None
+
+    def stop(self):
+        """Stop capturing, the frames in the pipeline are still classified."""
+        self._stop.set()
+
+    def run(self, max_frames=None, duration=None):
+        """Classify frames until the source ends, max_frames were captured or duration seconds passed.
+
+        Returns summary().
+        """
+        capture = open_source(self.source)
+        frames = queue.Queue(self.queue_size)
+        images = queue.Queue(self.queue_size)
+
+        self._start = time.monotonic()
+        deadline = None if duration is None else self._start + duration
+        threads = [threading.Thread(target=self._capture, args=(capture, frames, max_frames, deadline), daemon=True),
+                   threading.Thread(target=self._preprocess, args=(frames, images), daemon=True)]
+        for thread in threads:
+            thread.start()
+        self._classify(images)
+        for thread in threads:
+            thread.join()
+        self._end = time.monotonic()
+        return self.summary()
+
+    ############################################################################
+    # stages
+
+    def _capture(self, capture, frames, max_frames, deadline):
+        realtime = self.realtime if self.realtime is not None else not str(self.source).isdigit()
+        fps = capture.get(cv2.CAP_PROP_FPS) if realtime else 0
+        interval = 1 / fps if fps > 0 else 0
+        next_frame = time.monotonic()
+        try:
+            while not self._stop.is_set() and (max_frames is None or self.captured < max_frames):
+                if deadline is not None and time.monotonic() > deadline:
+                    break
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                self.dropped_frames += put_latest(frames, (self.captured, time.monotonic(), frame))
+                self.captured += 1
+                if interval:
+                    next_frame += interval
+                    time.sleep(max(0.0, next_frame - time.monotonic()))
+        finally:
+            capture.release()
+            frames.put(END)
+
+    def _preprocess(self, frames, images):
+        while True:
+            item = frames.get()
+            if item is END:
+                images.put(END)
+                return
+            index, captured, frame = item
+            image = photo_pipeline.process_frame(frame, self.size, self.interpolation, self.high_val)
+            self.dropped_images += put_latest(images, (index, captured, image))
+
+    def _classify(self, images):
+        # one slot per image buffer of the arduino: while all are busy newer frames replace the waiting ones
+        capacity = self.client.capacity
+        slots = threading.Semaphore(capacity)
+        while True:
+            slots.acquire()
+            item = images.get()
+            if item is END:
+                slots.release()
+                break
+            index, captured, image = item
+            future = self.client.predict(image.reshape(-1))
+            future.add_done_callback(partial(self._done, index, captured, image, slots))
+
+        # wait for the images in flight
+        for _ in range(capacity):
+            slots.acquire()
+
+    def _done(self, index, captured, image, slots, future):
+        latency = time.monotonic() - captured
+        slots.release()
+        try:
+            digit = future.result()
+        except sp.ProtocolError:
+            with self._lock:
+                self.errors += 1
+            return
+        with self._lock:
+            self.classified += 1
+            self.latencies.append(latency)
+        if self.on_result is not None:
+            self.on_result(index, digit, latency, image)
+
+    ############################################################################
+    # report
+
+    def summary(self):
+        """Frame counts, sustained rates and latency statistics (milliseconds)."""
+        elapsed = (self._end or time.monotonic()) - self._start
+        result = {"captured": self.captured, "dropped": self.dropped_frames + self.dropped_images,
+                  "classified": self.classified, "errors": self.errors, "seconds": elapsed,
+                  "capture_fps": self.captured / elapsed, "fps": self.classified / elapsed}
+        with self._lock:
+            latencies = np.array(self.latencies) * 1000
+        if len(latencies):
+            result["latency_ms"] = {"mean": float(latencies.mean()), "p50": float(np.percentile(latencies, 50)),
+                                    "p95": float(np.percentile(latencies, 95)), "max": float(latencies.max())}
+        return result
+
+
+def format_summary(summary):
+    lines = ["{captured} frames captured, {dropped} dropped, {classified} classified, {errors} errors "
+             "in {seconds:.1f} s".format(**summary),
+             "Sustained rate: {fps:.1f} fps classified ({capture_fps:.1f} fps captured)".format(**summary)]
+    if "latency_ms" in summary:
+        lines.append("Latency frame --> result: mean {mean:.1f} ms, p50 {p50:.1f} ms, p95 {p95:.1f} ms, "
+                     "max {max:.1f} ms".format(**summary["latency_ms"]))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify the frames of a camera or video file on the arduino")
+    parser.add_argument("--source", default="0", help="camera index or video file")
+    parser.add_argument("--port", help="serial port of the arduino")
+    parser.add_argument("--sim", action="store_true", help="use a virtual arduino instead of --port")
+    parser.add_argument("--sim-compute-delay", type=float, default=0.004)
+    parser.add_argument("--model", default="trained_models/fixedpoint_mnist_model.h5")
+    parser.add_argument("--check", action="store_true", help="compare every result with the fixed point model")
+    parser.add_argument("--protocol", default="pipelined", choices=sorted(sp.PROTOCOLS))
+    parser.add_argument("--high-val", type=int, default=180)
+    parser.add_argument("--interpolation", default="nearest", choices=sorted(photo_pipeline.INTERPOLATIONS))
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE)
+    parser.add_argument("--no-realtime", action="store_true", help="read video files as fast as possible")
+    parser.add_argument("--max-frames", type=int, default=None)
+    parser.add_argument("--duration", type=float, default=None, help="stop after this many seconds")
+    parser.add_argument("--verbose", action="store_true", help="print every result")
+    args = parser.parse_args()
+
+    from arduino_client import ArduinoClient
+
+    network = None
+    if args.sim or args.check:
+        from fixedpoint import FixedPointNetwork
+        network = FixedPointNetwork.load(args.model)
+
+    mismatches = []
+
+    def on_result(index, digit, latency, image):
+        if args.verbose:
+            print("Frame {:5d}: {} ({:.1f} ms)".format(index, digit, latency * 1000))
+        if args.check and network.predict(image[None])[0] != digit:
+            mismatches.append(index)
+
+    device = None
+    port = args.port
+    if args.sim:
+        from virtual_arduino import VirtualArduino
+        device = VirtualArduino(network, compute_delay=args.sim_compute_delay)
+        device.start()
+        port = device.port
+    elif port is None:
+        parser.error("--port or --sim is required")
+
+    try:
+        with ArduinoClient(port, protocol=args.protocol) as arduino:
+            print("Protocol:", arduino.protocol)
+            streamer = VideoClassifier(arduino, args.source, 14, args.interpolation, args.high_val, args.queue_size,
+                                       False if args.no_realtime else None, on_result)
+            try:
+                summary = streamer.run(args.max_frames, args.duration)
+            except KeyboardInterrupt:
+                streamer.stop()
+                summary = streamer.summary()
+    finally:
+        if device is not None:
+            device.stop()
+
+    print(format_summary(summary))
+    if args.check:
+        print("{} results differ from the fixed point model".format(len(mismatches)))
@@ -0,0 +1,432 @@
+################################################################################
+# File:     virtual_arduino.py
+# Author:   Richard Freitag
+# Email:    richard.freitag@uadm.uu.se
+# Created:  18.10.2026
+#
+# Revisions: 18.10.2026 - reset() to simulate the reset button
+#            18.10.2026 - timing records like firmware built with TIMING
+#            18.10.2026 - sparse mode
+#            18.10.2026 - bits mode (networks with binarized input)
+#            18.10.2026 - 64 byte serial receive buffer with overruns
+#
+# Description: Virtual Arduino which emulates "mnist_on_arduino.ino" on a
+#              pseudo terminal, so the host scripts can be run and
+#              benchmarked without hardware (Linux/Mac only).
+#
+#              The emulator speaks the same serial protocol as the firmware
+#              (ready banner, mode selection, ASCII, binary, pipelined, sparse
+#              and bit frames, see "serial_protocol.py") and computes the results
+#              with the bit-exact fixed point network from "fixedpoint.py".
+#              Like an Arduino Uno it resets when the port is opened (the
+#              DTR line of the real board is toggled on open, pseudo
+#              terminals have no modem lines) and sends the banner after a
+#              boot delay.
+#
+#              Timing model: every byte takes 10 bits at the baud rate plus
+#              a configurable per-byte latency on the wire (both directions),
+#              every inference takes a configurable compute delay. Like the
+#              firmware, the next image is received while one is computed as
+#              long as a free image buffer is available.
+#              The bytes arrive in a receive buffer of SERIAL_RX_BUFFER_SIZE
+#              bytes like the hardware serial port of the Uno. During an
+#              inference the buffer is only read at the polls of the firmware,
+#              evenly spread over the layers (one per layer 1 and layer 2
+#              output, the compute delay is split between the layers by their
+#              MACs). Bytes arriving at a full buffer are lost (counted in
+#              .overruns), the frame is then broken and the host has to
+#              resynchronize like with the real board.
+#              With timing=True every result is followed by a timing record
+#              like the firmware built with TIMING sends, the durations are
+#              taken from the virtual clock (the compute delay is split
+#              between the layers by their MACs, free SRAM is not emulated).
+#
+#              Usage: python virtual_arduino.py [--baudrate 1000000] ...
+#              prints the port name to open instead of e.g. /dev/ttyACM0
+#
+################################################################################
+
+
+import argparse
+import collections
+import errno
+import heapq
+import os
+import select
+import threading
+import time
+import tty
+
+import numpy as np
+
+import serial_protocol as sp
+from fixedpoint import FixedPointNetwork
+
+BUFFERSIZE = 8
+IMAGE_BUFFERS = 2
+
+# hardware serial receive buffer of the arduino uno (bytes)
+SERIAL_RX_BUFFER_SIZE = 64
+
+# modes whose results carry sequence numbers
+TAGGED_MODES = tuple(sp.PROTOCOLS[name] for name in sp.TAGGED_PROTOCOLS)
+
+
+def atoi(chars):
+    """C atoi(): optional leading whitespace and sign, then digits up to the first other character."""
+    text = chars.lstrip(" \t\n\r")
+    sign = 1
+    if text[:1] in ("-", "+"):
+        sign = -1 if text[0] == "-" else 1
+        text = text[1:]
+    digits = ""
+    for char in text:
+        if not char.isdigit():
+            break
+        digits += char
+    return sign * int(digits) if digits else 0
+
+
+class FirmwareEmulator:
+    """Protocol state machine of mnist_on_arduino.ino with a virtual clock.
+
+    feed() takes the received bytes together with the time they arrived at
+    the emulator and returns a list of (time, bytes) responses, the time
+    being the moment the last byte of the response has left the "board".
+    """
+
+    def __init__(self, network, baudrate=1000000, byte_latency=0.0, compute_delay=0.0,
+                 image_buffers=IMAGE_BUFFERS, timing=False, rx_buffer_size=SERIAL_RX_BUFFER_SIZE):
+        self.network = network
+        self.timing = timing
+        self.byte_time = 10.0 / baudrate + byte_latency
+        self.compute_delay = compute_delay
+        self.image_buffers = image_buffers
+        self.rx_buffer_size = rx_buffer_size
+        l1_macs = network.l1_weights.size
+        self.l1_share = l1_macs / (l1_macs + network.l2_weights.size)   # share of layer 1 in the compute delay
+        self.inferences = 0
+        self.overruns = 0               # bytes lost because the receive buffer was full
+        self.reset(0.0)
+
+    def reset(self, now):
+        self.mode = sp.ASCII_MODE
+        self.rx_time = now              # arrival time of the last received byte
+        self.tx_time = now              # time the serial transmitter becomes idle
+        self.compute_time = now         # time the cpu finishes the last queued inference
+        self.rx_start = now             # arrival time of the first byte of the current frame
+        self.busy_until = []            # times the occupied image buffers are freed again
+        self.wire_time = now            # arrival time of the last byte on the wire
+        self.rx_pending = collections.deque()   # read times of the bytes in the receive buffer
+        self.computing = collections.deque()    # (start, end) of the queued inferences
+        self._new_frame()
+        self._ascii_state = "idle"
+        self._binary_state = "idle"
+
+    def _new_frame(self):
+        self.pixels = []
+        self.buffer = ""
+        self.seq = 0
+        self.length = 0
+        self.checksum = 0
+        self.frame = sp.FRAME_START
+        self.index = None
+        self.pairs = 0
+        self.bad_index = False
+
+    def _send(self, data, ready):
+        self.tx_time = max(self.tx_time, ready) + len(data) * self.byte_time
+        return (self.tx_time, data)
+
+    def _select_mode(self, char):
+        # like the firmware, bits mode is only supported by networks with binarized input
+        if char in (sp.ASCII_MODE, sp.BINARY_MODE, sp.PIPELINED_MODE, sp.SPARSE_MODE) or \
+                (char == sp.BITS_MODE and getattr(self.network, "input_threshold", 0)):
+            self.mode = char
+        if self.mode == sp.BITS_MODE:
+            return self._send("<Mode {} {}>\r\n".format(self.mode, self.network.input_threshold).encode(),
+                              self.rx_time)
+        return self._send("<Mode {}>\r\n".format(self.mode).encode(), self.rx_time)
+
+    def _image_complete(self):
+        pixels = np.zeros(self.network.img_size, dtype=np.uint8)
+        pixels[:min(len(self.pixels), len(pixels))] = self.pixels[:len(pixels)]
+        digit = int(self.network.predict(pixels[np.newaxis])[0])
+        self.inferences += 1
+
+        start = max(self.rx_time, self.compute_time)
+        self.compute_time = start + self.compute_delay
+        heapq.heappush(self.busy_until, self.compute_time)
+        self.computing.append((start, self.compute_time))
+
+        if self.mode in TAGGED_MODES:
+            data = bytes((sp.RESULT_FRAME | digit, self.seq))
+        elif self.mode == sp.BINARY_MODE:
+            data = bytes((sp.RESULT_FRAME | digit,))
+        else:
+            data = "RESULT\r\n{}\r\n".format(digit).encode()
+        if self.timing:
+            data += self._timing_record(start)
+        return self._send(data, self.compute_time)
+
+    def _timing_record(self, start):
+        durations = {"receive": self.rx_time - self.rx_start, "parse": 0.0, "wait": start - self.rx_time,
+                     "layer1": self.compute_delay * self.l1_share,
+                     "layer2": self.compute_delay * (1 - self.l1_share),
+                     "poll": 0.0, "send": 0.0}
+        values = [min(int(round(durations.get(field, 0.0) * 1e6)), 0xFFFF) for field in sp.TIMING_FIELDS]
+        if self.mode == sp.ASCII_MODE:
+            return "{} {}\r\n".format(sp.TIMING_LINE, ", ".join(str(value) for value in values)).encode()
+        return bytes((sp.TIMING_FRAME,)) + np.array(values, dtype="<u2").tobytes()
+
+    def _error(self, error):
+        data = bytes((error, self.seq)) if self.mode in TAGGED_MODES else bytes((error,))
+        return self._send(data, self.rx_time)
+
+    def _next_poll(self, when):
+        """Time the firmware reads a byte which arrived at when (at the next poll during an inference)."""
+        while self.computing and self.computing[0][1] <= when:
+            self.computing.popleft()
+        if not self.computing or when < self.computing[0][0]:
+            return when
+        start, end = self.computing[0]
+        layer1 = (end - start) * self.l1_share
+        if when - start < layer1:
+            interval = layer1 / self.network.l1_size
+            return start + (int((when - start) / interval) + 1) * interval
+        interval = (end - start - layer1) / self.network.l2_size
+        return min(start + layer1 + (int((when - start - layer1) / interval) + 1) * interval, end)
+
+    def _receive(self, now):
+        """Move one byte arriving at now through the receive buffer, returns False if it is lost."""
+        self.wire_time = max(self.wire_time + self.byte_time, now)
+        while self.rx_pending and self.rx_pending[0] <= self.wire_time:
+            self.rx_pending.popleft()
+        if len(self.rx_pending) >= self.rx_buffer_size:
+            self.overruns += 1
+            return False
+
+        # the firmware only reads from the serial port if a free image buffer is available
+        read = max(self._next_poll(self.wire_time), self.rx_time)
+        while self.busy_until and self.busy_until[0] <= read:
+            heapq.heappop(self.busy_until)
+        if len(self.busy_until) >= self.image_buffers:
+            read = self._next_poll(heapq.heappop(self.busy_until))
+        self.rx_time = read
+        self.rx_pending.append(read)
+        return True
+
+    def feed(self, data, now):
+        responses = []
+        for value in data:
+            if not self._receive(now):
+                continue
+            if self.mode == sp.ASCII_MODE:
+                response = self._feed_ascii(chr(value))
+            else:
+                response = self._feed_binary(value)
+            if response is not None:
+                responses.append(response)
+        return responses
+
+    def _feed_ascii(self, char):
+        if self._ascii_state == "mode":
+            self._ascii_state = "idle"
+            return self._select_mode(char)
+        if self._ascii_state == "receive":
+            if char == sp.END_MARKER.decode():
+                self._parse_buffer()
+                self._ascii_state = "idle"
+                return self._image_complete()
+            if char == ",":
+                self._parse_buffer()
+            elif len(self.buffer) < BUFFERSIZE:
+                self.buffer += char
+        elif char == sp.START_MARKER.decode():
+            self._new_frame()
+            self.rx_start = self.rx_time
+            self._ascii_state = "receive"
+        elif char == sp.MODE_MARKER.decode():
+            self._ascii_state = "mode"
+        return None
+
+    def _parse_buffer(self):
+        if len(self.pixels) < self.network.img_size:
+            self.pixels.append(atoi(self.buffer) & 0xFF)
+        self.buffer = ""
+
+    def _feed_binary(self, value):
+        state = self._binary_state
+        if state == "idle":
+            if value == sp.FRAME_START or (value, self.mode) in ((sp.SPARSE_FRAME_START, sp.SPARSE_MODE),
+                                                                 (sp.BITS_FRAME_START, sp.BITS_MODE)):
+                self._new_frame()
+                self.frame = value
+                self.rx_start = self.rx_time
+                self._binary_state = "length" if self.mode == sp.BINARY_MODE else "seq"
+            elif value == sp.MODE_MARKER[0]:
+                self._binary_state = "mode"
+        elif state == "mode":
+            self._binary_state = "idle"
+            return self._select_mode(chr(value))
+        elif state == "seq":
+            self.seq = value
+            self.checksum = value
+            self._binary_state = "length"
+        elif state == "length":
+            self.length = value
+            self.checksum = (self.checksum + value) & 0xFF
+            self._binary_state = "payload" if value > 0 else "checksum"
+        elif state == "payload":
+            self.checksum = (self.checksum + value) & 0xFF
+            if self.frame == sp.SPARSE_FRAME_START:
+                self._feed_pair(value)
+            else:
+                self.pixels.append(value)
+            if (self.pairs if self.frame == sp.SPARSE_FRAME_START else len(self.pixels)) == self.length:
+                self._binary_state = "checksum"
+        elif state == "checksum":
+            self._binary_state = "idle"
+            if self.frame == sp.SPARSE_FRAME_START:
+                bad_length = self.bad_index
+            elif self.frame == sp.BITS_FRAME_START:
+                bad_length = self.length != (self.network.img_size + 7) // 8
+            else:
+                bad_length = self.length != self.network.img_size
+            if bad_length:
+                return self._error(sp.ERROR_LENGTH)
+            if value != self.checksum:
+                return self._error(sp.ERROR_CHECKSUM)
+            if self.frame == sp.BITS_FRAME_START:
+                # set pixels are stored as 255 like in the firmware
+                bits = np.unpackbits(np.array(self.pixels, dtype=np.uint8), bitorder="little")
+                self.pixels = list(bits * 255)
+            return self._image_complete()
+        return None
+
+    def _feed_pair(self, value):
+        # sparse frame: index, then value, the skipped pixels are 0
+        if self.index is None:
+            self.index = value
+            return
+        if len(self.pixels) <= self.index < self.network.img_size:
+            self.pixels.extend([0] * (self.index - len(self.pixels)))
+            self.pixels.append(value)
+        else:
+            self.bad_index = True
+        self.index = None
+        self.pairs += 1
+
+
+class VirtualArduino:
+    """Pseudo terminal running a FirmwareEmulator in a background thread.
+
+    Use as a context manager, the name of the port to open is .port
+        with VirtualArduino(network) as device:
+            arduino = serial.Serial(device.port, 1000000, timeout=0.05)
+    """
+
+    def __init__(self, network, baudrate=1000000, byte_latency=0.0, compute_delay=0.0,
+                 boot_delay=0.1, image_buffers=IMAGE_BUFFERS, timing=False):
+        self.emulator = FirmwareEmulator(network, baudrate, byte_latency, compute_delay, image_buffers, timing)
+        self.boot_delay = boot_delay
+
+        self._master, slave = os.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        os.close(slave)
+
+        self._outgoing = []         # heap of (time, counter, bytes)
+        self._counter = 0
+        self._stop = threading.Event()
+        self._reset = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        os.close(self._master)
+
+    def reset(self):
+        """Reset the board like the reset button (pending images and results are lost)."""
+        self._reset.set()
+
+    def _schedule(self, responses):
+        for ready, data in responses:
+            heapq.heappush(self._outgoing, (ready, self._counter, data))
+            self._counter += 1
+
+    def _boot(self):
+        now = time.monotonic()
+        self._outgoing = []
+        self.emulator.reset(now + self.boot_delay)
+        self._schedule([self.emulator._send(b"<Arduino is ready>\r\n", now + self.boot_delay)])
+
+    def _run(self):
+        connected = False
+        while not self._stop.is_set():
+            timeout = 0.05
+            if self._outgoing:
+                timeout = min(timeout, max(0.0, self._outgoing[0][0] - time.monotonic()))
+
+            readable, _, _ = select.select([self._master], [], [], timeout)
+            data = b""
+            if readable:
+                try:
+                    data = os.read(self._master, 4096)
+                except OSError as error:
+                    if error.errno != errno.EIO:
+                        raise
+                    # no process has the port open
+                    connected = False
+                    time.sleep(0.01)
+                    continue
+
+            if not connected:
+                # port was opened --> reset like an arduino uno
+                connected = True
+                self._boot()
+            elif self._reset.is_set():
+                # reset button, the bytes arriving during the reset are lost
+                self._reset.clear()
+                self._boot()
+                data = b""
+            if data:
+                self._schedule(self.emulator.feed(data, time.monotonic()))
+
+            now = time.monotonic()
+            while self._outgoing and self._outgoing[0][0] <= now:
+                try:
+                    os.write(self._master, heapq.heappop(self._outgoing)[2])
+                except OSError:
+                    break
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Emulate mnist_on_arduino.ino on a pseudo terminal")
+    parser.add_argument("--model", default="trained_models/fixedpoint_mnist_model.h5")
+    parser.add_argument("--baudrate", type=int, default=1000000)
+    parser.add_argument("--byte-latency", type=float, default=0.0, help="additional seconds per byte")
+    parser.add_argument("--compute-delay", type=float, default=0.0, help="seconds per inference")
+    parser.add_argument("--boot-delay", type=float, default=0.1, help="seconds from reset to ready banner")
+    parser.add_argument("--timing", action="store_true", help="send timing records like firmware built with TIMING")
+    args = parser.parse_args()
+
+    with VirtualArduino(FixedPointNetwork.load(args.model), args.baudrate, args.byte_latency,
+                        args.compute_delay, args.boot_delay, timing=args.timing) as device:
+        print(device.port)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass